@@ -11,6 +11,103 @@ N_STORYBOARD_PROCESSES = 1
 
 MIN_SPEACH_DURATION = 2  # (in seconds) If the speech duration is less than this, the audio is not processed.
 MAX_CHUNK_DURATION = 10 * 60  # (in seconds) Maximum duration of a chunk that goes to Whisper model.
+STREAMING_CHUNK_DURATION = 60  # (in seconds) Speech chunk is sent to Whisper as soon as VAD has collected this much speech.
+
+FRAME_PLANNER_MIN_FRAMES = 4  # Minimum number of frames extracted when frames are planned by the image token budget.
+FRAME_PLANNER_MIN_SECONDS_PER_FRAME = 1.0  # (in seconds) Planned frames are at least this far apart.
+
+LLM_CACHE_ENABLED = True  # Cache responses of chat completion calls on disk.
+LLM_CACHE_PATH = 'data/cache/llm_cache.sqlite'
+LLM_CACHE_TTL = 7 * 24 * 3600  # (in seconds) Cached responses older than this are not used.
+LLM_CACHE_MAX_ENTRIES = 10000
+LLM_CACHE_MAX_SIZE_MB = 512
+STORYBOARD_CACHE_ENABLED = True  # Cache storyboard descriptions, keywords and summaries by PDF content and prompts.
+STORYBOARD_CACHE_PATH = 'data/cache/storyboard_cache.sqlite'
+STORYBOARD_CACHE_TTL = 30 * 24 * 3600  # (in seconds)
+STORYBOARD_CACHE_MAX_ENTRIES = 5000
+STORYBOARD_CACHE_MAX_SIZE_MB = 64
+
+CYANITE_GRAPHQL_URL = 'https://api.cyanite.ai/graphql'
+CYANITE_RATE_LIMITER_PATH = 'data/cache/cyanite_rate_limits.sqlite'  # Token bucket shared by all worker processes.
+CYANITE_RATE_LIMIT_RPM = 300  # Requests per minute, should match the limits of the Cyanite plan.
+CYANITE_MAX_CONNECTIONS = 20  # Pooled keep-alive connections per event loop.
+CYANITE_KEEPALIVE_EXPIRY = 120  # (in seconds) Idle connections are closed after this time.
+CYANITE_CONNECT_TIMEOUT = 5  # (in seconds)
+CYANITE_TIMEOUT = 30  # (in seconds) Read, write and pool timeout of API requests.
+CYANITE_UPLOAD_TIMEOUT = 300  # (in seconds) Timeout of audio file uploads.
+CYANITE_MAX_BATCH_SEARCHES = 8  # Maximum number of searches in one batch request, each takes a token of the rate limit.
+
+OPENAI_RATE_LIMITER_PATH = 'data/cache/openai_rate_limits.sqlite'  # Token buckets shared by all worker processes.
+OPENAI_RATE_LIMITS = {  # Requests and tokens per minute for each model, should match the limits of the OpenAI account tier.
+    "gpt-4o": {"rpm": 5000, "tpm": 800000},
+    "gpt-4o-2024-08-06": {"rpm": 5000, "tpm": 800000},
+    "gpt-4o-mini": {"rpm": 5000, "tpm": 4000000},
+    "gpt-4-turbo": {"rpm": 5000, "tpm": 600000},
+    "gpt-4": {"rpm": 5000, "tpm": 80000},
+    "gpt-4-vision-preview": {"rpm": 5000, "tpm": 80000},
+    "whisper-1": {"rpm": 500},
+}
+OPENAI_DEFAULT_RATE_LIMIT = {"rpm": 500, "tpm": 30000}
+OPENAI_CONCURRENCY = {"chat": 16, "vision": 4, "whisper": 4}  # Maximum number of concurrent calls per process.
+OPENAI_REQUEST_TIMEOUT = 120  # (in seconds) Timeout of a single attempt.
+OPENAI_MAX_RETRIES = 4  # Retries of 429, 5xx, timeout and connection errors.
+OPENAI_RETRY_BASE_DELAY = 0.5  # (in seconds) Backoff is base * 2^attempt with full jitter.
+OPENAI_RETRY_MAX_DELAY = 20  # (in seconds)
+OPENAI_HEDGING_ENABLED = False  # Send a duplicate of a chat/vision call that takes longer than p95 of previous calls.
+OPENAI_HEDGING_MIN_SAMPLES = 20  # Number of latency samples needed before hedging starts.
+
+USAGE_DB_PATH = 'data/cache/llm_usage.sqlite'  # Per-call token, payload and latency records of model calls.
+USAGE_RETENTION = 30 * 24 * 3600  # (in seconds) Records older than this are deleted.
+OPENAI_PRICES_PER_1M_TOKENS = {  # (input, output) USD per 1M tokens, used to estimate the cost of requests.
+    "gpt-4o": (2.5, 10.0),
+    "gpt-4o-2024-08-06": (2.5, 10.0),
+    "gpt-4o-mini": (0.15, 0.6),
+    "gpt-4-turbo": (10.0, 30.0),
+    "gpt-4": (30.0, 60.0),
+    "gpt-4-vision-preview": (10.0, 30.0),
+}
+
+ASSISTANT_POLL_INITIAL_INTERVAL = 0.2  # (in seconds) First poll of an assistant run, the interval then grows by 1.5x.
+ASSISTANT_POLL_MAX_INTERVAL = 2.0  # (in seconds)
+ASSISTANT_RUN_TIMEOUT = 120  # (in seconds) Assistant runs that don't finish in this time are treated as failed.
+ASSISTANT_VECTOR_STORE_EXPIRATION_DAYS = 7  # Knowledge vector store created at startup expires after this many idle days.
+
+STORYBOARD_RASTERIZER = "poppler"  # "poppler" (pdftoppm processes) or "pdfium" (in-process, needs pypdfium2).
+STORYBOARD_RASTERIZER_THREADS = 4  # Number of poppler processes rasterizing page ranges of a storyboard in parallel.
+STORYBOARD_TEXT_MIN_PAGE_CHARS = 200  # pages with less text are sent as images when the text layer is used
+STORYBOARD_TEXT_RICH_PAGE_RATIO = 0.5  # share of pages with text for a storyboard to be described from its text layer
+STORYBOARD_TEXT_MAX_CHARS = 12000  # text of the storyboard sent to the model is cut to this length
+STORYBOARD_PAGE_MAX_SIDE = 1536  # Pages are rasterized with this longer side, then resized for their detail level.
+STORYBOARD_IMAGE_TOKEN_BUDGET = 6000  # Image tokens of all pages of a storyboard (0 - all pages at low detail).
+STORYBOARD_HIGH_DETAIL_MIN_DENSITY = 0.06  # Share of edge pixels (text density) of pages that may be sent at high detail.
+STORYBOARD_PAGE_BATCH_SIZE = 8  # pages rasterized at a time; encoding of a batch overlaps rasterization of the next
+STORYBOARD_PAGE_FILTER = True  # drop near-blank and near-duplicate storyboard pages before they're sent to the model
+STORYBOARD_BLANK_MAX_STD = 6.0  # pages with lower brightness standard deviation are blank
+STORYBOARD_BLANK_MAX_EDGE_DENSITY = 0.002  # pages with a lower share of edge pixels (at 512px width) are blank...
+STORYBOARD_BLANK_FEW_EDGES_MAX_STD = 12.0  # ...if their brightness standard deviation is also below this
+STORYBOARD_DUPLICATE_MAX_DISTANCE = 4  # max differing bits of 64-bit dHashes of duplicate pages
+
+MAP_REDUCE_MAX_IMAGES = 12  # Images of a video/storyboard are described in segments if there are more of them than this,
+MAP_REDUCE_MAX_PAYLOAD_MB = 8  # or if their payload is larger than this.
+MAP_REDUCE_SEGMENT_SIZE = 6  # Maximum number of images in one segment.
+STORYBOARD_GROUP_LATENCY_TARGET = 10.0  # (in seconds) Storyboard page groups are sized so one group is described within this time,
+STORYBOARD_GROUP_BASE_LATENCY = 3.0  # estimated from recent calls, or from these values until enough calls are recorded:
+STORYBOARD_GROUP_LATENCY_PER_PAGE = 0.6  # (in seconds) latency of a call without pages and the latency added by each page.
+
+HOSTED_IMAGES_S3_FOLDER = "analysis-images"  # Keyframes and storyboard pages uploaded for the vision model (use_hosted_frame_urls).
+HOSTED_IMAGES_URL_EXPIRATION = 15 * 60  # (in seconds) Lifetime of the presigned URLs of the uploaded images.
+HOSTED_IMAGES_RETENTION_DAYS = 1  # Uploaded images are deleted by an S3 lifecycle rule of the folder after this many days.
+
+KNOWLEDGE_FILE_PATH = 'data/knowledge.json'  # Local copy of the assistant's knowledge file, used by local knowledge retrieval.
+KNOWLEDGE_TOP_K = 8  # Maximum number of knowledge entries added to the keywords extraction prompt.
+KNOWLEDGE_MAX_CHARS = 6000  # Maximum total length of the added knowledge entries.
+
+TRANSCRIPT_COMPACTION_MODEL = "gpt-4o-mini"  # Model used by the "summary" transcript compaction method.
+
+BENCHMARK_CORPUS_DIR = 'data/benchmark/corpus'  # Extracted frames/pages and transcripts used by src/benchmark/run_benchmark.py.
+BENCHMARK_RECORDINGS_PATH = 'data/benchmark/recordings.sqlite'  # Model responses recorded for offline replay.
+BENCHMARK_REPORTS_DIR = 'data/benchmark/reports'
+BENCHMARK_USAGE_DB_PATH = 'data/benchmark/llm_usage.sqlite'  # Usage records of benchmark calls, kept apart from USAGE_DB_PATH.
 
 API_SETTINGS_PATH = 'configs/latest_settings.json'
 GRADIO_LATEST_SETTINGS_PATH = "configs/latest_settings.json"
@@ -1,5 +1,10 @@
 import os
 from openai import AsyncOpenAI
+from .llm_cache import llm_cache
+from .gateway import gateway
+from .model_router import model_router
 
 api_key = os.getenv("OPENAI_API_KEY")
-client = AsyncOpenAI(api_key=api_key)
+# retries are handled by the gateway, so the SDK's own retries are disabled
+# the router is the outermost layer, so responses are cached under the routed model
+client = model_router.wrap(llm_cache.wrap(gateway.wrap(AsyncOpenAI(api_key=api_key, max_retries=0))))
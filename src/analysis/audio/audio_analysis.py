@@ -1,9 +1,10 @@
 import os.path
 import shutil
+import asyncio
 from src.analysis import client
 from typing import Tuple
 import logging
-from .vad_pipeline import extract_speech
+from .vad_pipeline import iter_speech_chunks
 import subprocess
 
 logger = logging.getLogger(__name__)
@@ -27,14 +28,15 @@ async def audio_analysis(file_path: str) -> str:
             logger.warning(f"No audio was extracted from the video: {file_path}")
             return None
 
-        chunks_folder = extract_speech(audio_filename)
-        if os.path.exists(audio_filename):
-            os.remove(audio_filename)
-        
-        if chunks_folder is None:
+        try:
+            transcript = await transcribe_speech_pipelined(audio_filename)
+        finally:
+            if os.path.exists(audio_filename):
+                os.remove(audio_filename)
+
+        if transcript is None:
             return None
-        
-        transcript = await transcribe_audio(chunks_folder)
+
         steps_logger.info(f"Finished analyzing audio for {file_path}")
         return transcript
 
@@ -66,7 +68,8 @@ async def audio_keywords_extraction(transcript: str, audio_prompt: str, gpt_mode
         messages=[
             {"role": "system", "content": audio_prompt},
             {"role": "user", "content": transcript}
-        ]
+        ],
+        stage="audio_keywords"
     )
     audio_keywords = response.choices[0].message.content
     steps_logger.info(f"Finished extracting keywords from audio.\nKeywords: {audio_keywords}")
@@ -115,18 +118,81 @@ async def transcribe_audio(chunks_folder: str) -> str:
         str: Transcription of the audio.
     """
     steps_logger.info(f"Started transcribing audio for {chunks_folder}")
-    result = ''
-
-    for chunk_name in os.listdir(chunks_folder):
-        with open(os.path.join(chunks_folder, chunk_name), 'rb') as audio_file:
-            chunk_transcription = await client.audio.transcriptions.create(model="whisper-1", file=audio_file)
-        result += chunk_transcription.text
+    chunk_names = sorted(os.listdir(chunks_folder), key=lambda name: int(name.split('_')[-1].split('.')[0]))
+    chunk_transcriptions = [await transcribe_chunk(os.path.join(chunks_folder, name)) for name in chunk_names]
+    result = " ".join(chunk_transcriptions)
 
     shutil.rmtree(chunks_folder, ignore_errors=True)
     steps_logger.info(f"Finished transcribing audio for {chunks_folder}.\nTranscription: {result}")
     return result
 
 
+async def transcribe_chunk(chunk_path: str) -> str:
+    """
+    Transcribe a single speech chunk with Whisper.
+
+    Args:
+        chunk_path (str): Path to the audio chunk.
+
+    Returns:
+        str: Transcription of the chunk.
+    """
+    with open(chunk_path, 'rb') as audio_file:
+        chunk_transcription = await client.audio.transcriptions.create(model="whisper-1", file=audio_file,
+                                                                       stage="transcription")
+    steps_logger.info(f"Transcribed speech chunk {chunk_path}")
+    return chunk_transcription.text
+
+
+async def transcribe_speech_pipelined(audio_path: str) -> str | None:
+    """
+    Run VAD and transcription as a pipeline.
+    VAD runs in a worker thread and every speech chunk is sent to Whisper as soon as VAD closes it,
+    so transcription of the first chunks overlaps with VAD on the rest of the file.
+    The transcript is assembled in chunk order once all chunks are transcribed.
+
+    Args:
+        audio_path (str): Path to the extracted audio file.
+
+    Returns:
+        str: Transcription of the audio.
+        None: If no speech (or too little speech) was detected.
+    """
+    steps_logger.info(f"Started pipelined transcription for {audio_path}")
+    loop = asyncio.get_running_loop()
+    chunks_queue = asyncio.Queue()
+
+    def run_vad():
+        try:
+            for chunk_path in iter_speech_chunks(audio_path):
+                loop.call_soon_threadsafe(chunks_queue.put_nowait, chunk_path)
+        finally:
+            loop.call_soon_threadsafe(chunks_queue.put_nowait, None)
+
+    vad_future = loop.run_in_executor(None, run_vad)
+
+    transcription_tasks = []
+    chunks_folder = None
+    try:
+        while (chunk_path := await chunks_queue.get()) is not None:
+            chunks_folder = os.path.dirname(chunk_path)
+            transcription_tasks.append(asyncio.create_task(transcribe_chunk(chunk_path)))
+        await vad_future
+
+        if not transcription_tasks:
+            return None
+        chunk_transcriptions = await asyncio.gather(*transcription_tasks)
+    finally:
+        for task in transcription_tasks:
+            task.cancel()
+        if chunks_folder is not None:
+            shutil.rmtree(chunks_folder, ignore_errors=True)
+
+    result = " ".join(chunk_transcriptions)
+    steps_logger.info(f"Finished pipelined transcription for {audio_path}.\nTranscription: {result}")
+    return result
+
+
 if __name__ == "__main__":
     testFile = "America_s Game_31 V3_NO MUSIC"
     # extract_audio(testFile)
@@ -20,7 +20,9 @@ async def generate_track_title(audio_description: str, gpt_model: str = 'gpt-4o'
     prompt = f"Generate a track title for the audio, the description of which is as follows: {audio_description}. Your output should be only a track title, nothing else." 
     response = await client.chat.completions.create(
         model=gpt_model,
-        messages=[{"role": "user", "content": prompt}]
+        messages=[{"role": "user", "content": prompt}],
+        use_cache=False,  # a new title is expected on every call
+        stage="track_title"
     )
     tracks_title = response.choices[0].message.content
     steps_logger.info(f"Generated track title: {tracks_title}")
@@ -1,11 +1,12 @@
 import torch
 import os
+import shutil
 from configs import config
 from src.utils import extract_filename, delete_old_files
 import logging
-import os
 
 SAMPLING_RATE = 16000
+VAD_WINDOW_SIZE = 512  # number of samples Silero VAD expects per window at 16kHz
 logger = logging.getLogger(__name__)
 steps_logger = logging.getLogger("steps_info")
 
@@ -49,22 +50,36 @@ def group_speech_segments(segments, sampling_rate):
     return grouped_segments
 
 
-def extract_speech(file_path: str):
+def load_vad_model():
     """
-    Perform voice activity detection on an audio file.
-    The speech segments are grouped based on the maximum chunk duration and saved as separate audio files.
+    Load the Silero VAD model and its helper functions.
+
+    Returns:
+        tuple: The VAD model and the tuple of Silero utils.
+    """
+    return torch.hub.load(repo_or_dir='romberol/silero-vad',
+                          model='silero_vad',
+                          trust_repo=True)
+
+
+def iter_speech_chunks(file_path: str):
+    """
+    Perform streaming voice activity detection on an audio file.
+    Speech segments are grouped on the fly and every group is saved as a separate audio file as soon as VAD closes it,
+    so the caller can start transcribing the first chunk while VAD is still running over the rest of the file.
+
+    A group is closed when adding the next segment would exceed `MAX_CHUNK_DURATION`,
+    or when it has reached `STREAMING_CHUNK_DURATION`.
 
     Args:
         file_path (str): Path to the audio file.
 
-    Returns:
-        str: Path to the folder containing extracted speech chunks.
+    Yields:
+        str: Path to the next speech chunk, in order.
     """
     try:
         steps_logger.info(f"Started performing VAD on {file_path}")
-        model, utils = torch.hub.load(repo_or_dir='romberol/silero-vad',
-                                      model='silero_vad',
-                                      trust_repo=True)
+        model, utils = load_vad_model()
 
         (get_speech_timestamps,
          save_audio,
@@ -73,25 +88,88 @@ def extract_speech(file_path: str):
          collect_chunks) = utils
 
         wav = read_audio(file_path, sampling_rate=SAMPLING_RATE)
-        speech_timestamps = get_speech_timestamps(wav, model)
-        steps_logger.info(f"Finished performing VAD on {file_path}")
-
-        grouped_segments = group_speech_segments(speech_timestamps, SAMPLING_RATE)
-        if grouped_segments is None:
-            logger.warning(f"Speech duration is less than {config.MIN_SPEACH_DURATION} seconds for {file_path}")
-            return None
+        vad_iterator = VADIterator(model, sampling_rate=SAMPLING_RATE)
 
         delete_old_files(config.TEMP_PATH)
         output_folder = os.path.join(config.TEMP_PATH, extract_filename(file_path))
         os.makedirs(output_folder, exist_ok=True)
-        for i, group in enumerate(grouped_segments):
-            chunk_name = os.path.join(output_folder, f"chunk_{i}.wav")
+
+        current_group = []
+        current_duration = 0
+        total_duration = 0
+        n_chunks = 0
+        segment_start = None
+
+        def save_group(group, index):
+            chunk_name = os.path.join(output_folder, f"chunk_{index}.wav")
             save_audio(chunk_name, collect_chunks(group, wav), sampling_rate=SAMPLING_RATE)
-        return output_folder
+            steps_logger.info(f"VAD closed speech chunk {chunk_name}")
+            return chunk_name
+
+        for i in range(0, len(wav), VAD_WINDOW_SIZE):
+            window = wav[i: i + VAD_WINDOW_SIZE]
+            if len(window) < VAD_WINDOW_SIZE:
+                break
+            speech_dict = vad_iterator(window)
+            if not speech_dict:
+                continue
+            if 'start' in speech_dict:
+                segment_start = speech_dict['start']
+                continue
+
+            segment = {'start': segment_start, 'end': speech_dict['end']}
+            segment_start = None
+            segment_duration = (segment['end'] - segment['start']) / SAMPLING_RATE
+            total_duration += segment_duration
+
+            if current_group and current_duration + segment_duration > config.MAX_CHUNK_DURATION:
+                yield save_group(current_group, n_chunks)
+                n_chunks += 1
+                current_group, current_duration = [], 0
+
+            current_group.append(segment)
+            current_duration += segment_duration
+
+            if current_duration >= config.STREAMING_CHUNK_DURATION:
+                yield save_group(current_group, n_chunks)
+                n_chunks += 1
+                current_group, current_duration = [], 0
+
+        # speech that is still open at the end of the file
+        if segment_start is not None:
+            segment = {'start': segment_start, 'end': len(wav)}
+            current_group.append(segment)
+            total_duration += (segment['end'] - segment['start']) / SAMPLING_RATE
+        vad_iterator.reset_states()
+        steps_logger.info(f"Finished performing VAD on {file_path}")
+
+        if n_chunks == 0 and total_duration < config.MIN_SPEACH_DURATION:
+            logger.warning(f"Speech duration is less than {config.MIN_SPEACH_DURATION} seconds for {file_path}")
+            shutil.rmtree(output_folder, ignore_errors=True)
+            return
+
+        if current_group:
+            yield save_group(current_group, n_chunks)
 
     except Exception as e:
         logger.error(f"Error while performing VAD on {file_path}: {e}")
+
+
+def extract_speech(file_path: str):
+    """
+    Perform voice activity detection on an audio file.
+    The speech segments are grouped based on the maximum chunk duration and saved as separate audio files.
+
+    Args:
+        file_path (str): Path to the audio file.
+
+    Returns:
+        str: Path to the folder containing extracted speech chunks.
+    """
+    chunks = list(iter_speech_chunks(file_path))
+    if not chunks:
         return None
+    return os.path.dirname(chunks[0])
 
 
 if __name__ == "__main__":
@@ -0,0 +1,26 @@
+import functools
+from typing import Callable, Dict
+
+
+class ClientProxy:
+    """
+    Wraps an OpenAI client and routes selected endpoint methods through interceptor functions.
+    Everything that is not intercepted is returned from the wrapped client as is.
+
+    Interceptors are registered by dotted path of the method (e.g. "chat.completions.create")
+    and are called as `interceptor(method, *args, **kwargs)`, where `method` is the original bound method.
+    """
+    def __init__(self, target, interceptors: Dict[str, Callable], path: str = ""):
+        self._target = target
+        self._interceptors = interceptors
+        self._path = path
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        path = f"{self._path}.{name}" if self._path else name
+
+        if path in self._interceptors:
+            return functools.partial(self._interceptors[path], attr)
+        if any(intercepted.startswith(path + ".") for intercepted in self._interceptors):
+            return ClientProxy(attr, self._interceptors, path)
+        return attr
@@ -0,0 +1,207 @@
+import asyncio
+import collections
+import logging
+import random
+import time
+import openai
+from configs import config
+from src.utils.rate_limiter import RateLimiter
+from .client_proxy import ClientProxy
+from .usage_tracking import usage_tracker
+
+logger = logging.getLogger(__name__)
+steps_logger = logging.getLogger("steps_info")
+
+GATEWAY_ENDPOINTS = ["chat.completions.create", "beta.chat.completions.parse", "audio.transcriptions.create"]
+
+
+def estimate_tokens(kwargs: dict) -> int:
+    """
+    Rough estimate of the tokens a chat completion request will use, for the TPM limit.
+    """
+    n_tokens = 0
+    for message in kwargs.get("messages", []):
+        content = message.get("content")
+        parts = [{"type": "text", "text": content}] if isinstance(content, str) else content or []
+        for part in parts:
+            if part.get("type") == "text":
+                n_tokens += len(part["text"]) // 4
+            elif part.get("type") == "image_url":
+                n_tokens += 85 if part["image_url"].get("detail") == "low" else 765
+    return n_tokens + (kwargs.get("max_tokens") or 512)
+
+
+def call_class(endpoint: str, kwargs: dict) -> str:
+    """
+    Returns the concurrency class of the call: "whisper", "vision" or "chat".
+    """
+    if endpoint.startswith("audio."):
+        return "whisper"
+    for message in kwargs.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, list) and any(part.get("type") == "image_url" for part in content):
+            return "vision"
+    return "chat"
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and (error.status_code == 429 or error.status_code >= 500)
+
+
+def retry_delay(error: Exception, attempt: int) -> float:
+    """
+    Exponential backoff with full jitter. `Retry-After` header of the response is respected if present.
+    """
+    delay = random.uniform(0, min(config.OPENAI_RETRY_MAX_DELAY, config.OPENAI_RETRY_BASE_DELAY * 2 ** attempt))
+    response = getattr(error, "response", None)
+    if response is not None:
+        try:
+            delay = max(delay, float(response.headers.get("retry-after", 0)))
+        except ValueError:
+            pass
+    return delay
+
+
+class Gateway:
+    """
+    Throttling layer in front of the OpenAI client:
+    - RPM/TPM token buckets per model, shared by all worker processes;
+    - separate concurrency limits for chat, vision and Whisper calls (per process);
+    - retries of 429/5xx/connection errors with jittered exponential backoff;
+    - optional hedging: a duplicate of a slow call is fired after the p95 latency of previous calls.
+
+    Calls accept an extra `stage` argument, which is used to report queueing and retry time per stage.
+    """
+    def __init__(self):
+        self._rate_limiter = None
+        self._semaphores = {name: asyncio.Semaphore(limit) for name, limit in config.OPENAI_CONCURRENCY.items()}
+        self._latencies = collections.defaultdict(lambda: collections.deque(maxlen=200))
+        self.stage_stats = collections.defaultdict(lambda: {"calls": 0, "errors": 0, "retries": 0, "hedged": 0,
+                                                            "queue_time": 0.0, "retry_time": 0.0, "latency": 0.0})
+
+    @property
+    def rate_limiter(self) -> RateLimiter:
+        if self._rate_limiter is None:
+            self._rate_limiter = RateLimiter(config.OPENAI_RATE_LIMITER_PATH)
+        return self._rate_limiter
+
+    def wrap(self, client) -> ClientProxy:
+        interceptors = {endpoint: self._interceptor(endpoint) for endpoint in GATEWAY_ENDPOINTS}
+        return ClientProxy(client, interceptors)
+
+    def _interceptor(self, endpoint: str):
+        async def gateway_call(method, *args, stage: str = None, **kwargs):
+            return await self.call(endpoint, method, *args, stage=stage, **kwargs)
+        return gateway_call
+
+    async def _wait_for_rate_limit(self, endpoint: str, kwargs: dict) -> float:
+        model = kwargs.get("model")
+        limits = config.OPENAI_RATE_LIMITS.get(model, config.OPENAI_DEFAULT_RATE_LIMIT)
+        waited = await self.rate_limiter.acquire(f"{model}:rpm", 1, limits["rpm"])
+        if "tpm" in limits and not endpoint.startswith("audio."):
+            waited += await self.rate_limiter.acquire(f"{model}:tpm", estimate_tokens(kwargs), limits["tpm"])
+        return waited
+
+    def _hedge_delay(self, latency_key) -> float | None:
+        if not config.OPENAI_HEDGING_ENABLED:
+            return None
+        latencies = self._latencies[latency_key]
+        if len(latencies) < config.OPENAI_HEDGING_MIN_SAMPLES:
+            return None
+        return sorted(latencies)[int(0.95 * (len(latencies) - 1))]
+
+    async def call(self, endpoint: str, method, *args, stage: str = None, **kwargs):
+        stage = stage or endpoint
+        kind = call_class(endpoint, kwargs)
+        latency_key = (kind, kwargs.get("model"))
+        kwargs.setdefault("timeout", config.OPENAI_REQUEST_TIMEOUT)
+        report = {"queue_time": 0.0, "retry_time": 0.0, "retries": 0, "hedged": False}
+
+        async def attempt():
+            report["queue_time"] += await self._wait_for_rate_limit(endpoint, kwargs)
+            start = time.perf_counter()
+            if hasattr(kwargs.get("file"), "seek"):
+                kwargs["file"].seek(0)
+            response = await method(*args, **kwargs)
+            self._latencies[latency_key].append(time.perf_counter() - start)
+            return response
+
+        async def attempt_with_retries():
+            for n_attempt in range(config.OPENAI_MAX_RETRIES + 1):
+                try:
+                    return await attempt()
+                except Exception as e:
+                    if n_attempt == config.OPENAI_MAX_RETRIES or not is_retryable(e):
+                        raise
+                    delay = retry_delay(e, n_attempt)
+                    logger.warning(f"[{stage}] OpenAI call failed ({e.__class__.__name__}), retrying in {delay:.2f}s")
+                    report["retries"] += 1
+                    report["retry_time"] += delay
+                    await asyncio.sleep(delay)
+
+        start = time.perf_counter()
+        try:
+            async with self._semaphores[kind]:
+                report["queue_time"] += time.perf_counter() - start
+                hedge_delay = self._hedge_delay(latency_key) if kind != "whisper" else None
+                if hedge_delay is None:
+                    response = await attempt_with_retries()
+                else:
+                    response = await self._hedged(attempt_with_retries, hedge_delay, report, stage)
+        except Exception:
+            latency = time.perf_counter() - start
+            self._report(stage, kwargs.get("model"), report, latency, failed=True)
+            await usage_tracker.record_call(stage, kwargs, None, report["queue_time"], latency, failed=True)
+            raise
+        latency = time.perf_counter() - start
+        self._report(stage, kwargs.get("model"), report, latency)
+        await usage_tracker.record_call(stage, kwargs, response, report["queue_time"], latency)
+        return response
+
+    @staticmethod
+    async def _hedged(call, delay: float, report: dict, stage: str):
+        primary = asyncio.ensure_future(call())
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            return primary.result()
+
+        steps_logger.info(f"[{stage}] Call is slower than p95 ({delay:.2f}s), sending a hedged request.")
+        report["hedged"] = True
+        pending = {primary, asyncio.ensure_future(call())}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def _report(self, stage: str, model: str, report: dict, latency: float, failed: bool = False):
+        stats = self.stage_stats[stage]
+        stats["calls"] += 1
+        stats["errors"] += int(failed)
+        stats["retries"] += report["retries"]
+        stats["hedged"] += int(report["hedged"])
+        stats["queue_time"] += report["queue_time"]
+        stats["retry_time"] += report["retry_time"]
+        stats["latency"] += latency
+        steps_logger.info(f"[{stage}] {model}: {'failed' if failed else 'finished'} in {latency:.2f}s, "
+                          f"queued {report['queue_time']:.2f}s, {report['retries']} retries ({report['retry_time']:.2f}s)"
+                          f"{', hedged' if report['hedged'] else ''}")
+
+
+gateway = Gateway()
+
+
+def gateway_stats() -> dict:
+    """
+    Returns accumulated call count, queueing, retry and wall time per stage for the current process.
+    """
+    return {stage: dict(stats) for stage, stats in gateway.stage_stats.items()}
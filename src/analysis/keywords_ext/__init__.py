@@ -1,2 +1,4 @@
 from .video_audio_extractor import *
-from .keywords_utils import *
\ No newline at end of file
+from .keywords_utils import *
+from .knowledge_retrieval import *
+from .transcript_compaction import *
\ No newline at end of file
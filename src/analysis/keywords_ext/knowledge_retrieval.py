@@ -0,0 +1,152 @@
+import argparse
+import asyncio
+import json
+import logging
+import math
+import re
+import time
+from collections import Counter
+from configs import config
+
+logger = logging.getLogger(__name__)
+steps_logger = logging.getLogger("steps_info")
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "but", "by", "for", "from", "has", "have", "he", "her", "his", "in", "is",
+    "it", "its", "of", "on", "or", "she", "that", "the", "their", "them", "they", "this", "to", "was", "were", "will",
+    "with", "you", "your", "we", "our", "not", "no", "so", "if", "then", "than", "there", "which", "who", "what",
+}
+
+
+def tokenize(text: str) -> list:
+    return [token for token in re.findall(r"[a-z0-9]+", text.lower()) if token not in STOPWORDS and len(token) > 1]
+
+
+def load_knowledge_entries(file_path: str) -> list:
+    """
+    Loads entries of the knowledge file. The file can be a list of entries (strings or objects),
+    an object with a single list of entries, or an object mapping names to entries.
+
+    Args:
+        file_path (str): Path to the knowledge JSON file.
+
+    Returns:
+        list: Entries as strings, objects are serialized to JSON.
+    """
+    with open(file_path, 'r', encoding='utf-8') as file:
+        data = json.load(file)
+    if isinstance(data, dict):
+        lists = [value for value in data.values() if isinstance(value, list)]
+        data = lists[0] if len(data) == 1 and lists else [{name: value} for name, value in data.items()]
+    return [entry if isinstance(entry, str) else json.dumps(entry, ensure_ascii=False) for entry in data]
+
+
+class KnowledgeIndex:
+    """
+    In-memory BM25 index over the entries of the knowledge file.
+    """
+    def __init__(self, entries: list, k1: float = 1.5, b: float = 0.75):
+        self.entries = entries
+        self.k1 = k1
+        self.b = b
+        self._term_frequencies = [Counter(tokenize(entry)) for entry in entries]
+        self._lengths = [sum(frequencies.values()) for frequencies in self._term_frequencies]
+        self._avg_length = sum(self._lengths) / len(entries) if entries else 0
+        document_frequencies = Counter(term for frequencies in self._term_frequencies for term in frequencies)
+        self._idf = {term: math.log(1 + (len(entries) - df + 0.5) / (df + 0.5)) for term, df in document_frequencies.items()}
+
+    def search(self, query: str, top_k: int = config.KNOWLEDGE_TOP_K) -> list:
+        """
+        Returns the `top_k` entries most relevant to the query, most relevant first.
+
+        Args:
+            query (str): Text to search for, e.g. the video description and transcription.
+            top_k (int): Maximum number of entries to return.
+
+        Returns:
+            list: Tuples of (score, entry). Entries that share no terms with the query are not returned.
+        """
+        query_terms = [term for term in set(tokenize(query)) if term in self._idf]
+        scores = []
+        for frequencies, length, entry in zip(self._term_frequencies, self._lengths, self.entries):
+            score = 0.0
+            for term in query_terms:
+                tf = frequencies.get(term, 0)
+                if tf:
+                    score += self._idf[term] * tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * length / self._avg_length))
+            if score > 0:
+                scores.append((score, entry))
+        scores.sort(key=lambda item: item[0], reverse=True)
+        return scores[:top_k]
+
+
+_knowledge_index = None
+
+
+def load_knowledge_index(file_path: str = config.KNOWLEDGE_FILE_PATH) -> KnowledgeIndex:
+    """
+    Loads the knowledge file into the in-memory index. Supposed to be called once at startup.
+    """
+    global _knowledge_index
+    start = time.perf_counter()
+    _knowledge_index = KnowledgeIndex(load_knowledge_entries(file_path))
+    steps_logger.info(f"Loaded {len(_knowledge_index.entries)} knowledge entries from {file_path} "
+                      f"in {time.perf_counter() - start:.3f}s.")
+    return _knowledge_index
+
+
+def retrieve_knowledge(query: str, top_k: int = config.KNOWLEDGE_TOP_K, max_chars: int = config.KNOWLEDGE_MAX_CHARS) -> list:
+    """
+    Selects the knowledge entries relevant to the query, at most `max_chars` characters in total.
+
+    Args:
+        query (str): Text to search for, e.g. the video description and transcription.
+        top_k (int): Maximum number of entries.
+        max_chars (int): Maximum total length of the entries.
+
+    Returns:
+        list: Selected entries, most relevant first.
+    """
+    index = _knowledge_index or load_knowledge_index()
+    start = time.perf_counter()
+    selected, total_chars = [], 0
+    for _, entry in index.search(query, top_k):
+        if selected and total_chars + len(entry) > max_chars:
+            break
+        selected.append(entry)
+        total_chars += len(entry)
+    steps_logger.info(f"Retrieved {len(selected)} knowledge entries ({total_chars} chars) "
+                      f"in {(time.perf_counter() - start) * 1000:.1f}ms.")
+    return selected
+
+
+async def benchmark(description: str, transcription: str, prompt: str, runs: int) -> None:
+    """
+    Compares latency of the keywords extraction with local knowledge retrieval and with the OpenAI Assistant.
+    """
+    from src.analysis.keywords_ext import video_audio_extraction_local_knowledge, video_audio_extraction_assistant
+
+    load_knowledge_index()
+    for name, function in [("Local knowledge retrieval", video_audio_extraction_local_knowledge),
+                           ("OpenAI Assistant", video_audio_extraction_assistant)]:
+        latencies = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            keywords = await function(prompt, description, transcription)
+            latencies.append(time.perf_counter() - start)
+        latencies.sort()
+        print(f"{name}: mean {sum(latencies) / runs:.2f}s, min {latencies[0]:.2f}s, max {latencies[-1]:.2f}s\n"
+              f"  last keywords: {keywords}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark local knowledge retrieval against the OpenAI Assistant.")
+    parser.add_argument("--description", required=True, help="Video description.")
+    parser.add_argument("--transcription", default="", help="Audio transcription.")
+    parser.add_argument("--settings", default=config.API_SETTINGS_PATH, help="Settings file with the assistant prompts.")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    with open(args.settings, 'r') as file:
+        keyword_prompt = json.load(file)["assistant_keyword_extraction_prompt_1"]
+    asyncio.run(benchmark(args.description, args.transcription, keyword_prompt, args.runs))
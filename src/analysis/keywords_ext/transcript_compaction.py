@@ -0,0 +1,114 @@
+import logging
+import math
+import re
+from collections import Counter
+from configs import config
+from src.analysis import client
+from .knowledge_retrieval import tokenize
+
+logger = logging.getLogger(__name__)
+steps_logger = logging.getLogger("steps_info")
+
+SUMMARY_PROMPT = ("Condense the following transcript of a video to at most {n_words} words. Keep the narrative, "
+                  "the intent and emotional tone of the speakers and any mention of music. "
+                  "Return only the condensed transcript.")
+
+
+def estimate_text_tokens(text: str) -> int:
+    return len(text) // 4
+
+
+def split_sentences(text: str) -> list:
+    """
+    Splits the transcript into sentences. Transcripts without punctuation are split into 30 word pieces.
+    """
+    sentences = [sentence.strip() for sentence in re.split(r"(?<=[.!?])\s+", text) if sentence.strip()]
+    if len(sentences) == 1:
+        words = text.split()
+        sentences = [" ".join(words[i:i + 30]) for i in range(0, len(words), 30)]
+    return sentences
+
+
+def extractive_compaction(transcript: str, token_budget: int) -> str:
+    """
+    Keeps the most salient sentences of the transcript that fit into the token budget, in their original order.
+    Salience of a sentence is the frequency of its words in the whole transcript, normalized by its length,
+    so sentences about the recurring topics are kept. If no sentence fits (e.g. run-on speech or lyrics),
+    the most salient sentence is cut to the budget, so a non-empty transcript never becomes empty.
+
+    Args:
+        transcript (str): The transcription of the audio.
+        token_budget (int): Maximum number of tokens of the result.
+
+    Returns:
+        str: The compacted transcript.
+    """
+    sentences = split_sentences(transcript)
+    frequencies = Counter(tokenize(transcript))
+    scores = []
+    for idx, sentence in enumerate(sentences):
+        tokens = tokenize(sentence)
+        scores.append((sum(frequencies[token] for token in tokens) / math.sqrt(len(tokens) + 1), idx))
+
+    selected, n_tokens = [], 0
+    for _, idx in sorted(scores, reverse=True):
+        sentence_tokens = estimate_text_tokens(sentences[idx]) + 1
+        if n_tokens + sentence_tokens > token_budget:
+            continue
+        selected.append(idx)
+        n_tokens += sentence_tokens
+    if not selected and scores:
+        return sentences[max(scores)[1]][:max(token_budget, 1) * 4].strip()
+    return " ".join(sentences[idx] for idx in sorted(selected))
+
+
+async def summary_compaction(transcript: str, token_budget: int) -> str:
+    """
+    Condenses the transcript with one call to a small model.
+
+    Args:
+        transcript (str): The transcription of the audio.
+        token_budget (int): Maximum number of tokens of the result.
+
+    Returns:
+        str: The condensed transcript.
+    """
+    response = await client.chat.completions.create(
+        model=config.TRANSCRIPT_COMPACTION_MODEL,
+        messages=[{"role": "user", "content": [
+            {"type": "text", "text": "Transcript: " + transcript},
+            {"type": "text", "text": SUMMARY_PROMPT.format(n_words=int(token_budget * 0.75))}]}],
+        max_tokens=token_budget,
+        stage="transcript_compaction"
+    )
+    return response.choices[0].message.content.strip()
+
+
+async def compact_transcript(transcript: str, token_budget: int, method: str = "extractive") -> str:
+    """
+    Keeps the transcript under the token budget before it is sent to the keyword extraction calls.
+    Transcripts that already fit are returned unchanged.
+
+    Args:
+        transcript (str): The transcription of the audio.
+        token_budget (int): Maximum number of tokens of the transcript, 0 disables compaction.
+        method (str): "extractive" (selection of salient sentences, no model call) or "summary" (one model call).
+            If the summary call fails, extractive compaction is used.
+
+    Returns:
+        str: The transcript that fits into the budget.
+    """
+    if not transcript or token_budget <= 0 or estimate_text_tokens(transcript) <= token_budget:
+        return transcript
+
+    compacted = None
+    if method == "summary":
+        try:
+            compacted = await summary_compaction(transcript, token_budget)
+        except Exception as e:
+            logger.error(f"Failed to summarize transcript, using extractive compaction: {e}")
+    if not compacted:
+        compacted = extractive_compaction(transcript, token_budget)
+    steps_logger.info(f"Compacted transcript ({method}) from ~{estimate_text_tokens(transcript)} "
+                      f"to ~{estimate_text_tokens(compacted)} tokens.")
+    return compacted
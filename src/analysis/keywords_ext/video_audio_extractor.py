@@ -1,9 +1,13 @@
 from src.analysis import client
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
 from configs import config
 from typing import List
+from src.analysis.usage_tracking import usage_tracker
+from .knowledge_retrieval import retrieve_knowledge
 import asyncio
 import logging
+import openai
+import time
 import os
 
 logger = logging.getLogger(__name__)
@@ -12,11 +16,29 @@ steps_logger = logging.getLogger("steps_info")
 class KeywordList(BaseModel):
     keywords: list[str]
 
+
+class CreativityLevelsKeywords(BaseModel):
+    level_1: list[str]
+    level_2: list[str]
+    level_3: list[str]
+    level_4: list[str]
+
+
+ASSISTANT_RUN_PENDING_STATUSES = ("queued", "in_progress", "cancelling")
+
+_assistant_vector_store_id = os.getenv("ASSISTANT_VECTOR_STORE_ID")
+_assistant_vector_store_lock = asyncio.Lock()
+
+MULTI_LEVEL_INSTRUCTIONS = ("Above is the content to analyze. Below are 4 keyword extraction instructions, one for each "
+                            "creativity level. Follow each instruction independently of the others and return the keywords "
+                            "produced by instruction N as the list level_N. Each list must contain only the keywords.")
+
 async def video_audio_extraction(keyword_extraction_prompt: str, 
                                  video_description: str, 
                                  audio_transcription: str, 
                                  gpt_model: str = 'gpt-4o',
-                                 structured_output: bool = False):
+                                 structured_output: bool = False,
+                                 use_cache: bool = True):
     """
     Extracts keywords from the video description and audio transcription.
 
@@ -26,6 +48,7 @@ async def video_audio_extraction(keyword_extraction_prompt: str,
         audio_transcription (str): The transcription of the audio
         gpt_model (str): The GPT model to use for keyword extraction
         structured_output (bool): Whether to return structured output (list of keywords)
+        use_cache (bool): Whether a cached response for the same request can be returned.
 
     Returns:
         str: Keywords extracted from the video description and audio transcription.
@@ -33,9 +56,10 @@ async def video_audio_extraction(keyword_extraction_prompt: str,
     steps_logger.info(f"Started extracting keywords from video description and audio transcription.")
     if audio_transcription is None: 
         audio_transcription = ""
-    contents = [{"type": "text", "text": keyword_extraction_prompt}, 
-                {"type": "text", "text": "Video Description: " + video_description},
-                {"type": "text", "text": "Audio Transcription: " + audio_transcription}]
+    # shared content goes first and the per-level prompt last, so the 4 creativity calls share a cacheable prefix
+    contents = [{"type": "text", "text": "Video Description: " + video_description},
+                {"type": "text", "text": "Audio Transcription: " + audio_transcription},
+                {"type": "text", "text": keyword_extraction_prompt}]
     
     if not structured_output:
         if gpt_model == "gpt-4 + vision":
@@ -44,6 +68,8 @@ async def video_audio_extraction(keyword_extraction_prompt: str,
         response = await client.chat.completions.create(
             model=gpt_model,
             messages=[{"role": "user", "content": contents}],
+            use_cache=use_cache,
+            stage="video_audio_keywords"
         )
 
         keywords = response.choices[0].message.content.rstrip(",").replace(".", "").lower()
@@ -52,7 +78,9 @@ async def video_audio_extraction(keyword_extraction_prompt: str,
         response = await client.beta.chat.completions.parse(
             model="gpt-4o-2024-08-06",
             messages=[{"role": "user", "content": contents}],
-            response_format=KeywordList
+            response_format=KeywordList,
+            use_cache=use_cache,
+            stage="video_audio_keywords"
         )
         keywords = ", ".join(response.choices[0].message.parsed.keywords)
     steps_logger.info(f"Finished extracting keywords from video description and audio transcription.\nKeywords: {keywords}")
@@ -81,11 +109,175 @@ async def video_audio_creative_extraction(extraction_function,
     return keywords
 
 
+async def multi_level_keyword_extraction(keywords_extraction_prompts: List[str], contents: List[dict], stage: str,
+                                         use_cache: bool = True) -> List[str] | None:
+    """
+    Extracts keywords for all 4 creativity levels in one structured output call, so the shared content
+    (description, transcription) is sent once instead of once per level.
+
+    Args:
+        keywords_extraction_prompts (List[str]): Prompts for extracting keywords, one per creativity level.
+        contents (List[dict]): Text contents shared by all levels.
+        stage (str): Name of the stage for usage reporting.
+        use_cache (bool): Whether a cached response for the same request can be returned.
+
+    Returns:
+        List[str] | None: Comma-separated keywords for each level,
+            or None if the model output failed validation and the levels should be extracted separately.
+    """
+    instructions = [{"type": "text", "text": MULTI_LEVEL_INSTRUCTIONS}] + [
+        {"type": "text", "text": f"Instruction for level {i + 1}:\n{prompt}"} for i, prompt in enumerate(keywords_extraction_prompts)]
+    try:
+        response = await client.beta.chat.completions.parse(
+            model="gpt-4o-2024-08-06",
+            messages=[{"role": "user", "content": contents + instructions}],
+            response_format=CreativityLevelsKeywords,
+            use_cache=use_cache,
+            stage=stage
+        )
+    except (ValidationError, openai.LengthFinishReasonError, openai.ContentFilterFinishReasonError) as e:
+        logger.warning(f"[{stage}] Single call keyword extraction failed validation ({e.__class__.__name__}), "
+                       f"falling back to one call per creativity level.")
+        return None
+
+    parsed = response.choices[0].message.parsed
+    levels = [parsed.level_1, parsed.level_2, parsed.level_3, parsed.level_4] if parsed is not None else []
+    levels = [[keyword.strip(" ,.").lower() for keyword in level if keyword.strip(" ,.")] for level in levels]
+    if len(levels) != len(keywords_extraction_prompts) or not all(levels):
+        logger.warning(f"[{stage}] Single call keyword extraction returned empty or missing levels, "
+                       f"falling back to one call per creativity level.")
+        return None
+    keywords = [", ".join(level) for level in levels]
+    steps_logger.info(f"[{stage}] Extracted keywords for all creativity levels in one call.\nKeywords: {keywords}")
+    return keywords
+
+
+async def video_audio_single_call_extraction(keywords_extraction_prompts: List[str],
+                                             video_description: str,
+                                             audio_transcription: str,
+                                             gpt_model: str = 'gpt-4o',
+                                             structured_output: bool = False,
+                                             use_cache: bool = True) -> List[str]:
+    """
+    Extracts keywords for all 4 creativity levels from the video description and audio transcription in one call.
+    Falls back to `video_audio_creative_extraction` (one call per level) if the output fails validation.
+
+    Args:
+        keywords_extraction_prompts (List[str]): Prompts for extracting keywords, one per creativity level.
+        video_description (str): The description of the video
+        audio_transcription (str): The transcription of the audio
+        gpt_model (str): The GPT model to use for the fallback calls
+        structured_output (bool): Whether the fallback calls use structured output
+        use_cache (bool): Whether a cached response for the same request can be returned.
+
+    Returns:
+        List[str]: Keywords for each creativity level.
+    """
+    contents = [{"type": "text", "text": "Video Description: " + video_description},
+                {"type": "text", "text": "Audio Transcription: " + (audio_transcription or "")}]
+    keywords = await multi_level_keyword_extraction(keywords_extraction_prompts, contents, "video_audio_keywords", use_cache)
+    if keywords is None:
+        keywords = await video_audio_creative_extraction(video_audio_extraction, keywords_extraction_prompts, video_description,
+                                                         audio_transcription, gpt_model, structured_output, use_cache)
+    return keywords
+
+
+async def video_audio_extraction_local_knowledge(keyword_extraction_prompt: str,
+                                                 video_description: str,
+                                                 audio_transcription: str,
+                                                 gpt_model: str = 'gpt-4o',
+                                                 use_cache: bool = True):
+    """
+    Extracts keywords from the video description and audio transcription, grounded in the knowledge file entries
+    selected by the local retrieval index. Replacement for the OpenAI Assistant with file_search.
+
+    Args:
+        keyword_extraction_prompt (str): Prompt for extracting keywords.
+        video_description (str): The description of the video
+        audio_transcription (str): The transcription of the audio
+        gpt_model (str): The GPT model to use for keyword extraction
+        use_cache (bool): Whether a cached response for the same request can be returned.
+
+    Returns:
+        str: Keywords extracted from the video description and audio transcription.
+    """
+    if audio_transcription is None or audio_transcription == "":
+        audio_transcription = "No speech detected in the video."
+    entries = await asyncio.to_thread(retrieve_knowledge, video_description + "\n" + audio_transcription)
+    contents = [{"type": "text", "text": "Relevant entries of knowledge.json:\n" + "\n".join(entries)},
+                {"type": "text", "text": "Video Description: " + video_description},
+                {"type": "text", "text": "Audio Transcription: " + audio_transcription},
+                {"type": "text", "text": "Based on the knowledge.json entries, recommend keywords for this video.\n"
+                                         + keyword_extraction_prompt}]
+
+    response = await client.chat.completions.create(
+        model=gpt_model,
+        messages=[{"role": "user", "content": contents}],
+        use_cache=use_cache,
+        stage="local_knowledge_keywords"
+    )
+    keywords = response.choices[0].message.content.rstrip(",").replace(".", "").lower().strip(" ,")
+    steps_logger.info(f"Finished extracting keywords with local knowledge retrieval.\nKeywords: {keywords}")
+    return keywords
+
+
+async def prepare_assistant_knowledge() -> str | None:
+    """
+    Prepares the vector store with the knowledge file for the assistant's file_search once per process,
+    instead of attaching the file to every message. Set ASSISTANT_VECTOR_STORE_ID to use an existing vector store.
+
+    Returns:
+        str | None: ID of the vector store, or None if no knowledge file is configured.
+    """
+    global _assistant_vector_store_id
+    async with _assistant_vector_store_lock:
+        if _assistant_vector_store_id is None and os.getenv("ASSISTANT_KNOWLEDGE_FILE_ID"):
+            start = time.perf_counter()
+            vector_store = await client.beta.vector_stores.create(
+                name="assistant-knowledge",
+                file_ids=[os.getenv("ASSISTANT_KNOWLEDGE_FILE_ID")],
+                expires_after={"anchor": "last_active_at", "days": config.ASSISTANT_VECTOR_STORE_EXPIRATION_DAYS}
+            )
+            vector_store = await poll_until_done(
+                vector_store, lambda: client.beta.vector_stores.retrieve(vector_store.id), ("in_progress",))
+            if vector_store.status != "completed":
+                raise Exception(f"Failed to prepare the knowledge vector store: {vector_store.status}")
+            _assistant_vector_store_id = vector_store.id
+            steps_logger.info(f"Prepared knowledge vector store {vector_store.id} in {time.perf_counter() - start:.2f}s.")
+    return _assistant_vector_store_id
+
+
+async def poll_until_done(obj, retrieve, pending_statuses: tuple = ASSISTANT_RUN_PENDING_STATUSES):
+    """
+    Polls an OpenAI object while its status is pending. Polling starts at `ASSISTANT_POLL_INITIAL_INTERVAL`
+    and backs off up to `ASSISTANT_POLL_MAX_INTERVAL`, so short runs are not delayed by a long fixed interval.
+
+    Args:
+        obj: The object returned by the create call (run or vector store).
+        retrieve (callable): Returns a coroutine retrieving the latest state of the object.
+        pending_statuses (tuple): Statuses in which the object is still being processed.
+
+    Returns:
+        The object in its final status.
+    """
+    interval = config.ASSISTANT_POLL_INITIAL_INTERVAL
+    deadline = time.monotonic() + config.ASSISTANT_RUN_TIMEOUT
+    while obj.status in pending_statuses:
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"{obj.__class__.__name__} {obj.id} is still {obj.status} "
+                               f"after {config.ASSISTANT_RUN_TIMEOUT}s.")
+        await asyncio.sleep(interval)
+        interval = min(interval * 1.5, config.ASSISTANT_POLL_MAX_INTERVAL)
+        obj = await retrieve()
+    return obj
+
+
 async def video_audio_extraction_assistant(keyword_extraction_prompt: str,
                                            video_description: str, 
                                            audio_transcription: str):
     """
     Extracts keywords from the video description and audio transcription using the OpenAI Assistant.
+    The thread and the run are created in one request, with the knowledge vector store prepared once per process.
 
     Args:
         keyword_extraction_prompt (str): Prompt for extracting keywords.
@@ -97,35 +289,32 @@ async def video_audio_extraction_assistant(keyword_extraction_prompt: str,
     """
     if audio_transcription is None or audio_transcription == "":
         audio_transcription = "No speech detected in the video."
-    thread = await client.beta.threads.create()
-    
-    message = await client.beta.threads.messages.create(
-        thread_id=thread.id,
-        role="user",
-        content="Based on knowledge.json, recommend keywords for this video. Video description: " + video_description + "\nAudio transcription: " + audio_transcription,
-        attachments = [{"file_id": os.getenv("ASSISTANT_KNOWLEDGE_FILE_ID"), "tools": [{"type": "file_search"}]}]
-    )
+    start = time.perf_counter()
+    content = "Based on knowledge.json, recommend keywords for this video. Video description: " + video_description + "\nAudio transcription: " + audio_transcription
 
-    run = await client.beta.threads.runs.create(
-        thread_id=thread.id,
+    thread = {"messages": [{"role": "user", "content": content}]}
+    vector_store_id = await prepare_assistant_knowledge()
+    if vector_store_id is not None:
+        thread["tool_resources"] = {"file_search": {"vector_store_ids": [vector_store_id]}}
+
+    run = await client.beta.threads.create_and_run(
         assistant_id=os.getenv("ASSISTANT_ID"),
+        thread=thread,
         tools=[{"type": "file_search"}],
         instructions=keyword_extraction_prompt
     )
-
-    while not run.status == "completed":
-        await asyncio.sleep(5)
-        run = await client.beta.threads.runs.retrieve(
-            thread_id=thread.id,
-            run_id=run.id,
-        )
-        if run.status == "failed":
-            print(run)
-            raise Exception("Assistant run failed.")
+    run = await poll_until_done(run, lambda: client.beta.threads.runs.retrieve(thread_id=run.thread_id, run_id=run.id))
+    if run.status != "completed":
+        logger.error(f"Assistant run {run.id} {run.status}: {run.last_error}")
+        raise Exception("Assistant run failed.")
 
     messages = await client.beta.threads.messages.list(
-        thread_id=thread.id
+        thread_id=run.thread_id,
+        run_id=run.id,
+        limit=1
     )
+    await usage_tracker.record_call("assistant_keywords", {"model": run.model, "messages": [{"role": "user", "content": content}]},
+                                    run, latency=time.perf_counter() - start)
 
     keywords = messages.data[0].content[0].text.value.split("【")[0].strip()
-    return keywords
\ No newline at end of file
+    return keywords
@@ -0,0 +1,169 @@
+import asyncio
+import hashlib
+import json
+import logging
+from urllib.parse import urlsplit, urlunsplit
+from openai.types.chat import ChatCompletion, ParsedChatCompletion
+from pydantic import BaseModel
+from configs import config
+from src.utils.disk_cache import DiskCache
+from .client_proxy import ClientProxy
+from .usage_tracking import usage_tracker
+
+logger = logging.getLogger(__name__)
+steps_logger = logging.getLogger("steps_info")
+
+CACHED_ENDPOINTS = ["chat.completions.create", "beta.chat.completions.parse"]
+# parameters that don't change the response
+IGNORED_PARAMS = ("model", "messages", "stage", "timeout")
+
+
+def _normalize_text(text: str) -> str:
+    return "\n".join(line.rstrip() for line in text.strip().splitlines())
+
+
+def _normalize_image_url(url: str) -> str:
+    """
+    Replaces inline base64 images with the hash of their content and drops query strings
+    (e.g. presigned URL signatures) from hosted images.
+    """
+    if url.startswith("data:"):
+        return "sha256:" + hashlib.sha256(url.split(",", 1)[-1].encode('utf-8')).hexdigest()
+    scheme, netloc, path, _, _ = urlsplit(url)
+    return urlunsplit((scheme, netloc, path, "", ""))
+
+
+def _normalize_content(content):
+    if isinstance(content, str):
+        return _normalize_text(content)
+    if not isinstance(content, list):
+        return content
+
+    normalized = []
+    for part in content:
+        if part.get("type") == "text":
+            normalized.append({"type": "text", "text": _normalize_text(part["text"])})
+        elif part.get("type") == "image_url":
+            image_url = part["image_url"]
+            normalized.append({"type": "image_url", "url": _normalize_image_url(image_url["url"]),
+                               "detail": image_url.get("detail", "auto")})
+        else:
+            normalized.append(part)
+    return normalized
+
+
+def _normalize_param(value):
+    if isinstance(value, type) and issubclass(value, BaseModel):
+        return {"name": value.__name__, "schema": value.model_json_schema()}
+    return value
+
+
+def request_key(endpoint: str, kwargs: dict) -> str:
+    """
+    Builds the cache key of a chat completion request from the model, normalized messages
+    (with image content hashes instead of images) and the rest of the parameters.
+
+    Args:
+        endpoint (str): Dotted path of the client method.
+        kwargs (dict): Keyword arguments of the request.
+
+    Returns:
+        str: SHA-256 hex digest identifying the request.
+    """
+    messages = [{**message, "content": _normalize_content(message.get("content"))} for message in kwargs.get("messages", [])]
+    params = {name: _normalize_param(value) for name, value in kwargs.items() if name not in IGNORED_PARAMS}
+    payload = {"endpoint": endpoint, "model": kwargs.get("model"), "messages": messages, "params": params}
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class LLMCache:
+    """
+    Caches chat completion responses of the wrapped client on disk.
+    Calls accept an extra `use_cache` argument (True by default) to opt out of caching per call.
+    With `replay_only`, responses are only served from the store and a miss raises `LookupError`
+    (used to replay recorded responses offline).
+    """
+    def __init__(self, enabled: bool = config.LLM_CACHE_ENABLED):
+        self.enabled = enabled
+        self.replay_only = False
+        self.stats = {"hits": 0, "misses": 0, "bypassed": 0}
+        self._store = None
+
+    @property
+    def store(self) -> DiskCache:
+        if self._store is None:
+            self._store = DiskCache(config.LLM_CACHE_PATH, config.LLM_CACHE_TTL,
+                                    config.LLM_CACHE_MAX_ENTRIES, config.LLM_CACHE_MAX_SIZE_MB)
+        return self._store
+
+    def use_store(self, store: DiskCache) -> None:
+        """
+        Replaces the store of cached responses, e.g. with a store of recorded responses.
+        """
+        self._store = store
+
+    def wrap(self, client) -> ClientProxy:
+        interceptors = {endpoint: self._interceptor(endpoint) for endpoint in CACHED_ENDPOINTS}
+        return ClientProxy(client, interceptors)
+
+    def _interceptor(self, endpoint: str):
+        async def cached_call(method, *args, use_cache: bool = True, **kwargs):
+            return await self.call(endpoint, method, *args, use_cache=use_cache, **kwargs)
+        return cached_call
+
+    async def call(self, endpoint: str, method, *args, use_cache: bool = True, **kwargs):
+        if not (self.enabled and (use_cache or self.replay_only)) or kwargs.get("stream"):
+            self.stats["bypassed"] += 1
+            return await method(*args, **kwargs)
+
+        key = request_key(endpoint, kwargs)
+        try:
+            cached = await asyncio.to_thread(self.store.get, key)
+        except Exception as e:
+            logger.error(f"Failed to read LLM cache: {e}")
+            cached = None
+
+        if cached is not None:
+            self.stats["hits"] += 1
+            steps_logger.info(f"LLM cache hit for {endpoint} ({kwargs.get('model')}). Cache stats: {self.stats}")
+            response = self._load_response(cached, kwargs)
+            # replayed responses report their recorded usage, cache hits of the API cost nothing
+            await usage_tracker.record_call(kwargs.get("stage") or endpoint, kwargs, response if self.replay_only else None,
+                                            cache_hit=True, replayed=self.replay_only)
+            return response
+
+        self.stats["misses"] += 1
+        if self.replay_only:
+            raise LookupError(f"No recorded response for {endpoint} ({kwargs.get('stage') or endpoint}).")
+        response = await method(*args, **kwargs)
+        if self._is_cacheable(response):
+            try:
+                await asyncio.to_thread(self.store.set, key, response.model_dump_json())
+            except Exception as e:
+                logger.error(f"Failed to write LLM cache: {e}")
+        return response
+
+    @staticmethod
+    def _is_cacheable(response) -> bool:
+        # truncated (max_tokens reached), filtered and refused responses are not reused
+        for choice in response.choices:
+            if choice.finish_reason in ("length", "content_filter") or getattr(choice.message, "refusal", None):
+                return False
+        return True
+
+    @staticmethod
+    def _load_response(cached: str, kwargs: dict):
+        response_format = kwargs.get("response_format")
+        if isinstance(response_format, type) and issubclass(response_format, BaseModel):
+            return ParsedChatCompletion[response_format].model_validate_json(cached)
+        return ChatCompletion.model_validate_json(cached)
+
+
+llm_cache = LLMCache()
+
+
+def cache_stats() -> dict:
+    """
+    Returns hit/miss counters of the LLM response cache for the current process.
+    """
+    return dict(llm_cache.stats)
@@ -0,0 +1,78 @@
+import asyncio
+import logging
+import os
+from configs import config
+from src.utils import load_settings
+from .client_proxy import ClientProxy
+
+logger = logging.getLogger(__name__)
+steps_logger = logging.getLogger("steps_info")
+
+# Only plain chat completions are routed: structured output calls need models that support them
+ROUTED_ENDPOINTS = ["chat.completions.create"]
+STAGE_ROUTES = {
+    "video_description": "description", "video_description_map": "description", "video_description_reduce": "description",
+    "storyboard_description": "description", "storyboard_description_map": "description",
+    "storyboard_description_reduce": "description",
+    "video_summary": "summary", "storyboard_summary": "summary",
+    "video_audio_keywords": "keywords", "video_keywords": "keywords", "storyboard_keywords": "keywords",
+    "local_knowledge_keywords": "keywords", "audio_keywords": "keywords",
+    "track_title": "title",
+}
+
+
+class ModelRouter:
+    """
+    Picks the model of a call by its stage from the `stage_models` setting, e.g.
+    `{"summary": {"model": "gpt-4o-mini", "fallback": "gpt-4o", "timeout": 30}}`.
+    `model: null` keeps the model chosen by the caller. If the call fails or times out,
+    it is repeated once with the `fallback` model. With `enabled` set to False every call keeps its model,
+    e.g. in benchmarks that compare models.
+    """
+    def __init__(self, settings_path: str = config.API_SETTINGS_PATH):
+        self.settings_path = settings_path
+        self.enabled = True
+        self._routes = {}
+        self._settings_mtime = None
+
+    @property
+    def routes(self) -> dict:
+        try:
+            mtime = os.path.getmtime(self.settings_path)
+            if mtime != self._settings_mtime:
+                settings = load_settings(self.settings_path) or {}
+                self._routes = settings.get("stage_models", {})
+                self._settings_mtime = mtime
+        except OSError as e:
+            logger.error(f"Failed to read stage models from {self.settings_path}: {e}")
+        return self._routes
+
+    def wrap(self, client) -> ClientProxy:
+        interceptors = {endpoint: self._interceptor() for endpoint in ROUTED_ENDPOINTS}
+        return ClientProxy(client, interceptors)
+
+    def _interceptor(self):
+        async def routed_call(method, *args, **kwargs):
+            return await self.call(method, *args, **kwargs)
+        return routed_call
+
+    async def call(self, method, *args, **kwargs):
+        route = self.routes.get(STAGE_ROUTES.get(kwargs.get("stage"))) if self.enabled else None
+        if not route:
+            return await method(*args, **kwargs)
+
+        kwargs["model"] = route.get("model") or kwargs.get("model")
+        fallback = route.get("fallback")
+        try:
+            # the timeout covers retries of the gateway, so a slow model doesn't delay the fallback
+            return await asyncio.wait_for(method(*args, **kwargs), route.get("timeout"))
+        except Exception as e:
+            if not fallback or fallback == kwargs["model"]:
+                raise
+            logger.warning(f"[{kwargs.get('stage')}] {kwargs['model']} failed ({e.__class__.__name__}), "
+                           f"falling back to {fallback}.")
+            kwargs["model"] = fallback
+            return await method(*args, **kwargs)
+
+
+model_router = ModelRouter()
@@ -0,0 +1,235 @@
+import asyncio
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import sqlite3
+import time
+from configs import config
+
+logger = logging.getLogger(__name__)
+steps_logger = logging.getLogger("steps_info")
+
+current_request_id = contextvars.ContextVar("current_request_id", default=None)
+
+RECORD_FIELDS = ["request_id", "stage", "model", "prompt_tokens", "cached_tokens", "completion_tokens", "images",
+                 "image_detail", "payload_bytes", "queue_time", "latency", "cache_hit", "replayed", "failed", "created_at"]
+
+
+@contextlib.contextmanager
+def request_context(request_id: str):
+    """
+    Tags all model calls made inside the context (including tasks created in it) with the request id.
+    """
+    token = current_request_id.set(request_id)
+    try:
+        yield
+    finally:
+        current_request_id.reset(token)
+
+
+def describe_payload(kwargs: dict) -> dict:
+    """
+    Counts images, their detail levels and the size of the request messages.
+    """
+    images = 0
+    details = set()
+    for message in kwargs.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, list):
+            for part in content:
+                if part.get("type") == "image_url":
+                    images += 1
+                    details.add(part["image_url"].get("detail", "auto"))
+    payload_bytes = len(json.dumps(kwargs.get("messages", []), default=str))
+    return {"images": images, "image_detail": ",".join(sorted(details)), "payload_bytes": payload_bytes}
+
+
+def cached_prompt_tokens(usage) -> int:
+    """
+    Returns the number of prompt tokens served from the provider's prompt cache.
+    `prompt_tokens_details` is a dict or an object depending on the SDK version.
+    """
+    details = getattr(usage, "prompt_tokens_details", None)
+    if isinstance(details, dict):
+        return details.get("cached_tokens") or 0
+    return getattr(details, "cached_tokens", 0) or 0
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """
+    Estimates the cost of a call in USD from `OPENAI_PRICES_PER_1M_TOKENS`. Unknown models cost 0.
+    """
+    input_price, output_price = config.OPENAI_PRICES_PER_1M_TOKENS.get(model, (0, 0))
+    return (prompt_tokens * input_price + completion_tokens * output_price) / 1_000_000
+
+
+class UsageTracker:
+    """
+    Stores a record of every model call in a SQLite file, so records from the API and the worker processes
+    can be aggregated per request and per stage.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._initialized = False
+
+    def use_path(self, path: str) -> None:
+        """
+        Records the calls to another SQLite file from now on, e.g. to keep benchmark calls out of the API usage.
+        """
+        self.path = path
+        self._initialized = False
+
+    @contextlib.contextmanager
+    def _connect(self):
+        """
+        Opens a connection for one transaction, committed on success and rolled back on errors, and closes it.
+        """
+        if not self._initialized:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with contextlib.closing(sqlite3.connect(self.path, timeout=10)) as connection, connection:
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.execute("""CREATE TABLE IF NOT EXISTS calls (
+                    request_id TEXT, stage TEXT, model TEXT,
+                    prompt_tokens INTEGER, cached_tokens INTEGER, completion_tokens INTEGER,
+                    images INTEGER, image_detail TEXT, payload_bytes INTEGER,
+                    queue_time REAL, latency REAL, cache_hit INTEGER, replayed INTEGER, failed INTEGER, created_at REAL
+                )""")
+                columns = [row[1] for row in connection.execute("PRAGMA table_info(calls)")]
+                if "cached_tokens" not in columns:  # usage files created before cached tokens were recorded
+                    connection.execute("ALTER TABLE calls ADD COLUMN cached_tokens INTEGER DEFAULT 0")
+                if "replayed" not in columns:  # usage files created before replayed calls were recorded
+                    connection.execute("ALTER TABLE calls ADD COLUMN replayed INTEGER DEFAULT 0")
+                connection.execute("CREATE INDEX IF NOT EXISTS calls_request_id ON calls (request_id)")
+                connection.execute("CREATE INDEX IF NOT EXISTS calls_created_at ON calls (created_at)")
+            self._initialized = True
+        with contextlib.closing(sqlite3.connect(self.path, timeout=10)) as connection, connection:
+            yield connection
+
+    def _insert(self, record: dict) -> None:
+        with self._connect() as connection:
+            connection.execute(f"INSERT INTO calls ({', '.join(RECORD_FIELDS)}) VALUES ({', '.join('?' * len(RECORD_FIELDS))})",
+                               [record[field] for field in RECORD_FIELDS])
+            connection.execute("DELETE FROM calls WHERE created_at < ?", (time.time() - config.USAGE_RETENTION,))
+
+    async def record_call(self, stage: str, kwargs: dict, response=None, queue_time: float = 0.0, latency: float = 0.0,
+                          cache_hit: bool = False, failed: bool = False, replayed: bool = False) -> None:
+        """
+        Records a model call. Errors are logged and never propagated to the caller.
+        Replayed calls are cache hits served from recorded responses; they keep the usage of the recorded response.
+        """
+        try:
+            usage = getattr(response, "usage", None)
+            record = {
+                "request_id": current_request_id.get(),
+                "stage": stage,
+                "model": kwargs.get("model"),
+                "prompt_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+                "cached_tokens": cached_prompt_tokens(usage),
+                "completion_tokens": getattr(usage, "completion_tokens", 0) or 0,
+                **describe_payload(kwargs),
+                "queue_time": queue_time,
+                "latency": latency,
+                "cache_hit": int(cache_hit),
+                "replayed": int(replayed),
+                "failed": int(failed),
+                "created_at": time.time(),
+            }
+            steps_logger.info(f"Usage [{stage}] request={record['request_id']} model={record['model']} "
+                              f"tokens={record['prompt_tokens']}/{record['completion_tokens']} cached={record['cached_tokens']} "
+                              f"images={record['images']} ({record['image_detail'] or '-'}) "
+                              f"payload={record['payload_bytes'] / 1024:.1f}KB queue={queue_time:.2f}s latency={latency:.2f}s"
+                              f"{' replayed' if replayed else ' cache hit' if cache_hit else ''}")
+            await asyncio.to_thread(self._insert, record)
+        except Exception as e:
+            logger.error(f"Failed to record usage of {stage}: {e}")
+
+    def _aggregate(self, where: str, params: tuple) -> dict:
+        query = f"""SELECT stage, model, COUNT(*), SUM(prompt_tokens), SUM(COALESCE(cached_tokens, 0)), SUM(completion_tokens),
+                           SUM(images), SUM(payload_bytes), SUM(queue_time), SUM(latency), MAX(latency), SUM(cache_hit),
+                           SUM(COALESCE(replayed, 0)), SUM(failed), AVG(CASE WHEN cached_tokens > 0 AND cache_hit = 0 THEN latency END),
+                           AVG(CASE WHEN COALESCE(cached_tokens, 0) = 0 AND cache_hit = 0 THEN latency END)
+                    FROM calls WHERE {where} GROUP BY stage, model ORDER BY stage"""
+        with self._connect() as connection:
+            rows = connection.execute(query, params).fetchall()
+
+        stages = {}
+        total = {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0, "images": 0,
+                 "payload_bytes": 0, "replayed": 0, "cost_usd": 0.0}
+        for (stage, model, calls, prompt_tokens, cached_tokens, completion_tokens, images, payload_bytes, queue_time,
+             latency, max_latency, cache_hits, replayed, failed, latency_prompt_cached, latency_prompt_uncached) in rows:
+            cost = estimate_cost(model, prompt_tokens, completion_tokens)
+            stages[f"{stage}:{model}"] = {
+                "stage": stage, "model": model, "calls": calls, "prompt_tokens": prompt_tokens,
+                "cached_tokens": cached_tokens, "prompt_cache_hit_rate": round(cached_tokens / prompt_tokens, 3) if prompt_tokens else 0.0,
+                "completion_tokens": completion_tokens, "images": images, "payload_bytes": payload_bytes,
+                "queue_time": round(queue_time, 3), "avg_latency": round(latency / calls, 3), "max_latency": round(max_latency, 3),
+                "avg_latency_prompt_cached": round(latency_prompt_cached, 3) if latency_prompt_cached is not None else None,
+                "avg_latency_prompt_uncached": round(latency_prompt_uncached, 3) if latency_prompt_uncached is not None else None,
+                "cache_hits": cache_hits, "replayed": replayed, "failed": failed, "cost_usd": round(cost, 5)
+            }
+            total["calls"] += calls
+            total["prompt_tokens"] += prompt_tokens
+            total["cached_tokens"] += cached_tokens
+            total["completion_tokens"] += completion_tokens
+            total["images"] += images
+            total["payload_bytes"] += payload_bytes
+            total["replayed"] += replayed
+            total["cost_usd"] += cost
+        total["cost_usd"] = round(total["cost_usd"], 5)
+        return {"stages": list(stages.values()), "total": total}
+
+    def request_summary(self, request_id: str) -> dict:
+        """
+        Aggregates the calls of one request per stage and model.
+        """
+        return self._aggregate("request_id = ?", (request_id,))
+
+    def metrics(self, since_seconds: float = 3600) -> dict:
+        """
+        Aggregates the calls of all requests made in the last `since_seconds` per stage and model.
+        """
+        return self._aggregate("created_at >= ?", (time.time() - since_seconds,))
+
+    def latency_profile(self, stages: list, since_seconds: float = 24 * 3600, min_calls: int = 5) -> tuple | None:
+        """
+        Fits the latency of successful, not cached calls of the stages made in the last `since_seconds`
+        as `base + per_image * images` with least squares.
+
+        Returns:
+            tuple | None: Base latency and latency per image in seconds, None if there are too few calls to fit.
+        """
+        query = f"""SELECT images, latency FROM calls WHERE stage IN ({', '.join('?' * len(stages))})
+                    AND created_at >= ? AND failed = 0 AND cache_hit = 0 AND images > 0"""
+        with self._connect() as connection:
+            rows = connection.execute(query, (*stages, time.time() - since_seconds)).fetchall()
+        if len(rows) < min_calls:
+            return None
+        mean_images = sum(images for images, _ in rows) / len(rows)
+        mean_latency = sum(latency for _, latency in rows) / len(rows)
+        variance = sum((images - mean_images) ** 2 for images, _ in rows)
+        if variance == 0:
+            return None
+        per_image = sum((images - mean_images) * (latency - mean_latency) for images, latency in rows) / variance
+        return mean_latency - per_image * mean_images, per_image
+
+    async def log_request_summary(self, request_id: str) -> dict:
+        """
+        Writes the per-stage usage of the request to the steps log.
+        """
+        try:
+            summary = await asyncio.to_thread(self.request_summary, request_id)
+        except Exception as e:
+            logger.error(f"Failed to summarize usage of request {request_id}: {e}")
+            return {}
+        lines = [f"  {s['stage']} ({s['model']}): {s['calls']} calls, tokens {s['prompt_tokens']}/{s['completion_tokens']} "
+                 f"({s['cached_tokens']} cached), "
+                 f"{s['images']} images, {s['payload_bytes'] / 1024:.1f}KB, queue {s['queue_time']:.2f}s, "
+                 f"avg latency {s['avg_latency']:.2f}s, ${s['cost_usd']:.4f}" for s in summary["stages"]]
+        steps_logger.info(f"Usage summary for request {request_id}: total ${summary['total']['cost_usd']:.4f}, "
+                          f"{summary['total']['prompt_tokens']}/{summary['total']['completion_tokens']} tokens\n" + "\n".join(lines))
+        return summary
+
+
+usage_tracker = UsageTracker(config.USAGE_DB_PATH)
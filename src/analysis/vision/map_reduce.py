@@ -0,0 +1,137 @@
+import asyncio
+import logging
+import math
+from configs import config
+from src.analysis import client
+from src.analysis.usage_tracking import usage_tracker
+
+logger = logging.getLogger(__name__)
+steps_logger = logging.getLogger("steps_info")
+
+SEGMENT_INSTRUCTIONS = ("The images are part {index} of {total} of the same {kind}, in order. "
+                        "Describe only this part, following the instructions below, in at most 120 words.\n")
+MERGE_INSTRUCTIONS = ("Below are descriptions of consecutive parts of the same {kind}, in order. "
+                      "Merge them into one description of the whole {kind} following these instructions. "
+                      "Do not mention the parts.\n")
+
+
+def images_payload_size(image_contents: list) -> int:
+    """
+    Returns the size of the image URLs (inline base64 data or links) in bytes.
+    """
+    return sum(len(part["image_url"]["url"]) for part in image_contents if part.get("type") == "image_url")
+
+
+def should_map_reduce(image_contents: list) -> bool:
+    """
+    Whether the images should be described in segments: there are more images than `MAP_REDUCE_MAX_IMAGES`
+    or their payload is larger than `MAP_REDUCE_MAX_PAYLOAD_MB`.
+    """
+    return (len(image_contents) > config.MAP_REDUCE_MAX_IMAGES
+            or images_payload_size(image_contents) > config.MAP_REDUCE_MAX_PAYLOAD_MB * 1024 * 1024)
+
+
+def split_segments(image_contents: list, segment_size: int) -> list:
+    """
+    Splits the images into ordered segments of at most `segment_size` images with nearly equal sizes.
+    """
+    n_segments = max(1, math.ceil(len(image_contents) / segment_size))
+    bounds = [round(i * len(image_contents) / n_segments) for i in range(n_segments + 1)]
+    return [image_contents[start:end] for start, end in zip(bounds, bounds[1:])]
+
+
+async def segment_size_for_latency(stages: list, latency_target: float, base_latency: float, latency_per_image: float) -> int:
+    """
+    Returns the number of images per segment such that one segment is described within the latency target.
+    Latency of a call is estimated from the recent calls of the stages, or from the default values
+    if there are too few of them.
+
+    Args:
+        stages (list): Stages of the segment calls to estimate the latency from.
+        latency_target (float): Target latency of a segment call in seconds.
+        base_latency (float): Default latency of a call without images.
+        latency_per_image (float): Default latency added by each image.
+
+    Returns:
+        int: Segment size between 2 and `MAP_REDUCE_MAX_IMAGES`.
+    """
+    try:
+        profile = await asyncio.to_thread(usage_tracker.latency_profile, stages)
+    except Exception as e:
+        logger.error(f"Failed to estimate latency of {stages}: {e}")
+        profile = None
+    if profile is not None and profile[1] > 0:
+        base_latency, latency_per_image = profile
+    segment_size = int((latency_target - base_latency) / latency_per_image) if latency_per_image > 0 else config.MAP_REDUCE_MAX_IMAGES
+    segment_size = min(max(segment_size, 2), config.MAP_REDUCE_MAX_IMAGES)
+    logger.info(f"Segment size {segment_size} for {latency_target}s target "
+                f"(base latency {base_latency:.2f}s, {latency_per_image:.2f}s per image).")
+    return segment_size
+
+
+async def describe_segments(image_contents: list, description_prompt: str, gpt_model: str, stage: str,
+                            kind: str = "video", segment_size: int = None) -> list:
+    """
+    Describes ordered segments of the images concurrently (map step).
+
+    Args:
+        image_contents (list): Image message contents, in order.
+        description_prompt (str): Prompt for generating the description.
+        gpt_model (str): OpenAI's GPT model to use.
+        stage (str): Name of the pipeline stage, used for reporting.
+        kind (str): What the images are taken from, e.g. "video" or "storyboard".
+        segment_size (int): Maximum number of images per segment, `MAP_REDUCE_SEGMENT_SIZE` by default.
+
+    Returns:
+        list: Descriptions of the segments, in order.
+    """
+    segments = split_segments(image_contents, segment_size or config.MAP_REDUCE_SEGMENT_SIZE)
+
+    async def describe_segment(index, segment):
+        text = SEGMENT_INSTRUCTIONS.format(index=index + 1, total=len(segments), kind=kind) + description_prompt
+        response = await client.chat.completions.create(
+            model=gpt_model,
+            messages=[{"role": "user", "content": [{"type": "text", "text": text}] + segment}],
+            max_tokens=300,
+            stage=f"{stage}_map"
+        )
+        return response.choices[0].message.content
+
+    steps_logger.info(f"[{stage}] Describing {len(image_contents)} images in {len(segments)} segments.")
+    return await asyncio.gather(*[describe_segment(index, segment) for index, segment in enumerate(segments)])
+
+
+def merge_contents(segment_descriptions: list, description_prompt: str, kind: str = "video") -> list:
+    """
+    Builds text-only message contents for merging segment descriptions into one description (reduce step).
+    """
+    segments_text = "\n\n".join(f"Part {i + 1}: {description}" for i, description in enumerate(segment_descriptions))
+    return [{"type": "text", "text": segments_text},
+            {"type": "text", "text": MERGE_INSTRUCTIONS.format(kind=kind) + description_prompt}]
+
+
+async def map_reduce_describe(image_contents: list, description_prompt: str, gpt_model: str, stage: str,
+                              kind: str = "video", segment_size: int = None) -> str:
+    """
+    Describes the images segment by segment concurrently and merges the segment descriptions with a text-only call,
+    so latency doesn't grow with the number of images as in a single vision request.
+
+    Args:
+        image_contents (list): Image message contents, in order.
+        description_prompt (str): Prompt for generating the description.
+        gpt_model (str): OpenAI's GPT model to use.
+        stage (str): Name of the pipeline stage, used for reporting.
+        kind (str): What the images are taken from, e.g. "video" or "storyboard".
+        segment_size (int): Maximum number of images per segment, `MAP_REDUCE_SEGMENT_SIZE` by default.
+
+    Returns:
+        str: Description of all images.
+    """
+    segment_descriptions = await describe_segments(image_contents, description_prompt, gpt_model, stage, kind, segment_size)
+    response = await client.chat.completions.create(
+        model=gpt_model,
+        messages=[{"role": "user", "content": merge_contents(segment_descriptions, description_prompt, kind)}],
+        max_tokens=700,
+        stage=f"{stage}_reduce"
+    )
+    return response.choices[0].message.content
@@ -0,0 +1,124 @@
+import json
+import logging
+import os
+import cv2
+import numpy as np
+from PIL import Image
+from configs import config
+from src.utils.frame_detection import canny_edge_detection
+from src.utils.image_budget import fit_for_detail, image_tokens
+
+logger = logging.getLogger(__name__)
+steps_logger = logging.getLogger("steps_info")
+
+PAGE_DETAILS_FILENAME = "details.json"
+
+
+def text_density(image: np.ndarray) -> float:
+    """
+    Returns the share of edge pixels of the page at 512px width, a cheap proxy of how much small text it contains:
+    text strokes produce dense edges, while pictures and large titles produce few.
+    """
+    height, width = image.shape[:2]
+    scale = 512 / width
+    if scale < 1:
+        image = cv2.resize(image, (512, max(1, round(height * scale))), interpolation=cv2.INTER_AREA)
+    _, edges = canny_edge_detection(image)
+    return np.count_nonzero(edges) / edges.size
+
+
+def save_page_details(folder: str, details: dict) -> None:
+    with open(os.path.join(folder, PAGE_DETAILS_FILENAME), 'w') as file:
+        json.dump(details, file)
+
+
+def load_page_details(folder: str) -> dict:
+    """
+    Returns:
+        dict: Mapping of page file names to their detail level, empty if the pages were not planned.
+    """
+    details_path = os.path.join(folder, PAGE_DETAILS_FILENAME)
+    if not os.path.exists(details_path):
+        return {}
+    with open(details_path, 'r') as file:
+        return json.load(file)
+
+
+class PageDetailPlanner:
+    """
+    Chooses the detail level of each storyboard page within the image token budget of the deck.
+    Pages are sent at low detail, and text-dense pages (music references, scripts) are promoted to high detail,
+    the densest first, while the budget allows. Pages come in batches, each batch gets a share of the remaining
+    budget proportional to its number of pages among the remaining pages, so the budget left unused by a batch
+    and the share of dropped pages go to the next batches.
+    Page files are resized in place, keeping the aspect ratio, to the size the model sees them at.
+
+    Args:
+        n_pages (int): Number of pages of the storyboard.
+        token_budget (int): Maximum number of image tokens of all pages, 0 sends all pages at low detail.
+    """
+    def __init__(self, n_pages: int, token_budget: int = config.STORYBOARD_IMAGE_TOKEN_BUDGET):
+        self.token_budget = token_budget
+        self.remaining_pages = n_pages
+        self.remaining_budget = float(token_budget)
+        self.details = {}
+        self.n_tokens = 0
+
+    def plan(self, page_paths: list) -> list:
+        """
+        Args:
+            page_paths (list): Paths to the next batch of pages, in page order.
+
+        Returns:
+            list: Detail level of each page of the batch.
+        """
+        pages = []
+        for page_path in page_paths:
+            image = cv2.imread(page_path)
+            if image is None:
+                # unreadable pages are sent as they are, at low detail
+                logger.warning(f"Failed to read storyboard page {page_path}, sending it at low detail.")
+                pages.append({"path": page_path, "width": 0, "height": 0, "density": 0.0, "detail": "low"})
+                continue
+            height, width = image.shape[:2]
+            pages.append({"path": page_path, "width": width, "height": height, "density": text_density(image),
+                          "detail": "low"})
+
+        share = self.remaining_budget * min(1.0, len(pages) / max(self.remaining_pages, 1))
+        n_tokens = sum(image_tokens(page["width"], page["height"], "low") for page in pages)
+        candidates = [page for page in pages if page["density"] >= config.STORYBOARD_HIGH_DETAIL_MIN_DENSITY]
+        for page in sorted(candidates, key=lambda page: page["density"], reverse=True):
+            extra_tokens = image_tokens(page["width"], page["height"], "high") - image_tokens(page["width"], page["height"], "low")
+            if n_tokens + extra_tokens <= share:
+                page["detail"] = "high"
+                n_tokens += extra_tokens
+
+        for page in pages:
+            if page["width"]:
+                self.resize(page)
+            self.details[os.path.basename(page["path"])] = page["detail"]
+        self.n_tokens += n_tokens
+        self.remaining_budget -= n_tokens
+        self.remaining_pages -= len(pages)
+        return [page["detail"] for page in pages]
+
+    def drop(self, n_pages: int) -> None:
+        """
+        Excludes pages dropped before planning (blank or duplicate pages) from the remaining pages,
+        so their share of the budget goes to the pages that are sent.
+        """
+        self.remaining_pages -= n_pages
+
+    @staticmethod
+    def resize(page: dict) -> None:
+        size = fit_for_detail(page["width"], page["height"], page["detail"])
+        if size != (page["width"], page["height"]):
+            with Image.open(page["path"]) as image:
+                image = image.resize(size, Image.LANCZOS)
+            image.save(page["path"], 'JPEG')
+
+    def save(self, folder: str, file_path: str) -> None:
+        save_page_details(folder, self.details)
+        n_high = sum(detail == "high" for detail in self.details.values())
+        steps_logger.info(f"Planned {len(self.details)} pages of storyboard {file_path}: {n_high} at high detail, "
+                          f"~{self.n_tokens} image tokens (budget {self.token_budget}).")
@@ -0,0 +1,98 @@
+import logging
+import os
+import cv2
+import numpy as np
+from configs import config
+from src.utils.frame_detection import canny_edge_detection
+from .pdf_rasterizers import page_number
+
+logger = logging.getLogger(__name__)
+steps_logger = logging.getLogger("steps_info")
+
+
+def is_blank(image: np.ndarray) -> bool:
+    """
+    Whether the page is near-blank: almost uniform (e.g. blank separators)
+    or with almost no edges and little brightness variation (e.g. a solid background with a small logo).
+    Edges are counted on a 512px wide thumbnail, so a page with a single line of text isn't blank at any resolution.
+    """
+    height, width = image.shape[:2]
+    scale = 512 / width
+    if scale < 1:
+        image = cv2.resize(image, (512, max(1, round(height * scale))), interpolation=cv2.INTER_AREA)
+    blurred, edges = canny_edge_detection(image)
+    std = float(np.std(blurred))
+    return (std < config.STORYBOARD_BLANK_MAX_STD
+            or (std < config.STORYBOARD_BLANK_FEW_EDGES_MAX_STD
+                and np.count_nonzero(edges) / edges.size < config.STORYBOARD_BLANK_MAX_EDGE_DENSITY))
+
+
+def dhash(image: np.ndarray, hash_size: int = 8) -> int:
+    """
+    Returns the difference hash of the image: signs of brightness differences of adjacent pixels of its thumbnail.
+    Near-identical images have hashes that differ in few bits.
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    thumbnail = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (thumbnail[:, 1:] > thumbnail[:, :-1]).flatten()
+    return int("".join("1" if bit else "0" for bit in bits), 2)
+
+
+class PageFilter:
+    """
+    Drops near-blank pages and near-duplicates of previously kept pages (e.g. repeated template frames)
+    from the extracted storyboard pages. Dropped pages are deleted, so they are not sent to the model.
+    Keeps the hashes and paths of the seen pages between batches of the same storyboard, so a page passed again
+    is skipped instead of being compared with itself and deleted.
+    """
+    def __init__(self):
+        self.hashes = []
+        self.seen = set()
+        self.n_pages = 0
+        self.n_blank = 0
+        self.n_duplicates = 0
+        self.dropped_bytes = 0
+        self.dropped_pages = {"blank": [], "duplicate": []}
+
+    def keep(self, page_path: str) -> bool:
+        image = cv2.imread(page_path)
+        if image is None:
+            return True
+        if is_blank(image):
+            self.n_blank += 1
+            self.dropped_pages["blank"].append(page_number(os.path.basename(page_path)))
+            return False
+        page_hash = dhash(image)
+        if any(bin(page_hash ^ kept).count("1") <= config.STORYBOARD_DUPLICATE_MAX_DISTANCE for kept in self.hashes):
+            self.n_duplicates += 1
+            self.dropped_pages["duplicate"].append(page_number(os.path.basename(page_path)))
+            return False
+        self.hashes.append(page_hash)
+        return True
+
+    def filter(self, page_paths: list) -> list:
+        """
+        Args:
+            page_paths (list): Paths to the extracted pages, in page order.
+
+        Returns:
+            list: Paths to the kept pages not seen in previous batches, in page order.
+        """
+        kept = []
+        for page_path in page_paths:
+            if page_path in self.seen:
+                logger.warning(f"Page {page_path} was already filtered, skipping it.")
+                continue
+            self.seen.add(page_path)
+            self.n_pages += 1
+            if self.keep(page_path):
+                kept.append(page_path)
+            else:
+                self.dropped_bytes += os.path.getsize(page_path)
+                os.remove(page_path)
+        return kept
+
+    def log_summary(self, file_path: str) -> None:
+        steps_logger.info(f"Dropped {self.n_blank} blank (pages {self.dropped_pages['blank']}) and {self.n_duplicates} "
+                          f"duplicate (pages {self.dropped_pages['duplicate']}) pages of {self.n_pages} "
+                          f"from storyboard {file_path} ({self.dropped_bytes / 1024:.0f} KB of images).")
@@ -0,0 +1,180 @@
+import argparse
+import os
+import re
+import resource
+import shutil
+import tempfile
+import time
+import logging
+from pdf2image import convert_from_path, pdfinfo_from_path
+from configs import config
+
+try:
+    import pypdfium2 as pdfium
+except ImportError:  # optional backend, poppler is used if it's not installed
+    pdfium = None
+
+logger = logging.getLogger(__name__)
+
+
+def page_number(file_name: str) -> int:
+    """
+    Returns the page number (starting from 1) from the name of an extracted page, e.g. 'b00009_0001-12.jpg' -> 12.
+    """
+    numbers = re.findall(r"\d+", file_name)
+    return int(numbers[-1]) if numbers else 0
+
+
+class PageRasterizer:
+    """
+    Renders pages of a PDF file to JPEG files whose names end with the page number, keeping their aspect ratio.
+    """
+    name = None
+
+    def page_count(self, file_path: str) -> int:
+        raise NotImplementedError
+
+    def iter_pages(self, file_path: str, output_folder: str, max_side: int = 512):
+        """
+        Renders the pages in small batches and yields the path of each page as soon as it is written,
+        so memory use doesn't depend on the number of pages.
+
+        Args:
+            file_path (str): Path to the PDF file.
+            output_folder (str): Folder to write the pages to.
+            max_side (int): Size of the longer side of the page images.
+
+        Yields:
+            str: Path to the written page, in page order.
+        """
+        raise NotImplementedError
+
+    def rasterize(self, file_path: str, output_folder: str, max_side: int = 512) -> list:
+        """
+        Returns:
+            list: Paths to all written pages, in page order.
+        """
+        return list(self.iter_pages(file_path, output_folder, max_side))
+
+
+class PopplerRasterizer(PageRasterizer):
+    """
+    Runs poppler's `pdftoppm` through pdf2image; page ranges are rendered by `thread_count` processes in parallel.
+    """
+    name = "poppler"
+
+    def __init__(self, thread_count: int = config.STORYBOARD_RASTERIZER_THREADS,
+                 batch_size: int = config.STORYBOARD_PAGE_BATCH_SIZE):
+        self.thread_count = thread_count
+        self.batch_size = max(batch_size, thread_count)
+
+    def page_count(self, file_path: str) -> int:
+        return pdfinfo_from_path(file_path)["Pages"]
+
+    def iter_pages(self, file_path: str, output_folder: str, max_side: int = 512):
+        n_pages = self.page_count(file_path)
+        for first_page in range(1, n_pages + 1, self.batch_size):
+            last_page = min(first_page + self.batch_size - 1, n_pages)
+            # pdf2image returns every file of the folder starting with the prefix, so each batch gets its own prefix
+            # to not return the pages of the previous batches again
+            page_paths = convert_from_path(file_path, size=max_side, output_folder=output_folder, fmt='jpeg',
+                                           output_file=f'b{first_page:05d}_', paths_only=True,
+                                           thread_count=self.thread_count, first_page=first_page, last_page=last_page)
+            yield from sorted(page_paths, key=lambda page_path: page_number(os.path.basename(page_path)))
+
+
+class PdfiumRasterizer(PageRasterizer):
+    """
+    Renders pages in-process with PDFium (pypdfium2), without starting processes or writing temporary files.
+    Doesn't need poppler-utils to be installed.
+    """
+    name = "pdfium"
+
+    def __init__(self):
+        if pdfium is None:
+            raise ImportError("pypdfium2 is not installed, use the poppler rasterizer or install pypdfium2.")
+
+    def page_count(self, file_path: str) -> int:
+        pdf = pdfium.PdfDocument(file_path)
+        try:
+            return len(pdf)
+        finally:
+            pdf.close()
+
+    def iter_pages(self, file_path: str, output_folder: str, max_side: int = 512):
+        pdf = pdfium.PdfDocument(file_path)
+        try:
+            for i in range(len(pdf)):
+                page = pdf[i]
+                width, height = page.get_size()
+                # scale the longer side to max_side as pdftoppm's -scale-to does
+                bitmap = page.render(scale=max_side / max(width, height))
+                image = bitmap.to_pil().convert('RGB')
+                page_path = os.path.join(output_folder, f'page{i + 1}.jpg')
+                image.save(page_path, 'JPEG')
+                bitmap.close()
+                page.close()
+                yield page_path
+        finally:
+            pdf.close()
+
+
+RASTERIZERS = {rasterizer.name: rasterizer for rasterizer in [PopplerRasterizer, PdfiumRasterizer]}
+
+
+def get_rasterizer(name: str = config.STORYBOARD_RASTERIZER) -> PageRasterizer:
+    """
+    Returns the rasterizer backend by name ("poppler" or "pdfium"). Falls back to poppler if pypdfium2 is missing.
+    """
+    if name == "pdfium" and pdfium is None:
+        logger.warning("pypdfium2 is not installed, using the poppler rasterizer.")
+        name = "poppler"
+    return RASTERIZERS[name]()
+
+
+def check_pages(page_paths: list, n_pages: int) -> None:
+    """
+    Checks that the rasterizer yielded each page of the document exactly once, in page order.
+
+    Raises:
+        AssertionError: If pages are missing, repeated or out of order.
+    """
+    numbers = [page_number(os.path.basename(page_path)) for page_path in page_paths]
+    assert numbers == list(range(1, n_pages + 1)), f"expected pages 1..{n_pages} in order, got {numbers}"
+
+
+def benchmark(file_path: str, runs: int) -> None:
+    """
+    Compares page throughput and peak memory of the rasterizer backends.
+    Memory of poppler is measured on its child processes, memory of PDFium on the current process.
+    Each run also checks that every page is yielded exactly once, in order, so use a document with more pages
+    than `STORYBOARD_PAGE_BATCH_SIZE` to cover page ranges of several batches.
+    """
+    for name in RASTERIZERS:
+        try:
+            rasterizer = get_rasterizer(name)
+        except ImportError as e:
+            print(f"{name}: {e}")
+            continue
+        durations, n_pages = [], 0
+        for _ in range(runs):
+            output_folder = tempfile.mkdtemp()
+            start = time.perf_counter()
+            page_paths = rasterizer.rasterize(file_path, output_folder)
+            durations.append(time.perf_counter() - start)
+            n_pages = len(page_paths)
+            check_pages(page_paths, rasterizer.page_count(file_path))
+            shutil.rmtree(output_folder, ignore_errors=True)
+        who = resource.RUSAGE_CHILDREN if name == "poppler" else resource.RUSAGE_SELF
+        peak_memory = resource.getrusage(who).ru_maxrss / 1024
+        best = min(durations)
+        print(f"{name}: {n_pages} pages, best {best:.2f}s ({n_pages / best:.1f} pages/s), "
+              f"mean {sum(durations) / runs:.2f}s, peak memory {peak_memory:.0f} MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark storyboard rasterizer backends.")
+    parser.add_argument("file_path", help="Path to a PDF file.")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+    benchmark(args.file_path, args.runs)
@@ -0,0 +1,44 @@
+import logging
+import subprocess
+
+try:
+    import pypdfium2 as pdfium
+except ImportError:  # optional, poppler's pdftotext is used if it's not installed
+    pdfium = None
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_whitespace(text: str) -> str:
+    return " ".join(text.split())
+
+
+def extract_page_texts(file_path: str) -> list:
+    """
+    Extracts the text layer of each page of a PDF file with PDFium, or with poppler's `pdftotext` if pypdfium2
+    is not installed.
+
+    Args:
+        file_path (str): Path to the PDF file.
+
+    Returns:
+        list: Text of each page, in page order. Pages without a text layer (e.g. scans) have empty text.
+    """
+    if pdfium is not None:
+        page_texts = []
+        pdf = pdfium.PdfDocument(file_path)
+        try:
+            for i in range(len(pdf)):
+                page = pdf[i]
+                text_page = page.get_textpage()
+                page_texts.append(text_page.get_text_range())
+                text_page.close()
+                page.close()
+        finally:
+            pdf.close()
+    else:
+        output = subprocess.run(["pdftotext", "-enc", "UTF-8", file_path, "-"],
+                                capture_output=True, text=True, check=True).stdout
+        # pages are terminated by form feeds
+        page_texts = output.split("\f")[:-1] if output.endswith("\f") else output.split("\f")
+    return [normalize_whitespace(text) for text in page_texts]
@@ -1,9 +1,19 @@
+import itertools
 import os
+import shutil
 from src.utils import extract_filename, delete_old_subfolders
-from src.utils.frame_detection import encode_image
+from src.utils.hosted_images import load_urls_manifest, image_url_content
 from src.analysis import client
-from configs.config import STORYBOARD_EXTRACTION_DIR
-from pdf2image import convert_from_path
+from src.analysis.keywords_ext import multi_level_keyword_extraction
+from .video_analysis import describe_and_summarize
+from .map_reduce import should_map_reduce, segment_size_for_latency, map_reduce_describe, describe_segments, merge_contents
+from configs.config import STORYBOARD_EXTRACTION_DIR, STORYBOARD_PAGE_BATCH_SIZE, STORYBOARD_TEXT_MIN_PAGE_CHARS, \
+    STORYBOARD_TEXT_RICH_PAGE_RATIO, STORYBOARD_TEXT_MAX_CHARS, STORYBOARD_PAGE_FILTER, STORYBOARD_GROUP_LATENCY_TARGET, \
+    STORYBOARD_GROUP_BASE_LATENCY, STORYBOARD_GROUP_LATENCY_PER_PAGE, STORYBOARD_PAGE_MAX_SIDE
+from .page_filter import PageFilter
+from .page_detail import PageDetailPlanner, load_page_details
+from .pdf_rasterizers import get_rasterizer, page_number
+from .pdf_text import extract_page_texts
 import logging
 import asyncio
 from typing import List
@@ -12,6 +22,42 @@ logger = logging.getLogger(__name__)
 steps_logger = logging.getLogger("steps_info")
 
 
+def iter_storyboard_pages(file_path: str, batch_size: int = STORYBOARD_PAGE_BATCH_SIZE):
+    """
+    Converts a PDF file to images in a folder with the same name as the PDF file, yielding the pages in batches
+    as they are written. Pages are written as JPEGs by the rasterizer backend selected by `STORYBOARD_RASTERIZER`.
+    Near-blank and duplicate pages are dropped if `STORYBOARD_PAGE_FILTER` is enabled. The detail level of each
+    page is planned within `STORYBOARD_IMAGE_TOKEN_BUDGET` and the page is resized for it, keeping its aspect ratio.
+
+    Args:
+        file_path (str): Path to the PDF file.
+        batch_size (int): Maximum number of pages in a batch.
+
+    Yields:
+        list: Paths to the extracted images of the next batch and their detail levels as tuples, in page order.
+    """
+    steps_logger.info(f"Started extracting images from storyboard {file_path}")
+    delete_old_subfolders(STORYBOARD_EXTRACTION_DIR)
+    output_folder = os.path.join(STORYBOARD_EXTRACTION_DIR, extract_filename(file_path))
+    shutil.rmtree(output_folder, ignore_errors=True)  # pages of a previous upload with the same name
+    os.makedirs(output_folder, exist_ok=True)
+
+    rasterizer = get_rasterizer()
+    planner = PageDetailPlanner(rasterizer.page_count(file_path))
+    pages = rasterizer.iter_pages(file_path, output_folder, max_side=STORYBOARD_PAGE_MAX_SIDE)
+    page_filter = PageFilter() if STORYBOARD_PAGE_FILTER else None
+    while batch := list(itertools.islice(pages, batch_size)):
+        if page_filter is not None:
+            kept = page_filter.filter(batch)
+            planner.drop(len(batch) - len(kept))
+            batch = kept
+        if batch:
+            yield list(zip(batch, planner.plan(batch)))
+    if page_filter is not None:
+        page_filter.log_summary(file_path)
+    planner.save(output_folder, file_path)
+
+
 def pdf_to_images(file_path: str):
     """
     Converts a PDF file to images and saves them in a folder with the same name as the PDF file.
@@ -20,27 +66,44 @@ def pdf_to_images(file_path: str):
         file_path (str): Path to the PDF file.
 
     Returns:
-        list: List of extracted images
+        list: Paths to the extracted images, in page order
     """
     try:
-        steps_logger.info(f"Started extracting images from storyboard {file_path}")
-        delete_old_subfolders(STORYBOARD_EXTRACTION_DIR)
-        output_folder = os.path.join(STORYBOARD_EXTRACTION_DIR, extract_filename(file_path))
-        os.makedirs(output_folder, exist_ok=True)
-
-        images = convert_from_path(file_path, size=(512, 512))
-
-        for i in range(len(images)):
-            images[i].save(os.path.join(output_folder, 'page' + str(i) + '.jpg'), 'JPEG')
-
-        return images
+        return [page_path for batch in iter_storyboard_pages(file_path) for page_path, _ in batch]
     except Exception as e:
         logger.exception(f"Error while extracting images from storyboard {file_path}: {e}")
         raise e
 
 
+def encode_pages(pages: list) -> list:
+    return [image_url_content(page_path, detail, {}) for page_path, detail in pages]
+
+
+async def extract_storyboard_pages_contents(file_path: str) -> list:
+    """
+    Converts a PDF file to images and builds image message contents from them. Each batch of pages is encoded
+    while the next one is rasterized, and only the encoded pages are kept in memory.
+
+    Args:
+        file_path (str): Path to the storyboard PDF file.
+
+    Returns:
+        list: Image contents for the chat completion request, in page order.
+    """
+    batches = iter_storyboard_pages(file_path)
+    contents = []
+    next_batch = asyncio.create_task(asyncio.to_thread(next, batches, None))
+    while (batch := await next_batch) is not None:
+        next_batch = asyncio.create_task(asyncio.to_thread(next, batches, None))
+        contents += await asyncio.to_thread(encode_pages, batch)
+    steps_logger.info(f"Extracted and encoded {len(contents)} pages of storyboard {file_path}")
+    return contents
+
+
 async def analyze_storyboard(file_path : str, storyboard_description_prompt: str, keyword_extraction_prompt: str | List, 
-                             storyboard_summarization_prompt: str, extract_images=True, gpt_model: str ='gpt-4o'):
+                             storyboard_summarization_prompt: str, extract_images=True, gpt_model: str ='gpt-4o',
+                             fused: bool = False, single_call_keywords: bool = False, use_text_layer: bool = False,
+                             description: str = None):
     """
     Analyzes a storyboard by generating a description, extracting keywords and summarizing the description.
 
@@ -52,6 +115,13 @@ async def analyze_storyboard(file_path : str, storyboard_description_prompt: str
         storyboard_summarization_prompt (str): Prompt for summarizing the storyboard description.
         extract_images (bool): Whether to extract images from the storyboard PDF file.
         gpt_model (str): OpenAI's GPT model to use for analysis.
+        fused (bool): Whether to get the description and the summary in one structured output call.
+        single_call_keywords (bool): Whether to extract keywords for all prompts in one structured output call
+            (only if 4 prompts are provided). Falls back to one call per prompt if the output fails validation.
+        use_text_layer (bool): Whether to describe text-rich storyboards from their PDF text layer
+            and the images of the pages with little text only.
+        description (str): Description of the storyboard from a previous analysis. If provided,
+            the pages are not extracted or described again.
 
     Returns:
         tuple: Contains the storyboard description, extracted keywords and summarization.
@@ -59,20 +129,36 @@ async def analyze_storyboard(file_path : str, storyboard_description_prompt: str
     """
     try:
         steps_logger.info(f"Started analyzing storyboard for {file_path}")
-        if extract_images:
-            pdf_to_images(file_path)
-        description = await describe_storyboard(file_path, storyboard_description_prompt, gpt_model)
-        summary_task = asyncio.create_task(storyboard_summarization(storyboard_summarization_prompt, description, gpt_model))
+        if description is not None:
+            steps_logger.info(f"Using the provided description of storyboard {file_path}")
+            summary_task = asyncio.create_task(storyboard_summarization(storyboard_summarization_prompt, description, gpt_model))
+        else:
+            page_contents = await extract_storyboard_pages_contents(file_path) if extract_images else None
+            if fused:
+                description, summary = await describe_and_summarize_storyboard(
+                    file_path, storyboard_description_prompt, storyboard_summarization_prompt, page_contents, use_text_layer)
+                summary_task = None
+            else:
+                description = await describe_storyboard(file_path, storyboard_description_prompt, gpt_model, page_contents,
+                                                        use_text_layer)
+                summary_task = asyncio.create_task(
+                    storyboard_summarization(storyboard_summarization_prompt, description, gpt_model))
 
         if isinstance(keyword_extraction_prompt, str): 
             keywords = (await storyboard_keyword_extraction(keyword_extraction_prompt, description, gpt_model))
         else:
-            keywords_tasks = []
-            for prompt in keyword_extraction_prompt:
-                keywords_tasks.append(asyncio.create_task(storyboard_keyword_extraction(prompt, description, gpt_model)))
-            keywords = await asyncio.gather(*keywords_tasks)
-
-        summary = await summary_task
+            keywords = None
+            if single_call_keywords and len(keyword_extraction_prompt) == 4:
+                keywords = await multi_level_keyword_extraction(
+                    keyword_extraction_prompt, [{"type": "text", "text": description}], "storyboard_keywords")
+            if keywords is None:
+                keywords_tasks = []
+                for prompt in keyword_extraction_prompt:
+                    keywords_tasks.append(asyncio.create_task(storyboard_keyword_extraction(prompt, description, gpt_model)))
+                keywords = await asyncio.gather(*keywords_tasks)
+
+        if summary_task is not None:
+            summary = await summary_task
         steps_logger.info(f"Finished analyzing storyboard for {file_path}.")
         return description, keywords, summary
 
@@ -81,32 +167,39 @@ async def analyze_storyboard(file_path : str, storyboard_description_prompt: str
         raise e
 
 
-async def describe_storyboard(file_path: str, storyboard_description_prompt: str, gpt_model='gpt-4o') -> str:
+async def describe_storyboard(file_path: str, storyboard_description_prompt: str, gpt_model='gpt-4o',
+                              page_contents: list = None, use_text_layer: bool = False) -> str:
     """
     Generates a description of the storyboard based on extracted images.
+    Large storyboards are described in page groups concurrently, and the group descriptions are merged.
 
     Args:
         file_path (str): Path to the storyboard PDF file.
         storyboard_description_prompt (str): Prompt for generating the storyboard description.
+        page_contents (list): Image contents of the pages, read from the extracted pages if not provided.
+        use_text_layer (bool): Whether to use the PDF text layer of text-rich storyboards.
 
     Returns:
         str: Description of the storyboard.
     """
-    # Extract images from the storyboard PDF file
-    storyboard_folder = os.path.join(STORYBOARD_EXTRACTION_DIR, extract_filename(file_path))
-    storyboard_pages = [encode_image(os.path.join(storyboard_folder, f)) for f in os.listdir(storyboard_folder) if f.endswith('.jpg')]
-
-    contents = [{"type": "text", "text": storyboard_description_prompt}] + [
-        {'type': 'image_url', 'image_url': {"url": f"data:image/jpeg;base64,{base64_image}", "detail": "low"}} for base64_image in
-        storyboard_pages]
+    page_parts = storyboard_page_parts(file_path, page_contents, use_text_layer)
     
     if gpt_model == "gpt-4 + vision": 
         gpt_model = "gpt-4-vision-preview"
 
+    group_size = await storyboard_group_size(page_parts)
+    if group_size is not None:
+        description = await map_reduce_describe(page_parts, storyboard_description_prompt, gpt_model, "storyboard_description",
+                                                "storyboard", group_size)
+        steps_logger.info(f"Finished describing storyboard.\nStoryboard Description: {description}")
+        return description
+
+    contents = [{"type": "text", "text": storyboard_description_prompt}] + page_parts
     response = await client.chat.completions.create(
         model=gpt_model,
         messages=[{"role": "user", "content": contents}],
-        max_tokens=700
+        max_tokens=700,
+        stage="storyboard_description"
     )
 
     description = response.choices[0].message.content
@@ -114,18 +207,148 @@ async def describe_storyboard(file_path: str, storyboard_description_prompt: str
     return description
 
 
-async def storyboard_keyword_extraction(keyword_extraction_prompt: str, storyboard_description: str, gpt_model='gpt-4o') -> list:
+async def describe_and_summarize_storyboard(file_path: str, storyboard_description_prompt: str,
+                                            storyboard_summarization_prompt: str, page_contents: list = None,
+                                            use_text_layer: bool = False):
+    """
+    Generates a description of the storyboard and its summary in a single structured output call.
+
+    Args:
+        file_path (str): Path to the storyboard PDF file.
+        storyboard_description_prompt (str): Prompt for generating the storyboard description.
+        storyboard_summarization_prompt (str): Prompt for summarizing the storyboard description.
+        page_contents (list): Image contents of the pages, read from the extracted pages if not provided.
+        use_text_layer (bool): Whether to use the PDF text layer of text-rich storyboards.
+
+    Returns:
+        tuple: Contains the storyboard description and summarization.
+    """
+    page_parts = storyboard_page_parts(file_path, page_contents, use_text_layer)
+    group_size = await storyboard_group_size(page_parts)
+    if group_size is not None:
+        # page groups are described separately, the merge call also returns the summary
+        group_descriptions = await describe_segments(page_parts, storyboard_description_prompt, "gpt-4o-2024-08-06",
+                                                     "storyboard_description_summary", "storyboard", group_size)
+        contents = merge_contents(group_descriptions, storyboard_description_prompt, "storyboard")
+    else:
+        contents = [{"type": "text", "text": storyboard_description_prompt}] + page_parts
+    description, summarization = await describe_and_summarize(contents, storyboard_summarization_prompt,
+                                                              "storyboard_description_summary")
+    steps_logger.info(f"Finished describing and summarizing storyboard.\nStoryboard Description: {description}\n"
+                      f"Summarization: {summarization}")
+    return description, summarization
+
+
+def storyboard_page_paths(storyboard_folder: str) -> list:
+    """
+    Returns paths to the extracted pages of the storyboard, in page order.
+    """
+    pages = sorted((f for f in os.listdir(storyboard_folder) if f.endswith('.jpg')), key=page_number)
+    return [os.path.join(storyboard_folder, f) for f in pages]
+
+
+def storyboard_pages_contents(file_path: str) -> list:
+    """
+    Builds image message contents from the pages extracted from the storyboard.
+
+    Args:
+        file_path (str): Path to the storyboard PDF file.
+
+    Returns:
+        list: Image contents for the chat completion request.
+    """
+    storyboard_folder = os.path.join(STORYBOARD_EXTRACTION_DIR, extract_filename(file_path))
+    urls = load_urls_manifest(storyboard_folder)
+    details = load_page_details(storyboard_folder)
+    return [image_url_content(page_path, details.get(os.path.basename(page_path), "low"), urls)
+            for page_path in storyboard_page_paths(storyboard_folder)]
+
+
+def storyboard_text_layer_contents(file_path: str) -> list | None:
+    """
+    Builds description contents of a text-rich storyboard: the text layer of all pages and the images of only
+    the extracted pages with little text (usually the frames), or of the first page if all pages have text.
+
+    Args:
+        file_path (str): Path to the storyboard PDF file.
+
+    Returns:
+        list | None: Contents for the chat completion request,
+            None if the storyboard has too few pages with text to be described from it.
+    """
+    page_texts = extract_page_texts(file_path)
+    text_pages = {i + 1 for i, text in enumerate(page_texts) if len(text) >= STORYBOARD_TEXT_MIN_PAGE_CHARS}
+    if not page_texts or len(text_pages) < STORYBOARD_TEXT_RICH_PAGE_RATIO * len(page_texts):
+        return None
+
+    storyboard_folder = os.path.join(STORYBOARD_EXTRACTION_DIR, extract_filename(file_path))
+    page_paths = storyboard_page_paths(storyboard_folder)
+    image_paths = [path for path in page_paths if page_number(os.path.basename(path)) not in text_pages] or page_paths[:1]
+    urls = load_urls_manifest(storyboard_folder)
+    details = load_page_details(storyboard_folder)
+    image_contents = [image_url_content(page_path, details.get(os.path.basename(page_path), "low"), urls)
+                      for page_path in image_paths]
+
+    text = "\n".join(f"Page {i + 1}: {page_text}" for i, page_text in enumerate(page_texts) if page_text)
+    steps_logger.info(f"Describing storyboard {file_path} from its text layer ({len(text)} characters) "
+                      f"and {len(image_contents)} of {len(page_texts)} pages.")
+    return [{"type": "text", "text": "Storyboard text:\n" + text[:STORYBOARD_TEXT_MAX_CHARS]}] + image_contents
+
+
+def storyboard_page_parts(file_path: str, page_contents: list = None, use_text_layer: bool = False) -> list:
+    """
+    Builds the contents of the storyboard description request that represent the pages.
+
+    Args:
+        file_path (str): Path to the storyboard PDF file.
+        page_contents (list): Image contents of the pages, read from the extracted pages if not provided.
+        use_text_layer (bool): Whether text-rich storyboards are sent as their text layer with fewer images.
+
+    Returns:
+        list: Contents for the chat completion request, without the prompt.
+    """
+    if page_contents is None:
+        page_contents = storyboard_pages_contents(file_path)
+    if use_text_layer:
+        try:
+            page_contents = storyboard_text_layer_contents(file_path) or page_contents
+        except Exception as e:
+            logger.error(f"Failed to extract text layer of storyboard {file_path}, sending all pages: {e}")
+    return page_contents
+
+
+async def storyboard_group_size(page_parts: list) -> int | None:
+    """
+    Returns the number of pages per group if the storyboard should be described in page groups, i.e. it has
+    more pages than can be described within `STORYBOARD_GROUP_LATENCY_TARGET` or its payload is too large.
+    Storyboards described from their text layer are always described in one call.
+
+    Returns:
+        int | None: Number of pages per group, None if the storyboard should be described in one call.
+    """
+    if any(part["type"] != "image_url" for part in page_parts):
+        return None
+    group_size = await segment_size_for_latency(["storyboard_description_map", "storyboard_description_summary_map"],
+                                                STORYBOARD_GROUP_LATENCY_TARGET, STORYBOARD_GROUP_BASE_LATENCY,
+                                                STORYBOARD_GROUP_LATENCY_PER_PAGE)
+    return group_size if len(page_parts) > group_size or should_map_reduce(page_parts) else None
+
+
+async def storyboard_keyword_extraction(keyword_extraction_prompt: str, storyboard_description: str, gpt_model='gpt-4o',
+                                        use_cache: bool = True) -> list:
     """
     Extracts keywords from the storyboard description using OpenAI's GPT model.
 
     Args:
         keyword_extraction_prompt (str): Prompt for extracting keywords from the storyboard description.
         storyboard_description (str): Description of the storyboard.
+        use_cache (bool): Whether a cached response for the same request can be returned.
 
     Returns:
         list: Extracted keywords.
     """
-    contents = [{"type": "text", "text": keyword_extraction_prompt}] + [{"type": "text", "text": storyboard_description}]
+    # shared description goes first and the per-level prompt last, so the calls share a cacheable prefix
+    contents = [{"type": "text", "text": storyboard_description}, {"type": "text", "text": keyword_extraction_prompt}]
 
     if gpt_model == "gpt-4 + vision": 
         gpt_model = "gpt-4"
@@ -133,6 +356,8 @@ async def storyboard_keyword_extraction(keyword_extraction_prompt: str, storyboa
     response = await client.chat.completions.create(
         model=gpt_model,
         messages=[{"role": "user", "content": contents}],
+        use_cache=use_cache,
+        stage="storyboard_keywords"
     )
 
     keywords = response.choices[0].message.content.rstrip(",").replace(".", "").lower()
@@ -149,7 +374,7 @@ async def storyboard_summarization(storyboard_summarization_prompt, storyboard_d
     Returns:
         str: Summarized description of the storyboard.
     """
-    contents = [{"type": "text", "text": storyboard_summarization_prompt}] + [{"type": "text", "text": storyboard_description_output}]
+    contents = [{"type": "text", "text": storyboard_description_output}, {"type": "text", "text": storyboard_summarization_prompt}]
 
     if gpt_model == "gpt-4 + vision": 
         gpt_model = "gpt-4"
@@ -158,18 +383,10 @@ async def storyboard_summarization(storyboard_summarization_prompt, storyboard_d
         model=gpt_model,
         max_tokens=500,
         messages=[{"role": "user", "content": contents}],
+        stage="storyboard_summary"
     )
 
     summarization = response.choices[0].message.content
 
     return summarization
 
-
-# def extract_text_from_pdf(inputpath):
-#     doc = fitz.open(inputpath)
-#     all_text = ""
-#     for page in doc:
-#         text = page.get_text()
-#         all_text += text + "\n"
-#     all_text = all_text.strip()
-#     return all_text
\ No newline at end of file
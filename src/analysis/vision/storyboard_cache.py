@@ -0,0 +1,115 @@
+import hashlib
+import json
+import logging
+from configs import config
+from src.utils.disk_cache import DiskCache
+
+logger = logging.getLogger(__name__)
+steps_logger = logging.getLogger("steps_info")
+
+
+def file_hash(file_path: str) -> str:
+    """
+    Returns the SHA-256 hex digest of the file content.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# model of the structured output calls (fused description and summary, single call keyword extraction)
+STRUCTURED_OUTPUT_MODEL = "gpt-4o-2024-08-06"
+
+
+def pages_options() -> dict:
+    """
+    Returns the configuration of page filtering and detail planning, which changes the pages the model sees.
+    """
+    return {"filter": config.STORYBOARD_PAGE_FILTER, "blank_max_std": config.STORYBOARD_BLANK_MAX_STD,
+            "blank_max_edge_density": config.STORYBOARD_BLANK_MAX_EDGE_DENSITY,
+            "blank_few_edges_max_std": config.STORYBOARD_BLANK_FEW_EDGES_MAX_STD,
+            "duplicate_max_distance": config.STORYBOARD_DUPLICATE_MAX_DISTANCE,
+            "token_budget": config.STORYBOARD_IMAGE_TOKEN_BUDGET, "max_side": config.STORYBOARD_PAGE_MAX_SIDE,
+            "high_detail_min_density": config.STORYBOARD_HIGH_DETAIL_MIN_DENSITY}
+
+
+def _key(kind: str, payload: dict) -> str:
+    return kind + ":" + hashlib.sha256(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class StoryboardCache:
+    """
+    Caches results of storyboard analyses on disk in two levels, so a re-sent storyboard is not analyzed again:
+        - the description, keyed by the PDF content hash, the description prompt, the model that describes it
+          (the structured output model if the description is fused with the summary), the text layer and fusion
+          options, the description stage model and the page filtering and detail configuration;
+        - the keywords and summary, keyed by the description key, the keyword and summary prompts, the model,
+          the fusion and single call options and the summary and keywords stage models.
+    If only the keyword or summary prompts changed, the cached description is reused.
+    """
+    def __init__(self, enabled: bool = config.STORYBOARD_CACHE_ENABLED):
+        self.enabled = enabled
+        self._store = None
+
+    @property
+    def store(self) -> DiskCache:
+        if self._store is None:
+            self._store = DiskCache(config.STORYBOARD_CACHE_PATH, config.STORYBOARD_CACHE_TTL,
+                                    config.STORYBOARD_CACHE_MAX_ENTRIES, config.STORYBOARD_CACHE_MAX_SIZE_MB)
+        return self._store
+
+    @staticmethod
+    def description_key(pdf_hash: str, settings: dict) -> str:
+        """
+        Args:
+            pdf_hash (str): SHA-256 of the storyboard PDF.
+            settings (dict): API settings of the request.
+        """
+        fused = settings.get("fuse_description_and_summary", False)
+        return _key("description", {
+            "pdf": pdf_hash, "prompt": settings["storyboard_description_prompt"],
+            "model": STRUCTURED_OUTPUT_MODEL if fused else settings["gpt_model"], "fused": fused,
+            "text_layer": settings.get("use_storyboard_text_layer", False),
+            "stage_model": settings.get("stage_models", {}).get("description"), "pages": pages_options()})
+
+    @staticmethod
+    def result_key(description_key: str, keyword_prompts: list, settings: dict) -> str:
+        """
+        Args:
+            description_key (str): Key of the description the result is based on.
+            keyword_prompts (list): Keyword extraction prompts of the creativity levels.
+            settings (dict): API settings of the request.
+        """
+        stage_models = settings.get("stage_models", {})
+        return _key("result", {
+            "description": description_key, "keyword_prompts": keyword_prompts,
+            "summarization_prompt": settings["storyboard_summarization_prompt"], "model": settings["gpt_model"],
+            "fused": settings.get("fuse_description_and_summary", False),
+            "single_call": settings.get("single_call_keyword_extraction", False),
+            "stage_models": [stage_models.get("summary"), stage_models.get("keywords")]})
+
+    def get(self, key: str):
+        """
+        Returns the cached value, or None if there is none or caching is disabled.
+        """
+        if not self.enabled:
+            return None
+        try:
+            value = self.store.get(key)
+        except Exception as e:
+            logger.error(f"Failed to read storyboard cache: {e}")
+            return None
+        return json.loads(value) if value is not None else None
+
+    def set(self, key: str, value) -> None:
+        if not self.enabled:
+            return
+        try:
+            self.store.set(key, json.dumps(value))
+        except Exception as e:
+            logger.error(f"Failed to write storyboard cache: {e}")
+
+
+storyboard_cache = StoryboardCache()
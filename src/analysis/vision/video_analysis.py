@@ -1,8 +1,11 @@
 import os
 from configs.config import KEYFRAMES_DIR, UPLOAD_VIDEO_DIR
 from src.utils import extract_filename, delete_old_files
-from src.utils.frame_detection import encode_image
+from src.utils.frame_detection import load_frames_plan
+from src.utils.hosted_images import load_urls_manifest, image_url_content
 from src.analysis import client
+from .map_reduce import should_map_reduce, map_reduce_describe, describe_segments, merge_contents
+from pydantic import BaseModel
 import logging
 from typing import Tuple
 
@@ -10,8 +13,14 @@ logger = logging.getLogger(__name__)
 steps_logger = logging.getLogger("steps_info")
 
 
+class DescriptionSummary(BaseModel):
+    description: str
+    summary: str
+
+
 async def video_analysis(file_path: str, video_description_prompt: str,
-                         video_summarization_prompt: str, gpt_model: str = 'gpt-4o') -> Tuple[str, str]:
+                         video_summarization_prompt: str, gpt_model: str = 'gpt-4o',
+                         fused: bool = False) -> Tuple[str, str]:
     """
     Analyzes a video by generating a description and summarizing the description.
     Note: call this function after frames have been extracted!
@@ -21,6 +30,7 @@ async def video_analysis(file_path: str, video_description_prompt: str,
         video_description_prompt (str): Prompt for generating the video description.
         video_summarization_prompt (str): Prompt for summarizing the video description.
         gpt_model (str): OpenAI's GPT model to use for analysis
+        fused (bool): Whether to get the description and the summary in one structured output call.
 
     Returns:
         tuple: Contains the video description and summarization
@@ -29,8 +39,12 @@ async def video_analysis(file_path: str, video_description_prompt: str,
     try:
         steps_logger.info(f"Started analyzing video for {file_path}")
         delete_old_files(UPLOAD_VIDEO_DIR)
-        description = await describe_video(file_path, video_description_prompt, gpt_model)
-        video_summary = await video_summarization(video_summarization_prompt, description, gpt_model)
+        if fused:
+            description, video_summary = await describe_and_summarize_video(
+                file_path, video_description_prompt, video_summarization_prompt)
+        else:
+            description = await describe_video(file_path, video_description_prompt, gpt_model)
+            video_summary = await video_summarization(video_summarization_prompt, description, gpt_model)
 
         steps_logger.info(f"Finished analyzing video for {file_path}")
         return description, video_summary
@@ -43,6 +57,7 @@ async def video_analysis(file_path: str, video_description_prompt: str,
 async def describe_video(file_path: str, video_description_prompt: str, gpt_model: str = 'gpt-4o') -> str:
     """
     Generates a description of the video based on extracted keyframes.
+    If there are too many keyframes for one request, they are described in segments which are merged afterwards.
 
     Args:
         file_path (str): Path to the video file.
@@ -53,21 +68,22 @@ async def describe_video(file_path: str, video_description_prompt: str, gpt_mode
         str: Description of the video.
     """
     steps_logger.info(f"Started describing video {file_path}")
-    filename = extract_filename(file_path)
-    frames_folder = os.path.join(KEYFRAMES_DIR, filename)
-    frames = [encode_image(os.path.join(frames_folder, name)) for name in [
-        f"keyframe{i+1}.jpg" for i in range(len(os.listdir(frames_folder)))]]
-
-    contents = [{"type": "text", "text": video_description_prompt}] + [
-        {'type': 'image_url', 'image_url': {"url": f"data:image/jpeg;base64,{base64_image}", "detail": "low"}} for base64_image in frames]
+    frames_contents = video_frames_contents(file_path)
 
     if gpt_model == "gpt-4 + vision": 
         gpt_model = "gpt-4-vision-preview"
-    
+
+    if should_map_reduce(frames_contents):
+        description = await map_reduce_describe(frames_contents, video_description_prompt, gpt_model, "video_description")
+        steps_logger.info(f"Finished describing video.\nVideo Description: {description}")
+        return description
+
+    contents = [{"type": "text", "text": video_description_prompt}] + frames_contents
     response = await client.chat.completions.create(
         model=gpt_model,
         messages=[{"role": "user", "content": contents}],
-        max_tokens=700
+        max_tokens=700,
+        stage="video_description"
     )
 
     description = response.choices[0].message.content
@@ -75,6 +91,85 @@ async def describe_video(file_path: str, video_description_prompt: str, gpt_mode
     return description
 
 
+async def describe_and_summarize_video(file_path: str, video_description_prompt: str,
+                                       video_summarization_prompt: str) -> Tuple[str, str]:
+    """
+    Generates a description of the video and its summary in a single structured output call.
+
+    Args:
+        file_path (str): Path to the video file.
+        video_description_prompt (str): Prompt for generating the video description.
+        video_summarization_prompt (str): Prompt for summarizing the video description.
+
+    Returns:
+        tuple: Contains the video description and summarization.
+    """
+    steps_logger.info(f"Started describing and summarizing video {file_path}")
+    frames_contents = video_frames_contents(file_path)
+    if should_map_reduce(frames_contents):
+        # segments are described separately, the merge call also returns the summary
+        segment_descriptions = await describe_segments(frames_contents, video_description_prompt, "gpt-4o-2024-08-06",
+                                                       "video_description_summary")
+        contents = merge_contents(segment_descriptions, video_description_prompt)
+    else:
+        contents = [{"type": "text", "text": video_description_prompt}] + frames_contents
+    description, summarization = await describe_and_summarize(contents, video_summarization_prompt, "video_description_summary")
+    steps_logger.info(f"Finished describing and summarizing video.\nVideo Description: {description}\n"
+                      f"Summarization: {summarization}")
+    return description, summarization
+
+
+async def describe_and_summarize(contents: list, summarization_prompt: str, stage: str = "description_summary") -> Tuple[str, str]:
+    """
+    Asks the vision model for a description and a summary of that description in one structured output call.
+
+    Args:
+        contents (list): Message contents with the description prompt and the images.
+        summarization_prompt (str): Prompt for summarizing the description.
+        stage (str): Name of the pipeline stage, used for reporting.
+
+    Returns:
+        tuple: Contains the description and the summary.
+    """
+    contents = contents + [{"type": "text", "text": "Put your response in the `description` field. "
+                                                    "Then summarize that description following the instructions below "
+                                                    "and put the result in the `summary` field.\n" + summarization_prompt}]
+    response = await client.beta.chat.completions.parse(
+        model="gpt-4o-2024-08-06",
+        messages=[{"role": "user", "content": contents}],
+        response_format=DescriptionSummary,
+        max_tokens=1000,
+        stage=stage
+    )
+    parsed = response.choices[0].message.parsed
+    if parsed is None:
+        raise ValueError(f"Model refused to describe the images: {response.choices[0].message.refusal}")
+    return parsed.description, parsed.summary
+
+
+def video_frames_contents(file_path: str) -> list:
+    """
+    Builds image message contents from the keyframes extracted for the video.
+
+    Args:
+        file_path (str): Path to the video file.
+
+    Returns:
+        list: Image contents for the chat completion request.
+    """
+    filename = extract_filename(file_path)
+    frames_folder = os.path.join(KEYFRAMES_DIR, filename)
+    n_keyframes = len([name for name in os.listdir(frames_folder) if name.startswith("keyframe") and name.endswith(".jpg")])
+
+    # frames planned by the image token budget are sent with the planned detail level
+    plan = load_frames_plan(file_path)
+    detail = plan["detail"] if plan else "low"
+
+    # frames uploaded to S3 are sent as presigned URLs
+    urls = load_urls_manifest(frames_folder)
+    return [image_url_content(os.path.join(frames_folder, f"keyframe{i+1}.jpg"), detail, urls) for i in range(n_keyframes)]
+
+
 async def video_keyword_extraction(keyword_extraction_prompt: str, video_description_output: str, gpt_model: str = 'gpt-4o'):
     """
     Extracts keywords from the video description.
@@ -88,7 +183,8 @@ async def video_keyword_extraction(keyword_extraction_prompt: str, video_descrip
         str: Extracted keywords from the video description.
     """
     steps_logger.info(f"Started extracting keywords from video description. Video Description: {video_description_output[:100]}...")
-    contents = [{"type": "text", "text": keyword_extraction_prompt}] + [{"type": "text", "text": video_description_output}]
+    contents = [{"type": "text", "text": "Video Description: " + video_description_output},
+                {"type": "text", "text": keyword_extraction_prompt}]
 
     if gpt_model == "gpt-4 + vision": 
         gpt_model = "gpt-4"
@@ -96,6 +192,7 @@ async def video_keyword_extraction(keyword_extraction_prompt: str, video_descrip
     response = await client.chat.completions.create(
         model=gpt_model,
         messages=[{"role": "user", "content": contents}],
+        stage="video_keywords"
     )
 
     keywords = response.choices[0].message.content.rstrip(",").replace(".", "").lower()
@@ -116,7 +213,9 @@ async def video_summarization(video_summarization_prompt, video_description, gpt
         str: Summarized video description.
     """
     steps_logger.info(f"Started summarizing video description. Video Description: {video_description[:100]}...")
-    contents = [{"type": "text", "text": video_summarization_prompt}] + [{"type": "text", "text": video_description}]
+    # same prefix as the keyword extraction calls, so the provider can reuse the cached description
+    contents = [{"type": "text", "text": "Video Description: " + video_description},
+                {"type": "text", "text": video_summarization_prompt}]
 
     if gpt_model == "gpt-4 + vision": 
         gpt_model = "gpt-4"
@@ -125,6 +224,7 @@ async def video_summarization(video_summarization_prompt, video_description, gpt
         model=gpt_model,
         max_tokens=500,
         messages=[{"role": "user", "content": contents}],
+        stage="video_summary"
     )
 
     summarization = response.choices[0].message.content
@@ -5,10 +5,9 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from multiprocessing import Process, Lock
 import uuid
-import httpx
 import multiprocessing, threading, queue
 import logging
-from typing import Dict
+from typing import Dict, List
 from src.external_api import cyanite, suno_api
 from src.utils import load_settings, setup_logging
 from configs import config
@@ -17,8 +16,12 @@ from src.api_logic.queue_processors import (
     process_frames_ext_queue, process_audio_queue, process_queue_wrapper, process_storyboard_queue, s3_upload_worker)
 import os
 from src.analysis.audio import generate_track_title
+from src.analysis.usage_tracking import usage_tracker
+from src.analysis.llm_cache import cache_stats
+from src.analysis.gateway import gateway_stats
+from src.analysis.keywords_ext import prepare_assistant_knowledge, load_knowledge_index
 from src.utils.yt_fetcher import download_audio_from_yt
-from src.api_logic.s3_handler import process_suno_audio, generate_s3_url
+from src.api_logic.s3_handler import process_suno_audio, generate_s3_url, ensure_hosted_images_expiration
 import nest_asyncio
 nest_asyncio.apply()
 
@@ -75,6 +78,48 @@ async def quota_information_endpoint() -> JSONResponse:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/llm_metrics")
+async def llm_metrics_endpoint(since_seconds: float = 3600) -> JSONResponse:
+    """
+    Endpoint to retrieve token, payload and latency metrics of model calls.
+
+    Args:
+        since_seconds (float): Only calls made in the last `since_seconds` are aggregated.
+
+    Returns:
+        JSONResponse: A JSON response containing usage per stage and model, and cache/gateway counters of the API process.
+    """
+    try:
+        metrics = await asyncio.to_thread(usage_tracker.metrics, since_seconds)
+        metrics["cache"] = cache_stats()
+        metrics["gateway"] = gateway_stats()
+        return JSONResponse(content=metrics, status_code=200)
+    except Exception as e:
+        error_message = f"Error retrieving model call metrics: {str(e)}"
+        logger.error(error_message)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/llm_usage/{request_id}")
+async def llm_usage_endpoint(request_id: str = Path(..., description="UUID of the video or storyboard")) -> JSONResponse:
+    """
+    Endpoint to retrieve token, payload and latency usage of model calls made for one request.
+
+    Args:
+        request_id (str): UUID of the processed video or storyboard.
+
+    Returns:
+        JSONResponse: A JSON response containing usage per stage and model, and totals with estimated cost.
+    """
+    try:
+        usage = await asyncio.to_thread(usage_tracker.request_summary, request_id)
+        return JSONResponse(content=usage, status_code=200)
+    except Exception as e:
+        error_message = f"Error retrieving usage for request {request_id}: {str(e)}"
+        logger.error(error_message)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @app.post("/upload_video/")
 async def upload_video_endpoint(file: UploadFile = File(...)) -> JSONResponse:
     """
@@ -184,6 +229,38 @@ async def search_music_weighted_endpoint(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/search_music_weighted_batch/")
+async def search_music_weighted_batch_endpoint(
+        keywords_weights_sets: List[Dict[str, float]]
+) -> JSONResponse:
+    """
+    Endpoint to search music based on several dictionaries of words and their weights (e.g. one per creativity level)
+    with one request to Cyanite.
+
+    Args:
+        keywords_weights_sets (List[Dict[str, float]]): Dictionaries of words and their weights.
+
+    Returns:
+        JSONResponse: A JSON response containing a list of music results and aggregated keywords for each dictionary.
+    """
+    if len(keywords_weights_sets) > config.CYANITE_MAX_BATCH_SEARCHES:
+        raise HTTPException(status_code=422, detail=f"At most {config.CYANITE_MAX_BATCH_SEARCHES} sets of weighted "
+                                                    f"keywords can be searched in one request.")
+    try:
+        logger.info(f"Searching music with {len(keywords_weights_sets)} sets of weighted keywords: {keywords_weights_sets}")
+        aggregated_keywords = [apply_weight(keywords_weights) for keywords_weights in keywords_weights_sets]
+        music_results = await cyanite.songsearch_batch(aggregated_keywords)
+        logger.info(f"Successfully searched music with {len(keywords_weights_sets)} sets of weighted keywords.")
+        return JSONResponse(content={"results": [{"music_results": results, "cyanite_query": query}
+                                                 for results, query in zip(music_results, aggregated_keywords)]},
+                            status_code=200)
+
+    except Exception as e:
+        error_message = f"Error searching music with weighted keywords: {str(e)}"
+        logger.error(error_message)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @app.post("/search_music_text/")
 async def search_music_text_endpoint(text_input: str) -> JSONResponse:
     """
@@ -283,8 +360,7 @@ async def search_spotify_music_endpoint(
     """
     try:
         logger.info(f"Searching Spotify music with track ID: {track_id}")
-        async with httpx.AsyncClient() as client:
-            music_results = await cyanite.search_spotify_music(client, track_id)
+        music_results = await cyanite.search_spotify_music(track_id)
         logger.info(f"Successfully searched Spotify music with track ID: {track_id}")
         return JSONResponse(content={"music_results": music_results}, status_code=200)
 
@@ -307,8 +383,7 @@ async def library_search_similar_music(track_id: str) -> JSONResponse:
     """
     try:
         logger.info(f"Searching similar music for track ID: {track_id}")
-        async with httpx.AsyncClient() as client:
-            similar_tracks = await cyanite.search_similar_music(client, track_id)
+        similar_tracks = await cyanite.search_similar_music(track_id)
         logger.info(f"Successfully searched similar music for track ID: {track_id}")
         return JSONResponse(content={"music_results": similar_tracks}, status_code=200)
 
@@ -410,6 +485,23 @@ async def startup_event():
     os.makedirs(config.UPLOAD_AUDIO_DIR, exist_ok=True)
     os.makedirs(config.STORYBOARD_EXTRACTION_DIR, exist_ok=True)
 
+    # Knowledge vector store for the OpenAI Assistant keywords extraction
+    try:
+        await prepare_assistant_knowledge()
+    except Exception as e:
+        logger.error(f"Failed to prepare the knowledge vector store, it will be retried on the first request: {e}")
+    # In-memory index of the knowledge file for the local knowledge retrieval keywords extraction
+    try:
+        load_knowledge_index()
+    except FileNotFoundError:
+        logger.warning(f"Knowledge file {config.KNOWLEDGE_FILE_PATH} not found, local knowledge retrieval is unavailable.")
+    # Images uploaded for use_hosted_frame_urls are only needed while their request is analyzed
+    try:
+        await ensure_hosted_images_expiration()
+    except Exception as e:
+        logger.error(f"Failed to add the S3 lifecycle rule of {config.HOSTED_IMAGES_S3_FOLDER}, "
+                     f"add an expiration rule for the prefix manually: {e}")
+
     # multiprocessing.set_start_method('spawn', force=True)
     manager = multiprocessing.Manager()
 
@@ -463,5 +555,10 @@ async def startup_event():
     # delete_cyanite_thread.start()
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    await cyanite.cyanite_client.aclose()
+
+
 if __name__ == "__main__":
     uvicorn.run("__main__:app", host="127.0.0.1", port=config.API_PORT, workers=config.N_API_WORKERS, loop="asyncio")
@@ -1,10 +1,13 @@
 from src.analysis import audio, vision
+from src.analysis.usage_tracking import request_context
+from src.utils import extract_filename
 import asyncio
 from src.utils import frame_detection
 from src.external_api import cyanite
-from src.api_logic.s3_handler import process_suno_audio
+from src.api_logic.s3_handler import process_suno_audio, publish_images
+from configs import config
+import os
 import nest_asyncio
-import httpx
 import time
 
 
@@ -48,9 +51,11 @@ async def process_frames_ext_queue(queue, completion_dict):
     """
     while True:
         item = queue.get()
-        video_path, n_frames, return_collage = item
+        video_path, n_frames, return_collage, image_token_budget, hosted_urls = item
         try:
-            frame_detection.extract_frames(video_path, n_frames, return_collage)
+            frame_detection.extract_frames(video_path, n_frames, return_collage, image_token_budget)
+            if hosted_urls:
+                await publish_images(os.path.join(config.KEYFRAMES_DIR, extract_filename(video_path)))
             completion_dict[video_path] = True
         except Exception:
             completion_dict[video_path] = False
@@ -68,7 +73,8 @@ async def process_audio_queue(queue, completion_dict, lock):
     async def audio_analysis_task(item, completion_dict):
         video_path = item
         try:
-            transcript = await audio.audio_analysis(video_path)
+            with request_context(extract_filename(video_path)):
+                transcript = await audio.audio_analysis(video_path)
             completion_dict[video_path] = transcript
         except Exception:
             completion_dict[video_path] = False
@@ -86,12 +92,18 @@ async def process_storyboard_queue(queue, completion_dict, lock):
         lock: (multiprocessing.Lock): A lock to ensure multiprocessing safety.
     """
     async def storyboard_analysis_task(item, completion_dict):
-        file_path, storyboard_description_prompt, keyword_extraction_prompt, storyboard_summarization_prompt, gpt_model = item
+        file_path, storyboard_description_prompt, keyword_extraction_prompt, storyboard_summarization_prompt, gpt_model, fused, single_call, \
+            hosted_urls, use_text_layer, cached_description = item
         try:
-            description, keywords, summarization = await vision.analyze_storyboard(
-                file_path, storyboard_description_prompt, keyword_extraction_prompt, storyboard_summarization_prompt, 
-                extract_images=True, gpt_model=gpt_model)
-            completion_dict[file_path] = (keywords, summarization)
+            with request_context(extract_filename(file_path)):
+                if hosted_urls and cached_description is None:
+                    vision.pdf_to_images(file_path)
+                    await publish_images(os.path.join(config.STORYBOARD_EXTRACTION_DIR, extract_filename(file_path)))
+                description, keywords, summarization = await vision.analyze_storyboard(
+                    file_path, storyboard_description_prompt, keyword_extraction_prompt, storyboard_summarization_prompt, 
+                    extract_images=not hosted_urls, gpt_model=gpt_model, fused=fused,
+                    single_call_keywords=single_call, use_text_layer=use_text_layer, description=cached_description)
+            completion_dict[file_path] = (description, keywords, summarization)
         except Exception:
             completion_dict[file_path] = False
 
@@ -133,9 +145,7 @@ async def delete_cyanite_tracks(delete_queue):
 
         if track_id is not None:
             if time.time() - upload_time > 60 * 5:
-                timeout = httpx.Timeout(10.0, read=None)
-                async with httpx.AsyncClient(timeout=timeout) as client:
-                    await cyanite.delete_library_tracks(client, track_id)
+                await cyanite.delete_library_tracks(track_id)
                 continue
             else:
                 delete_queue.put((track_id, upload_time))
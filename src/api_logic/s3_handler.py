@@ -1,9 +1,13 @@
 import httpx
 import aioboto3
+import asyncio
+import hashlib
 import os
+import time
 from botocore.exceptions import ClientError
 import logging
 from configs import config
+from src.utils.hosted_images import save_urls_manifest
 import aiofiles
 
 logger = logging.getLogger(__name__)
@@ -103,6 +107,83 @@ async def process_suno_audio(url, filename):
         await upload_to_s3(saved_file, s3_key)
 
 
+async def upload_images_presigned(image_paths: list, s3_folder: str, expires_in: int) -> dict:
+    """
+    Uploads images to the S3 bucket in parallel and generates presigned URLs for them.
+    Keys are hashes of the image content, so the same image is always uploaded under the same key.
+
+    Args:
+        image_paths (list): Local paths of the images.
+        s3_folder (str): Folder in the S3 bucket.
+        expires_in (int): Number of seconds the presigned URLs are valid for.
+
+    Returns:
+        dict: Mapping of image file names to their presigned URLs.
+    """
+    session = aioboto3.Session()
+    async with session.client('s3') as s3_client:
+        async def upload(image_path):
+            async with aiofiles.open(image_path, 'rb') as file:
+                data = await file.read()
+            s3_key = f"{s3_folder}/{hashlib.sha256(data).hexdigest()}{os.path.splitext(image_path)[1]}"
+            await s3_client.put_object(Bucket=S3_BUCKET_NAME, Key=s3_key, Body=data, ContentType="image/jpeg")
+            url = await s3_client.generate_presigned_url(
+                'get_object', Params={'Bucket': S3_BUCKET_NAME, 'Key': s3_key}, ExpiresIn=expires_in)
+            return os.path.basename(image_path), url
+
+        return dict(await asyncio.gather(*[upload(image_path) for image_path in image_paths]))
+
+
+async def publish_images(folder: str) -> bool:
+    """
+    Uploads the JPEG images of the folder (keyframes or storyboard pages) to S3 and saves their presigned URLs
+    in the folder, so they are sent to the model as URLs instead of inline base64 images.
+
+    Args:
+        folder (str): Folder with the images.
+
+    Returns:
+        bool: True if the images were uploaded, False otherwise (the images are then sent inline).
+    """
+    try:
+        start = time.time()
+        image_paths = [os.path.join(folder, name) for name in os.listdir(folder) if name.endswith('.jpg')]
+        urls = await upload_images_presigned(image_paths, config.HOSTED_IMAGES_S3_FOLDER, config.HOSTED_IMAGES_URL_EXPIRATION)
+        save_urls_manifest(folder, urls, config.HOSTED_IMAGES_URL_EXPIRATION)
+        steps_logger.info(f"Uploaded {len(urls)} images from {folder} to S3 in {time.time() - start:.3f} seconds.")
+        return True
+    except Exception as e:
+        logger.error(f"Uploading images from {folder} to S3 failed, they will be sent inline: {e}")
+        return False
+
+
+async def ensure_hosted_images_expiration() -> None:
+    """
+    Adds a lifecycle rule to the S3 bucket that deletes images uploaded for the vision model
+    (`HOSTED_IMAGES_S3_FOLDER`) after `HOSTED_IMAGES_RETENTION_DAYS`, keeping the other rules of the bucket.
+    Does nothing if the rule is already in place.
+    """
+    rule_id = f"expire-{config.HOSTED_IMAGES_S3_FOLDER}"
+    rule = {"ID": rule_id, "Filter": {"Prefix": f"{config.HOSTED_IMAGES_S3_FOLDER}/"}, "Status": "Enabled",
+            "Expiration": {"Days": config.HOSTED_IMAGES_RETENTION_DAYS}}
+    session = aioboto3.Session()
+    async with session.client('s3') as s3_client:
+        try:
+            rules = (await s3_client.get_bucket_lifecycle_configuration(Bucket=S3_BUCKET_NAME))["Rules"]
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "NoSuchLifecycleConfiguration":
+                raise
+            rules = []
+        if rule in rules:
+            return
+        rules = [existing for existing in rules if existing.get("ID") != rule_id] + [rule]
+        # the configuration replaces all rules of the bucket, so the existing rules are sent along
+        await s3_client.put_bucket_lifecycle_configuration(Bucket=S3_BUCKET_NAME,
+                                                           LifecycleConfiguration={"Rules": rules})
+        steps_logger.info(f"Added S3 lifecycle rule {rule_id}: {config.HOSTED_IMAGES_S3_FOLDER}/ objects expire "
+                          f"after {config.HOSTED_IMAGES_RETENTION_DAYS} days.")
+
+
 def generate_s3_url(s3_key: str) -> str:
     """Generate a public URL for the uploaded S3 object."""
     return f"https://{S3_BUCKET_NAME}.s3.{S3_REGION_NAME}.amazonaws.com/{s3_key}".replace(" ", "+")
@@ -7,10 +7,11 @@ from fastapi import File, UploadFile, HTTPException
 import aiofiles
 from configs import config
 from src.analysis import vision, keywords_ext
+from src.analysis.usage_tracking import request_context, usage_tracker
+from src.analysis.vision.storyboard_cache import storyboard_cache, file_hash
 from src.external_api import cyanite
-from src.utils import load_settings, delete_old_files
+from src.utils import load_settings, delete_old_files, extract_filename
 import uuid
-import httpx
 import logging
 
 logger = logging.getLogger(__name__)
@@ -86,6 +87,15 @@ async def process_video(video_uuid: str, frames_ext_completion_dict: Dict[str, b
     Returns:
         Tuple[List[str], str]: A tuple containing the list of keywords and the video summarization result.
     """
+    with request_context(video_uuid):
+        keywords, video_summary = await _process_video(video_uuid, frames_ext_completion_dict, audio_completion_dict,
+                                                       frames_ext_queue, audio_analysis_queue)
+    await usage_tracker.log_request_summary(video_uuid)
+    return keywords, video_summary
+
+
+async def _process_video(video_uuid: str, frames_ext_completion_dict: Dict[str, bool], audio_completion_dict: Dict[str, bool],
+                         frames_ext_queue, audio_analysis_queue) -> Tuple[List[str], str]:
     settings = load_settings(config.API_SETTINGS_PATH)
     if not settings:
         raise ValueError("Error: File containing the last saved settings is empty.")
@@ -98,7 +108,8 @@ async def process_video(video_uuid: str, frames_ext_completion_dict: Dict[str, b
         shutil.rmtree(output_folder, ignore_errors=True)
 
     start = time.time()
-    frames_ext_queue.put((video_path, settings["number_of_frames"], settings["extract_frames_as_collage"]))
+    frames_ext_queue.put((video_path, settings["number_of_frames"], settings["extract_frames_as_collage"],
+                          settings.get("image_token_budget", 0), settings.get("use_hosted_frame_urls", False)))
 
     # Extract keywords from audio
     audio_analysis_queue.put(video_path)
@@ -110,14 +121,20 @@ async def process_video(video_uuid: str, frames_ext_completion_dict: Dict[str, b
 
     # Extract keywords from video
     video_analysis_task = asyncio.create_task(vision.video_analysis(video_path, settings["video_description_prompt"],
-                                                            settings["video_summarization_prompt"], settings["gpt_model"]))
+                                                            settings["video_summarization_prompt"], settings["gpt_model"],
+                                                            settings.get("fuse_description_and_summary", False)))
 
     await wait_for_completion(video_path, audio_completion_dict, 0.25, "Failed to analyze audio for video")
     audio_transcription = audio_completion_dict[video_path]
     del audio_completion_dict[video_path]
 
-    video_description, video_summary = await video_analysis_task
+    # Compacted once, the same transcript is used by all creativity levels; runs while the video is being described
+    compaction_task = asyncio.create_task(keywords_ext.compact_transcript(
+        audio_transcription, settings.get("transcript_token_budget", 0),
+        settings.get("transcript_compaction_method", "extractive")))
 
+    video_description, video_summary = await video_analysis_task
+    audio_transcription = await compaction_task
     
     if settings["model_type_for_keywords_extraction"] == "OpenAI Assistant (will use gpt-4o)":
         # Extract keywords from video description and audio transcription for all 4 creativity levels
@@ -126,6 +143,13 @@ async def process_video(video_uuid: str, frames_ext_completion_dict: Dict[str, b
             settings["assistant_keyword_extraction_prompt_3"], settings["assistant_keyword_extraction_prompt_4"]]
         extraction_function = keywords_ext.video_audio_extraction_assistant
         args = [video_description, audio_transcription]
+    elif settings["model_type_for_keywords_extraction"] == "Local knowledge retrieval (will use gpt-4o)":
+        # Same prompts as the assistant, knowledge entries are retrieved locally
+        keywords_extraction_prompts = [
+            settings["assistant_keyword_extraction_prompt_1"], settings["assistant_keyword_extraction_prompt_2"],
+            settings["assistant_keyword_extraction_prompt_3"], settings["assistant_keyword_extraction_prompt_4"]]
+        extraction_function = keywords_ext.video_audio_extraction_local_knowledge
+        args = [video_description, audio_transcription]
     else:
         # Extract keywords from video description and audio transcription for all 4 creativity levels
         keywords_extraction_prompts = [
@@ -134,10 +158,14 @@ async def process_video(video_uuid: str, frames_ext_completion_dict: Dict[str, b
         extraction_function = keywords_ext.video_audio_extraction
         strucutred_output = settings["model_type_for_keywords_extraction"] == "Structured output (will use gpt-4o-2024-08-06)"
         args = [video_description, audio_transcription, settings["gpt_model"], strucutred_output]
-    
-    keywords = await keywords_ext.video_audio_creative_extraction(extraction_function,
-                                                                  keywords_extraction_prompts, 
-                                                                  *args)
+
+    if settings.get("single_call_keyword_extraction", False) and extraction_function is keywords_ext.video_audio_extraction:
+        # all 4 creativity levels in one call, falls back to one call per level
+        keywords = await keywords_ext.video_audio_single_call_extraction(keywords_extraction_prompts, *args)
+    else:
+        keywords = await keywords_ext.video_audio_creative_extraction(extraction_function,
+                                                                      keywords_extraction_prompts, 
+                                                                      *args)
 
     keywords_splitted = [[word.lower() for word in keywords_string.split(', ') if word.strip()] for keywords_string in keywords]
 
@@ -149,6 +177,8 @@ async def process_video(video_uuid: str, frames_ext_completion_dict: Dict[str, b
 async def analyze_storyboard_api(file_path: str, storyboard_completion_dict: Dict[str, bool], storyboard_queue) -> Tuple[List[str], str]:
     """
     Analyze a storyboard by generating a description, extracting keywords, and summarizing the description.
+    Results of a storyboard with the same content, prompts and model are returned from the cache,
+    and a cached description is reused if only the keyword or summarization prompts changed.
 
     Args:
         file_path (str): Path to the storyboard file.
@@ -158,21 +188,41 @@ async def analyze_storyboard_api(file_path: str, storyboard_completion_dict: Dic
     Returns:
         Tuple: Contains the extracted keywords and summarization.
     """
+    request_id = extract_filename(file_path)
     settings = load_settings(config.API_SETTINGS_PATH)
     if not settings:
         raise ValueError("Error: File containing the last saved settings is empty.")
     
     keywords_prompts = [settings["storyboard_keyword_extraction_prompt_1"], settings["storyboard_keyword_extraction_prompt_2"],
                          settings["storyboard_keyword_extraction_prompt_3"], settings["storyboard_keyword_extraction_prompt_4"]]
-    
+
+    pdf_hash = await asyncio.to_thread(file_hash, file_path)
+    description_key = storyboard_cache.description_key(pdf_hash, settings)
+    result_key = storyboard_cache.result_key(description_key, keywords_prompts, settings)
+    cached_result = await asyncio.to_thread(storyboard_cache.get, result_key)
+    if cached_result is not None:
+        steps_logger.info(f"Storyboard {request_id} (sha256 {pdf_hash}) analysis served from cache.")
+        return [keyword.lower().split(", ") for keyword in cached_result["keywords"]], cached_result["summary"]
+    cached_description = await asyncio.to_thread(storyboard_cache.get, description_key)
+    if cached_description is not None:
+        steps_logger.info(f"Reusing cached description of storyboard {request_id} (sha256 {pdf_hash}).")
+
     storyboard_queue.put((file_path, settings["storyboard_description_prompt"], keywords_prompts,
-                                    settings["storyboard_summarization_prompt"], settings["gpt_model"]))
+                                    settings["storyboard_summarization_prompt"], settings["gpt_model"],
+                                    settings.get("fuse_description_and_summary", False),
+                                    settings.get("single_call_keyword_extraction", False),
+                                    settings.get("use_hosted_frame_urls", False),
+                                    settings.get("use_storyboard_text_layer", False),
+                                    cached_description))
     
     await wait_for_completion(file_path, storyboard_completion_dict, 0.25, "Failed to analyze storyboard")
-    keywords, summary = storyboard_completion_dict[file_path]
-    keywords = [keyword.lower().split(", ") for keyword in keywords]
+    description, keywords, summary = storyboard_completion_dict[file_path]
     del storyboard_completion_dict[file_path]
+    await asyncio.to_thread(storyboard_cache.set, description_key, description)
+    await asyncio.to_thread(storyboard_cache.set, result_key, {"keywords": keywords, "summary": summary})
+    keywords = [keyword.lower().split(", ") for keyword in keywords]
 
+    await usage_tracker.log_request_summary(request_id)
     return keywords, summary
 
 
@@ -208,43 +258,41 @@ async def search_similar_music_from_audio(
             await audio_file_saved.write(await audio_file.read())
     audio_path = audio_path.replace("\\", "/")
 
-    timeout = httpx.Timeout(10.0, read=None)
-    async with httpx.AsyncClient(timeout=timeout) as client:
-        # Get file upload request
-        file_upload_request = await cyanite.get_file_upload_request(client)
+    # Get file upload request
+    file_upload_request = await cyanite.get_file_upload_request()
 
-        if not file_upload_request:
-            raise HTTPException(status_code=500, detail="Failed to obtain file upload request.")
+    if not file_upload_request:
+        raise HTTPException(status_code=500, detail="Failed to obtain file upload request.")
 
-        upload_url = file_upload_request['uploadUrl']
-        file_upload_id = file_upload_request['id']
+    upload_url = file_upload_request['uploadUrl']
+    file_upload_id = file_upload_request['id']
 
-        # Upload the file
-        if not await cyanite.upload_file(client, upload_url, audio_path):
-            raise HTTPException(status_code=500, detail="File upload failed.")
+    # Upload the file
+    if not await cyanite.upload_file(upload_url, audio_path):
+        raise HTTPException(status_code=500, detail="File upload failed.")
 
-        steps_logger.info(f"File uploaded successfully with ID: {file_upload_id}")
+    steps_logger.info(f"File uploaded successfully with ID: {file_upload_id}")
 
-        # Create library track using file upload ID
-        created_track_id = await cyanite.create_library_track(client, file_upload_id, title)
+    # Create library track using file upload ID
+    created_track_id = await cyanite.create_library_track(file_upload_id, title)
 
-        if not created_track_id:
-            raise HTTPException(status_code=500, detail="Library Track creation failed.")
+    if not created_track_id:
+        raise HTTPException(status_code=500, detail="Library Track creation failed.")
 
-        steps_logger.info(f"Library Track created successfully with ID: {created_track_id}")
+    steps_logger.info(f"Library Track created successfully with ID: {created_track_id}")
 
-        # Now you can enqueue analysis for the created library track
-        await cyanite.enqueue_library_track_analysis(client, created_track_id)
+    # Now you can enqueue analysis for the created library track
+    await cyanite.enqueue_library_track_analysis(created_track_id)
 
-        # Simulating a delay for analysis completion (adjust as needed)
-        for i in range(20):
-            similar_tracks = await cyanite.search_similar_music(client, created_track_id, False)
-            if similar_tracks:
-                break
-            steps_logger.info("Retrying to search similar music. Retry count: " + str(i+1))
-            await asyncio.sleep(5)
+    # Simulating a delay for analysis completion (adjust as needed)
+    for i in range(20):
+        similar_tracks = await cyanite.search_similar_music(created_track_id, False)
+        if similar_tracks:
+            break
+        steps_logger.info("Retrying to search similar music. Retry count: " + str(i+1))
+        await asyncio.sleep(5)
 
-        if not save_track:
-            await cyanite.delete_library_tracks(client, created_track_id)
+    if not save_track:
+        await cyanite.delete_library_tracks(created_track_id)
 
-        return similar_tracks
+    return similar_tracks
@@ -21,8 +21,9 @@ logger = logging.getLogger(__name__)
 
 
 GRADIO_PLAYGROUND_SETTINGS_LIST = [
-    "number_of_frames", "gpt_model", "extract_frames_as_collage", "model_type_for_keywords_extraction",
-    "video_description_prompt", 
+    "number_of_frames", "gpt_model", "extract_frames_as_collage", "fuse_description_and_summary", "image_token_budget",
+    "single_call_keyword_extraction",
+    "model_type_for_keywords_extraction", "video_description_prompt", 
     "video_audio_keyword_extraction_prompt_1", "video_audio_keyword_extraction_prompt_2",
     "video_audio_keyword_extraction_prompt_3", "video_audio_keyword_extraction_prompt_4",
     "assistant_keyword_extraction_prompt_1", "assistant_keyword_extraction_prompt_2",
@@ -31,7 +32,8 @@ GRADIO_PLAYGROUND_SETTINGS_LIST = [
 ]
 GRADIO_STORYBOARD_SETTINGS_LIST = [
     "storyboard_description_prompt", "storyboard_keyword_extraction_prompt_1", "storyboard_keyword_extraction_prompt_2", 
-    "storyboard_keyword_extraction_prompt_3", "storyboard_keyword_extraction_prompt_4", "storyboard_summarization_prompt"
+    "storyboard_keyword_extraction_prompt_3", "storyboard_keyword_extraction_prompt_4", "storyboard_summarization_prompt",
+    "use_storyboard_text_layer"
 ]
 
 
@@ -42,7 +44,7 @@ async def video_audio_analysis(video_path: str, video_description_prompt: str,
                                assistant_keyword_extraction_prompt_1: str, assistant_keyword_extraction_prompt_2,
                                assistant_keyword_extraction_prompt_3, assistant_keyword_extraction_prompt_4,
                                video_summarization_prompt: str, 
-                               gpt_model: str, creativity: int, gpt_model_for_extraction: str) -> tuple:
+                               gpt_model: str, creativity: int, gpt_model_for_extraction: str, fused: bool) -> tuple:
     """
     Runs all processes. Analyzes both video and audio, returning their respective keywords.
 
@@ -53,7 +55,7 @@ async def video_audio_analysis(video_path: str, video_description_prompt: str,
         logger.info(f"Analyzing video and audio for: {video_path}")
         
         video_analysis_task = asyncio.create_task(vision.video_analysis(
-            video_path, video_description_prompt, video_summarization_prompt, gpt_model))
+            video_path, video_description_prompt, video_summarization_prompt, gpt_model, fused))
 
         transcript = await audio.audio_analysis(video_path)
         video_description, video_summary = await video_analysis_task
@@ -69,7 +71,7 @@ async def video_audio_analysis(video_path: str, video_description_prompt: str,
             video_audio_keyword_extraction_prompt_3, video_audio_keyword_extraction_prompt_4,
             assistant_keyword_extraction_prompt_1, assistant_keyword_extraction_prompt_2,
             assistant_keyword_extraction_prompt_3, assistant_keyword_extraction_prompt_4,
-            creativity, video_description, transcript, gpt_model, gpt_model_for_extraction, False)
+            creativity, video_description, transcript, gpt_model, gpt_model_for_extraction, False, True)
 
         logger.info(f"Successfully analyzed video and audio for: {video_path}")
         return video_description, video_audio_keywords, video_summary, transcript
@@ -83,7 +85,8 @@ async def video_audio_analysis(video_path: str, video_description_prompt: str,
 async def storyboard_analysis_gradio(file_path: str, storyboard_description_prompt: str, 
                                      keyword_extraction_prompt_1: str, keyword_extraction_prompt_2: str,
                                      keyword_extraction_prompt_3: str, keyword_extraction_prompt_4: str,
-                                     storyboard_summarization_prompt: str, gpt_model: str, creativity: int) -> tuple:
+                                     storyboard_summarization_prompt: str, gpt_model: str, creativity: int,
+                                     fused: bool, use_text_layer: bool = False) -> tuple:
     """
     Wrapper function for analyzing storyboards.
     """
@@ -93,7 +96,8 @@ async def storyboard_analysis_gradio(file_path: str, storyboard_description_prom
                                       keyword_extraction_prompt_3, keyword_extraction_prompt_4]
         description, keywords, summarization = await vision.analyze_storyboard(file_path, storyboard_description_prompt,
                                                          keyword_extraction_prompts[creativity-1], storyboard_summarization_prompt,
-                                                         extract_images=False, gpt_model=gpt_model)
+                                                         extract_images=False, gpt_model=gpt_model, fused=fused,
+                                                         use_text_layer=use_text_layer)
         logger.info(f"Successfully analyzed storyboard: {file_path}")
         return description, keywords, summarization
     except Exception as e:
@@ -128,9 +132,10 @@ def save_settings_gradio(output_path, dict_keys, *args):
         gr.Info("Settings for video analysis saved successfully.")
 
 
-def extract_frames_gradio(video_path: str, n_frames: int, return_collage: bool) -> list:
+def extract_frames_gradio(video_path: str, n_frames: int, return_collage: bool, image_token_budget: int = 0) -> list:
     try:
-        frames_ = frame_detection.extract_frames(video_path, n_frames, return_collage=return_collage)
+        frames_ = frame_detection.extract_frames(video_path, n_frames, return_collage=return_collage,
+                                                 image_token_budget=int(image_token_budget or 0))
         return frames_
     except Exception as e:
         logger.error(f"Failed to extract frames: {e}")
@@ -141,7 +146,7 @@ def extract_frames_gradio(video_path: str, n_frames: int, return_collage: bool)
 async def video_audio_keyword_extraction_gradio(video_audio_prompt1, video_audio_prompt2, video_audio_prompt3, video_audio_prompt4,
                                                 assistant_prompt1, assistant_prompt2, assistant_prompt3, assistant_prompt4,
                                                 creativity, video_description, audio_transcription, model, gpt_model_for_extraction,
-                                                show_warnings=True):
+                                                show_warnings=True, use_cache=False):
     if video_description == "" or video_description is None and show_warnings:
         gr.Warning("No video description provided!")
     if audio_transcription == "" or audio_transcription is None or audio_transcription == "No speech detected in the video" and show_warnings:
@@ -150,13 +155,18 @@ async def video_audio_keyword_extraction_gradio(video_audio_prompt1, video_audio
     if gpt_model_for_extraction == "OpenAI Assistant (will use gpt-4o)":
         prompt = [assistant_prompt1, assistant_prompt2, assistant_prompt3, assistant_prompt4][creativity - 1]
         return await keywords_ext.video_audio_extraction_assistant(prompt, video_description, audio_transcription)
+    if gpt_model_for_extraction == "Local knowledge retrieval (will use gpt-4o)":
+        prompt = [assistant_prompt1, assistant_prompt2, assistant_prompt3, assistant_prompt4][creativity - 1]
+        return await keywords_ext.video_audio_extraction_local_knowledge(prompt, video_description, audio_transcription,
+                                                                          use_cache=use_cache)
     
     prompt = [video_audio_prompt1, video_audio_prompt2, video_audio_prompt3, video_audio_prompt4][creativity - 1]
     if gpt_model_for_extraction == "No structured output (will use gpt model specified above)":
         use_structured_outputs = False
     else: # "Structured output (will use gpt-4o-2024-08-06)"
         use_structured_outputs = True
-    return await keywords_ext.video_audio_extraction(prompt, video_description, audio_transcription, model, use_structured_outputs)
+    return await keywords_ext.video_audio_extraction(prompt, video_description, audio_transcription, model, use_structured_outputs,
+                                                     use_cache=use_cache)
 
 
 async def storyboard_keyword_extraction_gradio(prompt1, prompt2, prompt3, prompt4, creativity, description, model):
@@ -164,7 +174,7 @@ async def storyboard_keyword_extraction_gradio(prompt1, prompt2, prompt3, prompt
         gr.Warning("No description provided!")
         return ""
     prompt = [prompt1, prompt2, prompt3, prompt4][creativity - 1]
-    return await vision.storyboard_keyword_extraction(prompt, description, model)
+    return await vision.storyboard_keyword_extraction(prompt, description, model, use_cache=False)
 
 
 async def generate_audio_gradio(prompt: str):
@@ -244,7 +254,7 @@ def update_tabs(model_for_extraction, creativity):
     """
     Makes the tabs with prompts visible based on the model for extraction.
     """
-    structured = model_for_extraction != "OpenAI Assistant (will use gpt-4o)"
+    structured = model_for_extraction not in ["OpenAI Assistant (will use gpt-4o)", "Local knowledge retrieval (will use gpt-4o)"]
     updates = [gr.update(visible=structured), gr.update(visible=not structured),
                 gr.Tabs(selected=creativity), gr.Tabs(selected=creativity)]
     return updates
@@ -365,11 +375,17 @@ with gr.Blocks(title='MultiMediaAI', css=custom_css) as app:
                                                   label="GPT Model (used for video description and summarization)", value="gpt-4o", interactive=True)
                     with gr.Column(scale=1):
                         extract_as_collage = gr.Checkbox(label="Extract frames as Collage", interactive=True)
+                        fuse_description_and_summary = gr.Checkbox(label="Description and Summary in one call", interactive=True)
+                        single_call_keyword_extraction = gr.Checkbox(label="All creativity levels in one call (API)",
+                                                                     interactive=True)
+                        image_token_budget = gr.Number(label="Image token budget (0 - disabled)", value=0, minimum=0,
+                                                       precision=0, interactive=True)
                 with gr.Row():
                     gpt_model_for_extraction = gr.Dropdown(label="Model Type (used for keywords extraction)", choices=[
                         "No structured output (will use gpt model specified above)", 
                         "Structured output (will use gpt-4o-2024-08-06)",
-                        "OpenAI Assistant (will use gpt-4o)"], 
+                        "OpenAI Assistant (will use gpt-4o)",
+                        "Local knowledge retrieval (will use gpt-4o)"], 
                         value="No structured output (will use gpt model specified above)",
                         interactive=True, allow_custom_value=False)
             with gr.Column(elem_id="params"):
@@ -494,6 +510,9 @@ with gr.Blocks(title='MultiMediaAI', css=custom_css) as app:
                     storyboard = gr.File(label="Storyboard File",  interactive=True)
                 with gr.Row():
                     storyboard_creativity_slider = gr.Slider(minimum=1, maximum=4, label="Creativity", value=1, step=1, interactive=True)
+                with gr.Row():
+                    use_storyboard_text_layer = gr.Checkbox(label="Use PDF text layer of text-rich storyboards",
+                                                            interactive=True)
             with gr.Column(scale=6):
                 storyboard_pages = gr.Gallery(label='Pages', height=512)
 
@@ -564,19 +583,25 @@ with gr.Blocks(title='MultiMediaAI', css=custom_css) as app:
 
     video.upload(
         extract_frames_gradio,
-        inputs=[video, n_frames, extract_as_collage],
+        inputs=[video, n_frames, extract_as_collage, image_token_budget],
         outputs=[frames]
     )
 
     n_frames.release(
         extract_frames_gradio,
-        inputs=[video, n_frames, extract_as_collage],
+        inputs=[video, n_frames, extract_as_collage, image_token_budget],
         outputs=[frames]
     )
 
     extract_as_collage.input(
         extract_frames_gradio,
-        inputs=[video, n_frames, extract_as_collage],
+        inputs=[video, n_frames, extract_as_collage, image_token_budget],
+        outputs=[frames]
+    )
+
+    image_token_budget.submit(
+        extract_frames_gradio,
+        inputs=[video, n_frames, extract_as_collage, image_token_budget],
         outputs=[frames]
     )
 
@@ -620,8 +645,9 @@ with gr.Blocks(title='MultiMediaAI', css=custom_css) as app:
     save_settings_playground_btn.click(
         save_settings_gradio,
         inputs=[gr.State(config.GRADIO_LATEST_SETTINGS_PATH),  gr.State(GRADIO_PLAYGROUND_SETTINGS_LIST),
-                n_frames, gpt_model_name, extract_as_collage, gpt_model_for_extraction, video_description_prompt, 
-                *VIDEO_AUDIO_KEYWORD_PROMPTS, *ASSISTANT_KEYWORD_PROMPTS, video_summarization_prompt],
+                n_frames, gpt_model_name, extract_as_collage, fuse_description_and_summary, image_token_budget,
+                single_call_keyword_extraction, gpt_model_for_extraction,
+                video_description_prompt, *VIDEO_AUDIO_KEYWORD_PROMPTS, *ASSISTANT_KEYWORD_PROMPTS, video_summarization_prompt],
         outputs=None
     )
 
@@ -629,7 +655,9 @@ with gr.Blocks(title='MultiMediaAI', css=custom_css) as app:
     load_latest_playground_btn.click(
         load_settings_gradio,
         inputs=[gr.State(config.GRADIO_LATEST_SETTINGS_PATH), gr.State(GRADIO_PLAYGROUND_SETTINGS_LIST)],
-        outputs=[n_frames, gpt_model_name, extract_as_collage, gpt_model_for_extraction, video_description_prompt, 
+        outputs=[n_frames, gpt_model_name, extract_as_collage, fuse_description_and_summary, image_token_budget,
+                 single_call_keyword_extraction, gpt_model_for_extraction,
+                 video_description_prompt, 
                  *VIDEO_AUDIO_KEYWORD_PROMPTS, *ASSISTANT_KEYWORD_PROMPTS, video_summarization_prompt]
     )
 
@@ -638,7 +666,8 @@ with gr.Blocks(title='MultiMediaAI', css=custom_css) as app:
         video_audio_analysis,
         inputs=[
             video, video_description_prompt, *VIDEO_AUDIO_KEYWORD_PROMPTS, *ASSISTANT_KEYWORD_PROMPTS,
-            video_summarization_prompt, gpt_model_name, creativity_slider_main, gpt_model_for_extraction
+            video_summarization_prompt, gpt_model_name, creativity_slider_main, gpt_model_for_extraction,
+            fuse_description_and_summary
         ],
         outputs=[video_description_output, video_audio_keywords_output, video_summarization_output,
                  audio_transcription]
@@ -704,7 +733,8 @@ with gr.Blocks(title='MultiMediaAI', css=custom_css) as app:
     analyse_storyboard_btn.click(
         storyboard_analysis_gradio,
         inputs=[storyboard, storyboard_description_prompt, *STORYBOARD_KEYWORD_PROMPTS,
-                storyboard_summarization_prompt, gpt_model_name, storyboard_creativity_slider],
+                storyboard_summarization_prompt, gpt_model_name, storyboard_creativity_slider,
+                fuse_description_and_summary, use_storyboard_text_layer],
         outputs=[storyboard_description_output, storyboard_keywords_output, storyboard_summarization_output]
     ).then(
         lambda keywords, description: keywords + ". " + description,
@@ -747,7 +777,8 @@ with gr.Blocks(title='MultiMediaAI', css=custom_css) as app:
     save_settings_storyboards_btn.click(
         save_settings_gradio,
         inputs=[gr.State(config.GRADIO_LATEST_SETTINGS_PATH), gr.State(GRADIO_STORYBOARD_SETTINGS_LIST), 
-                storyboard_description_prompt, *STORYBOARD_KEYWORD_PROMPTS, storyboard_summarization_prompt],
+                storyboard_description_prompt, *STORYBOARD_KEYWORD_PROMPTS, storyboard_summarization_prompt,
+                use_storyboard_text_layer],
         outputs=None
     )
 
@@ -755,16 +786,20 @@ with gr.Blocks(title='MultiMediaAI', css=custom_css) as app:
     load_latest_storyboards_btn.click(
         load_settings_gradio,
         inputs=[gr.State(config.GRADIO_LATEST_SETTINGS_PATH), gr.State(GRADIO_STORYBOARD_SETTINGS_LIST)],
-        outputs=[storyboard_description_prompt, *STORYBOARD_KEYWORD_PROMPTS, storyboard_summarization_prompt]
+        outputs=[storyboard_description_prompt, *STORYBOARD_KEYWORD_PROMPTS, storyboard_summarization_prompt,
+                 use_storyboard_text_layer]
     )
 
     app.load(
         load_settings_gradio, 
         inputs=[gr.State(config.GRADIO_LATEST_SETTINGS_PATH), 
                 gr.State(GRADIO_PLAYGROUND_SETTINGS_LIST + GRADIO_STORYBOARD_SETTINGS_LIST)],
-        outputs=[n_frames, gpt_model_name, extract_as_collage, gpt_model_for_extraction, video_description_prompt, 
+        outputs=[n_frames, gpt_model_name, extract_as_collage, fuse_description_and_summary, image_token_budget,
+                 single_call_keyword_extraction, gpt_model_for_extraction,
+                 video_description_prompt, 
                  *VIDEO_AUDIO_KEYWORD_PROMPTS, *ASSISTANT_KEYWORD_PROMPTS, video_summarization_prompt, 
-                 storyboard_description_prompt, *STORYBOARD_KEYWORD_PROMPTS, storyboard_summarization_prompt]
+                 storyboard_description_prompt, *STORYBOARD_KEYWORD_PROMPTS, storyboard_summarization_prompt,
+                 use_storyboard_text_layer]
     ).then(
         update_tabs,
         inputs=[gpt_model_for_extraction, creativity_slider_main],
@@ -0,0 +1,254 @@
+"""
+Benchmark of the analysis stages over a local corpus with several model/mode configurations.
+
+Corpus layout (`BENCHMARK_CORPUS_DIR`), one folder per item:
+    <item>/frames/keyframe1.jpg, keyframe2.jpg, ...  - keyframes of a video
+    <item>/transcript.txt                            - transcription of its audio (optional)
+    <item>/pages/page0.jpg, page1.jpg, ...           - pages of a storyboard (instead of frames)
+
+Usage:
+    python -m src.benchmark.run_benchmark --mode live
+    python -m src.benchmark.run_benchmark --mode record   # real calls, responses are recorded
+    python -m src.benchmark.run_benchmark --mode replay   # recorded responses only, works offline
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import shutil
+import time
+import numpy as np
+from configs import config
+from src.analysis import vision, keywords_ext
+from src.analysis.llm_cache import llm_cache
+from src.analysis.model_router import model_router
+from src.analysis.usage_tracking import usage_tracker, request_context
+from src.utils import load_settings
+from src.utils.disk_cache import DiskCache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONFIGURATIONS = [
+    {"name": "gpt-4o", "gpt_model": "gpt-4o", "keywords_mode": "plain", "fused": False},
+    {"name": "gpt-4o structured", "gpt_model": "gpt-4o", "keywords_mode": "structured", "fused": False},
+    {"name": "gpt-4o single call, fused", "gpt_model": "gpt-4o", "keywords_mode": "single_call", "fused": True},
+    {"name": "gpt-4o-mini", "gpt_model": "gpt-4o-mini", "keywords_mode": "plain", "fused": False},
+]
+BENCHMARK_PREFIX = "benchmark_"
+
+
+def load_corpus(corpus_dir: str) -> list:
+    """
+    Copies the corpus items to the folders the analysis functions read images from.
+
+    Returns:
+        list: Items as dicts with `name`, `kind` ("video" or "storyboard"), `file_path` and `transcript`.
+    """
+    items = []
+    for name in sorted(os.listdir(corpus_dir)):
+        item_dir = os.path.join(corpus_dir, name)
+        if not os.path.isdir(item_dir):
+            continue
+        if os.path.isdir(os.path.join(item_dir, "frames")):
+            kind, source, target_dir, extension = "video", "frames", config.KEYFRAMES_DIR, ".mp4"
+        elif os.path.isdir(os.path.join(item_dir, "pages")):
+            kind, source, target_dir, extension = "storyboard", "pages", config.STORYBOARD_EXTRACTION_DIR, ".pdf"
+        else:
+            logger.warning(f"Skipping {item_dir}: no frames or pages folder.")
+            continue
+
+        target = os.path.join(target_dir, BENCHMARK_PREFIX + name)
+        shutil.rmtree(target, ignore_errors=True)
+        shutil.copytree(os.path.join(item_dir, source), target)
+
+        transcript = ""
+        transcript_path = os.path.join(item_dir, "transcript.txt")
+        if os.path.exists(transcript_path):
+            with open(transcript_path, 'r') as file:
+                transcript = file.read()
+        items.append({"name": name, "kind": kind, "file_path": BENCHMARK_PREFIX + name + extension, "transcript": transcript})
+    return items
+
+
+async def extract_video_keywords(configuration: dict, settings: dict, description: str, transcript: str) -> list:
+    mode = configuration["keywords_mode"]
+    if mode in ("assistant", "local_knowledge"):
+        if mode == "assistant" and llm_cache.replay_only:
+            # Assistant runs are not chat completions, so they are neither recorded nor replayed
+            raise ValueError("The assistant keywords mode can't be replayed, benchmark it in live mode.")
+        extraction_function = (keywords_ext.video_audio_extraction_assistant if mode == "assistant"
+                               else keywords_ext.video_audio_extraction_local_knowledge)
+        prompts = [settings[f"assistant_keyword_extraction_prompt_{i}"] for i in range(1, 5)]
+        return await keywords_ext.video_audio_creative_extraction(extraction_function, prompts, description, transcript)
+
+    prompts = [settings[f"video_audio_keyword_extraction_prompt_{i}"] for i in range(1, 5)]
+    args = [description, transcript, configuration["gpt_model"], mode == "structured"]
+    if mode == "single_call":
+        return await keywords_ext.video_audio_single_call_extraction(prompts, *args)
+    return await keywords_ext.video_audio_creative_extraction(keywords_ext.video_audio_extraction, prompts, *args)
+
+
+async def extract_storyboard_keywords(configuration: dict, settings: dict, description: str) -> list:
+    prompts = [settings[f"storyboard_keyword_extraction_prompt_{i}"] for i in range(1, 5)]
+    keywords = None
+    if configuration["keywords_mode"] == "single_call":
+        keywords = await keywords_ext.multi_level_keyword_extraction(
+            prompts, [{"type": "text", "text": description}], "storyboard_keywords")
+    if keywords is None:
+        keywords = await asyncio.gather(*[vision.storyboard_keyword_extraction(prompt, description, configuration["gpt_model"])
+                                          for prompt in prompts])
+    return keywords
+
+
+async def run_item(item: dict, configuration: dict, settings: dict) -> dict:
+    """
+    Runs the analysis stages of one corpus item with one configuration.
+
+    Returns:
+        dict: Latency of each stage in seconds, keywords of each creativity level and usage totals.
+    """
+    latencies = {}
+
+    async def timed(stage, coroutine):
+        start = time.perf_counter()
+        result = await coroutine
+        latencies[stage] = time.perf_counter() - start
+        return result
+
+    model, fused = configuration["gpt_model"], configuration.get("fused", False)
+    run_id = f"{BENCHMARK_PREFIX}{configuration['name']}:{item['name']}:{time.time():.0f}"
+    with request_context(run_id):
+        if item["kind"] == "video":
+            if fused:
+                description, _ = await timed("description_summary", vision.describe_and_summarize_video(
+                    item["file_path"], settings["video_description_prompt"], settings["video_summarization_prompt"]))
+            else:
+                description = await timed("description", vision.describe_video(
+                    item["file_path"], settings["video_description_prompt"], model))
+                await timed("summary", vision.video_summarization(settings["video_summarization_prompt"], description, model))
+            keywords = await timed("keywords", extract_video_keywords(configuration, settings, description, item["transcript"]))
+        else:
+            if fused:
+                description, _ = await timed("description_summary", vision.describe_and_summarize_storyboard(
+                    item["file_path"], settings["storyboard_description_prompt"], settings["storyboard_summarization_prompt"]))
+            else:
+                description = await timed("description", vision.describe_storyboard(
+                    item["file_path"], settings["storyboard_description_prompt"], model))
+                await timed("summary", vision.storyboard_summarization(
+                    settings["storyboard_summarization_prompt"], description, model))
+            keywords = await timed("keywords", extract_storyboard_keywords(configuration, settings, description))
+    latencies["total"] = sum(latencies.values())
+
+    usage = (await asyncio.to_thread(usage_tracker.request_summary, run_id))["total"]
+    return {"latencies": latencies, "keywords": [parse_keywords(level) for level in keywords], "usage": usage}
+
+
+def parse_keywords(keywords: str) -> set:
+    return {keyword.strip().lower() for keyword in keywords.split(",") if keyword.strip()}
+
+
+def jaccard(a: set, b: set) -> float:
+    return len(a & b) / len(a | b) if a | b else 1.0
+
+
+def percentiles(values: list) -> dict:
+    return {"n": len(values), "mean": round(float(np.mean(values)), 3),
+            **{f"p{p}": round(float(np.percentile(values, p)), 3) for p in (50, 90, 95)}}
+
+
+def build_report(results: dict, mode: str) -> dict:
+    """
+    Aggregates the runs: latency percentiles per stage, usage totals and mean keyword overlap (Jaccard index
+    averaged over creativity levels and items) between every pair of configurations.
+    """
+    report = {"mode": mode, "configurations": {}, "keyword_overlap": {}}
+    for name, runs in results.items():
+        successful = [run for run in runs.values() if "error" not in run]
+        stages = sorted({stage for run in successful for stage in run["latencies"]})
+        totals = {key: sum(run["usage"][key] for run in successful)
+                  for key in ("calls", "prompt_tokens", "cached_tokens", "completion_tokens", "replayed", "cost_usd")}
+        report["configurations"][name] = {
+            "stages": {stage: percentiles([run["latencies"][stage] for run in successful if stage in run["latencies"]])
+                       for stage in stages},
+            "usage": totals,
+            "errors": len(runs) - len(successful),
+        }
+
+    for name_a, name_b in itertools.product(results, repeat=2):
+        overlaps = [np.mean([jaccard(a, b) for a, b in zip(results[name_a][item]["keywords"], results[name_b][item]["keywords"])])
+                    for item in results[name_a]
+                    if "error" not in results[name_a][item] and "error" not in results[name_b].get(item, {"error": True})]
+        report["keyword_overlap"].setdefault(name_a, {})[name_b] = round(float(np.mean(overlaps)), 3) if overlaps else None
+    return report
+
+
+def print_report(report: dict) -> None:
+    print(f"\nBenchmark ({report['mode']})")
+    for name, result in report["configurations"].items():
+        usage = result["usage"]
+        print(f"\n{name}: {usage['calls']} calls, tokens {usage['prompt_tokens']}/{usage['completion_tokens']} "
+              f"({usage['cached_tokens']} cached), ${usage['cost_usd']:.4f}, {result['errors']} errors"
+              + (f", {usage['replayed']} calls replayed" if usage['replayed'] else ""))
+        for stage, stats in result["stages"].items():
+            print(f"  {stage:<20} p50 {stats['p50']:>7.2f}s  p90 {stats['p90']:>7.2f}s  p95 {stats['p95']:>7.2f}s  (n={stats['n']})")
+    print("\nKeyword overlap (mean Jaccard index):")
+    for name, overlaps in report["keyword_overlap"].items():
+        print(f"  {name}: " + ", ".join(f"{other}: {value}" for other, value in overlaps.items() if other != name))
+
+
+async def run_benchmark(corpus_dir: str, configurations: list, settings: dict, mode: str, repeat: int) -> dict:
+    # stage_models of the settings would replace the models of the configurations
+    model_router.enabled = False
+    usage_tracker.use_path(config.BENCHMARK_USAGE_DB_PATH)
+    if mode == "live":
+        llm_cache.enabled = False
+    else:
+        if mode == "record" and os.path.exists(config.BENCHMARK_RECORDINGS_PATH):
+            os.remove(config.BENCHMARK_RECORDINGS_PATH)
+        llm_cache.enabled = True
+        llm_cache.replay_only = mode == "replay"
+        llm_cache.use_store(DiskCache(config.BENCHMARK_RECORDINGS_PATH, ttl=float("inf"), max_entries=10 ** 9, max_size_mb=10 ** 6))
+
+    items = load_corpus(corpus_dir)
+    results = {configuration["name"]: {} for configuration in configurations}
+    for configuration in configurations:
+        for item in items:
+            for n_run in range(repeat):
+                key = item["name"] if repeat == 1 else f"{item['name']}#{n_run}"
+                if mode == "record":
+                    # only the first run is recorded, repeats would otherwise read its responses back
+                    llm_cache.enabled = n_run == 0
+                try:
+                    results[configuration["name"]][key] = await run_item(item, configuration, settings)
+                except Exception as e:
+                    logger.exception(f"Benchmark of {item['name']} with {configuration['name']} failed: {e}")
+                    results[configuration["name"]][key] = {"error": str(e)}
+    return build_report(results, mode)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark latency, token usage and keywords of model/mode configurations.")
+    parser.add_argument("--corpus", default=config.BENCHMARK_CORPUS_DIR, help="Folder with the corpus items.")
+    parser.add_argument("--configurations", help="JSON file with a list of configurations "
+                                                 "({name, gpt_model, keywords_mode: plain|structured|single_call|local_knowledge|assistant, fused}). "
+                                                 "assistant (the OpenAI Assistant) runs in live mode only.")
+    parser.add_argument("--settings", default=config.API_SETTINGS_PATH, help="Settings file with the prompts.")
+    parser.add_argument("--mode", choices=["live", "record", "replay"], default="live")
+    parser.add_argument("--repeat", type=int, default=1, help="Number of runs of every item (live and record modes, only the first run is recorded).")
+    parser.add_argument("--output", default=config.BENCHMARK_REPORTS_DIR, help="Folder for the JSON report.")
+    args = parser.parse_args()
+
+    configurations = DEFAULT_CONFIGURATIONS
+    if args.configurations:
+        with open(args.configurations, 'r') as file:
+            configurations = json.load(file)
+
+    report = asyncio.run(run_benchmark(args.corpus, configurations, load_settings(args.settings), args.mode, args.repeat))
+    print_report(report)
+    os.makedirs(args.output, exist_ok=True)
+    report_path = os.path.join(args.output, f"benchmark_{args.mode}_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    with open(report_path, 'w') as file:
+        json.dump(report, file, indent=4)
+    print(f"\nReport saved to {report_path}")
@@ -1,31 +1,95 @@
+import asyncio
 import os
+import weakref
 import httpx
 import aiofiles
 import logging
+from configs import config
+from src.utils.rate_limiter import RateLimiter
+
+try:
+    import h2  # noqa: F401, needed by httpx for HTTP/2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
 
 CYANITE_ACCESS_TOKEN = os.getenv("CYANITE_ACCESS_TOKEN")
 logger = logging.getLogger(__name__)
 steps_logger = logging.getLogger("steps_info")
 
 
-async def songsearch(search_text) -> list:
+class CyaniteClient:
     """
-    Search for songs based on the given text.
-
-    Args:
-        search_text (str): Text to search for.
-
-    Returns:
-        list: List of songs matching the search text.
+    Long-lived client of the Cyanite GraphQL API shared by all endpoints. Connections are pooled and kept alive
+    (over HTTP/2 if h2 is installed), requests are limited by a token bucket shared by all worker processes
+    (`CYANITE_RATE_LIMIT_RPM`) and every request has bounded timeouts.
+    An HTTP client is created per event loop, since the API, its worker processes and threads and the Gradio app
+    run their own loops.
     """
-    url = 'https://api.cyanite.ai/graphql'
-    headers = {"Authorization": CYANITE_ACCESS_TOKEN}
-    query = """query FreeTextSearchExample {
-    freeTextSearch(
-      first: 10
-      target: { library: {} }
-      searchText: "%s"
-    ) {
+    def __init__(self, access_token: str = CYANITE_ACCESS_TOKEN, url: str = config.CYANITE_GRAPHQL_URL):
+        self.url = url
+        self.headers = {"Authorization": access_token}
+        self._clients = weakref.WeakKeyDictionary()
+        self._rate_limiter = None
+
+    @property
+    def rate_limiter(self) -> RateLimiter:
+        if self._rate_limiter is None:
+            self._rate_limiter = RateLimiter(config.CYANITE_RATE_LIMITER_PATH)
+        return self._rate_limiter
+
+    @property
+    def http(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                http2=HTTP2_AVAILABLE,
+                timeout=httpx.Timeout(config.CYANITE_TIMEOUT, connect=config.CYANITE_CONNECT_TIMEOUT),
+                limits=httpx.Limits(max_connections=config.CYANITE_MAX_CONNECTIONS,
+                                    max_keepalive_connections=config.CYANITE_MAX_CONNECTIONS,
+                                    keepalive_expiry=config.CYANITE_KEEPALIVE_EXPIRY))
+            self._clients[loop] = client
+        return client
+
+    async def post(self, query: str, variables: dict = None, cost: int = 1) -> httpx.Response:
+        """
+        Sends a GraphQL query or mutation.
+
+        Args:
+            query (str): GraphQL document.
+            variables (dict): Values of the variables of the document.
+            cost (int): Number of rate limit tokens the request takes, e.g. the number of searches of a batch.
+
+        Returns:
+            httpx.Response: Response of the API.
+        """
+        await self.rate_limiter.acquire("cyanite:rpm", cost, config.CYANITE_RATE_LIMIT_RPM)
+        data = {"query": query}
+        if variables is not None:
+            data["variables"] = variables
+        return await self.http.post(self.url, json=data, headers=self.headers)
+
+    async def upload(self, upload_url: str, content: bytes, content_type: str) -> httpx.Response:
+        """
+        Uploads a file to a presigned upload URL, with a longer timeout than API requests.
+        """
+        timeout = httpx.Timeout(config.CYANITE_UPLOAD_TIMEOUT, connect=config.CYANITE_CONNECT_TIMEOUT)
+        return await self.http.put(upload_url, content=content, headers={"Content-Type": content_type}, timeout=timeout)
+
+    async def aclose(self) -> None:
+        """
+        Closes the connections of the current event loop.
+        """
+        client = self._clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+
+cyanite_client = CyaniteClient()
+
+
+FREE_TEXT_SEARCH_SELECTION = """{
       ... on FreeTextSearchError {
         message
         code
@@ -35,54 +99,106 @@ async def songsearch(search_text) -> list:
           cursor
           node {
             id
-            title        
+            title
           }
         }
       }
-    }
-    }""" % search_text
+    }"""
 
-    data = {
-        "query": query
-    }
+
+def parse_free_text_search(result: dict | None) -> list:
+    """
+    Returns the tracks of a `freeTextSearch` result, empty if the search failed.
+    """
+    if not result:
+        return []
+    if "edges" not in result:
+        logger.error(f"Free text search failed: {result.get('code')}, {result.get('message')}")
+        return []
+    return [edge['node'] for edge in result['edges']]
+
+
+async def songsearch(search_text) -> list:
+    """
+    Search for songs based on the given text.
+
+    Args:
+        search_text (str): Text to search for.
+
+    Returns:
+        list: List of songs matching the search text.
+    """
+    query = """query FreeTextSearchQuery($searchText: String!) {
+    freeTextSearch(first: 10, target: { library: {} }, searchText: $searchText) %s
+    }""" % FREE_TEXT_SEARCH_SELECTION
 
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, json=data, headers=headers)
-            if response.status_code != 200:
-                return []
-
-            try:
-                data = response.json()
-            except Exception as e:
-                logger.error(f"Error parsing response: {str(e)}")
-                return []
-
-            res = []
-            if data is not None:
-                d = data['data']['freeTextSearch']['edges']
-                for dd in d:
-                    res.append(dd['node'])
-            return res
+        response = await cyanite_client.post(query, {"searchText": search_text})
+        if response.status_code != 200:
+            return []
+
+        try:
+            data = response.json()
+        except Exception as e:
+            logger.error(f"Error parsing response: {str(e)}")
+            return []
+
+        return parse_free_text_search((data.get('data') or {}).get('freeTextSearch'))
     except Exception as e:
         logger.error(f"Error searching for songs: {str(e)}")
         return []
 
 
-async def search_similar_music(client: httpx.AsyncClient, track_id: str, include_original: bool = True) -> list:
+async def songsearch_batch(search_texts: list) -> list:
+    """
+    Search for songs based on several texts in one request: every text is an aliased `freeTextSearch` field
+    of the same GraphQL document.
+
+    Args:
+        search_texts (list): Texts to search for.
+
+    Returns:
+        list: Lists of songs matching each search text, in the same order. Failed searches return empty lists.
+    """
+    if not search_texts:
+        return []
+    variables = {f"searchText{i}": search_text for i, search_text in enumerate(search_texts)}
+    fields = "\n".join(f"search{i}: freeTextSearch(first: 10, target: {{ library: {{}} }}, searchText: $searchText{i}) "
+                       f"{FREE_TEXT_SEARCH_SELECTION}" for i in range(len(search_texts)))
+    query = """query FreeTextSearchBatchQuery(%s) {
+    %s
+    }""" % (", ".join(f"${name}: String!" for name in variables), fields)
+
+    try:
+        # every aliased search counts against the rate limit like a separate request
+        response = await cyanite_client.post(query, variables, cost=len(search_texts))
+        if response.status_code != 200:
+            return [[] for _ in search_texts]
+
+        try:
+            data = response.json()
+        except Exception as e:
+            logger.error(f"Error parsing response: {str(e)}")
+            return [[] for _ in search_texts]
+
+        results = data.get('data') or {}
+        return [parse_free_text_search(results.get(f"search{i}")) for i in range(len(search_texts))]
+    except Exception as e:
+        logger.error(f"Error searching for songs: {str(e)}")
+        return [[] for _ in search_texts]
+
+
+async def search_similar_music(track_id: str, include_original: bool = True) -> list:
     """
     Search for similar music tracks.
 
     Args:
-        client (httpx.AsyncClient): The HTTP client to use for the request.
         track_id (str): ID of the track to find similar tracks for.
         include_original (bool): Whether to include the original track in the results.
 
     Returns:
         list: List of similar tracks.
     """
-    url = 'https://api.cyanite.ai/graphql'
-    headers = {"Authorization": CYANITE_ACCESS_TOKEN}
     query = """query SimilarTracksQuery($trackId: ID!) {
         libraryTrack(id: $trackId) {
             __typename
@@ -115,12 +231,8 @@ async def search_similar_music(client: httpx.AsyncClient, track_id: str, include
         "trackId": track_id
     }
 
-    data = {
-        "query": query,
-        "variables": variables
-    }
     try:
-        response = await client.post(url, json=data, headers=headers)
+        response = await cyanite_client.post(query, variables)
         if response.status_code != 200:
             return []
 
@@ -147,18 +259,13 @@ async def search_similar_music(client: httpx.AsyncClient, track_id: str, include
         return []
 
 
-async def get_file_upload_request(client: httpx.AsyncClient) -> dict | None:
+async def get_file_upload_request() -> dict | None:
     """
     Get the file upload request.
 
-    Args:
-        client (httpx.AsyncClient): The HTTP client to use for the request.
-
     Returns:
         dict: File upload request details.
     """
-    url = 'https://api.cyanite.ai/graphql'
-    headers = {"Authorization": CYANITE_ACCESS_TOKEN}
     query = """mutation FileUploadRequestMutation {
         fileUploadRequest {
             id
@@ -166,11 +273,8 @@ async def get_file_upload_request(client: httpx.AsyncClient) -> dict | None:
         }
     }"""
 
-    data = {
-        "query": query
-    }
     try:
-        response = await client.post(url, json=data, headers=headers)
+        response = await cyanite_client.post(query)
         if response.status_code != 200:
             return None
 
@@ -188,12 +292,11 @@ async def get_file_upload_request(client: httpx.AsyncClient) -> dict | None:
         logger.error(f"Error getting file upload request: {str(e)}")
         return None
 
-async def upload_file(client: httpx.AsyncClient, upload_url: str, file_path: str) -> bool:
+async def upload_file(upload_url: str, file_path: str) -> bool:
     """
     Upload a file.
 
     Args:
-        client (httpx.AsyncClient): The HTTP client to use for the request.
         upload_url (str): URL to upload the file to.
         file_path (str): Path to the file to upload.
 
@@ -204,26 +307,23 @@ async def upload_file(client: httpx.AsyncClient, upload_url: str, file_path: str
         async with aiofiles.open(file_path, 'rb') as file:
             file_data = await file.read()
 
-        response = await client.put(upload_url, content=file_data, headers={"Content-Type": "audio/mpeg"})
+        response = await cyanite_client.upload(upload_url, file_data, "audio/mpeg")
         return response.status_code == 200
     except Exception as e:
         logger.error(f"Error uploading file: {str(e)}")
         return False
 
-async def create_library_track(client: httpx.AsyncClient, upload_id: str, title: str) -> str | None:
+async def create_library_track(upload_id: str, title: str) -> str | None:
     """
     Create a library track.
 
     Args:
-        client (httpx.AsyncClient): The HTTP client to use for the request.
         upload_id (str): ID of the uploaded file.
         title (str): Title of the track.
 
     Returns:
         str: ID of the created library track.
     """
-    url = 'https://api.cyanite.ai/graphql'
-    headers = {"Authorization": CYANITE_ACCESS_TOKEN}
     query = """mutation LibraryTrackCreateMutation($input: LibraryTrackCreateInput!) {
         libraryTrackCreate(input: $input) {
             __typename
@@ -246,13 +346,9 @@ async def create_library_track(client: httpx.AsyncClient, upload_id: str, title:
         }
     }
 
-    data = {
-        "query": query,
-        "variables": variables
-    }
 
     try:
-        response = await client.post(url, json=data, headers=headers)
+        response = await cyanite_client.post(query, variables)
         if response.status_code != 200:
             return None
 
@@ -275,16 +371,13 @@ async def create_library_track(client: httpx.AsyncClient, upload_id: str, title:
         logger.error(f"Error creating library track: {str(e)}")
         return None
 
-async def enqueue_library_track_analysis(client: httpx.AsyncClient, library_track_id: str) -> None:
+async def enqueue_library_track_analysis(library_track_id: str) -> None:
     """
     Enqueue library track analysis.
 
     Args:
-        client (httpx.AsyncClient): The HTTP client to use for the request.
         library_track_id (str): ID of the library track.
     """
-    url = 'https://api.cyanite.ai/graphql'
-    headers = {"Authorization": CYANITE_ACCESS_TOKEN}
     query = """mutation LibraryTrackEnqueueMutation($input: LibraryTrackEnqueueInput!) {
         libraryTrackEnqueue(input: $input) {
             __typename
@@ -309,13 +402,9 @@ async def enqueue_library_track_analysis(client: httpx.AsyncClient, library_trac
         }
     }
 
-    data = {
-        "query": query,
-        "variables": variables
-    }
 
     try:
-        response = await client.post(url, json=data, headers=headers)
+        response = await cyanite_client.post(query, variables)
         if response.status_code != 200:
             return None
 
@@ -343,19 +432,16 @@ async def enqueue_library_track_analysis(client: httpx.AsyncClient, library_trac
         logger.error(f"Error enqueuing library track analysis: {str(e)}")
         return None
 
-async def search_spotify_music(client: httpx.AsyncClient, spotify_track_id: str) -> list:
+async def search_spotify_music(spotify_track_id: str) -> list:
     """
     Search for Spotify music.
 
     Args:
-        client (httpx.AsyncClient): The HTTP client to use for the request.
         spotify_track_id (str): ID of the Spotify track.
 
     Returns:
         list: List of similar tracks.
     """
-    url = 'https://api.cyanite.ai/graphql'
-    headers = {"Authorization": CYANITE_ACCESS_TOKEN}
     query = """query SimilarTracksQuery($trackId: ID!) {
         spotifyTrack(id: $trackId) {
             __typename
@@ -387,13 +473,9 @@ async def search_spotify_music(client: httpx.AsyncClient, spotify_track_id: str)
         "trackId": spotify_track_id
     }
 
-    data = {
-        "query": query,
-        "variables": variables
-    }
 
     try:
-        response = await client.post(url, json=data, headers=headers)
+        response = await cyanite_client.post(query, variables)
         if response.status_code != 200:
             return []
 
@@ -415,20 +497,17 @@ async def search_spotify_music(client: httpx.AsyncClient, spotify_track_id: str)
         logger.error(f"Error searching Spotify music: {str(e)}")
         return []
 
-async def delete_library_tracks(client: httpx.AsyncClient, library_track_ids: list) -> bool:
+async def delete_library_tracks(library_track_ids: list) -> bool:
     """
     Delete library tracks.
 
     Args:
-        client (httpx.AsyncClient): The HTTP client to use for the request.
         library_track_ids (list): List of library track IDs to delete.
 
     Returns:
         bool: True if deletion was successful, False otherwise.
     """
     # print("Deleting library tracks", library_track_ids)
-    url = 'https://api.cyanite.ai/graphql'
-    headers = {"Authorization": CYANITE_ACCESS_TOKEN}
     query = """mutation LibraryTracksDeleteMutation($input: LibraryTracksDeleteInput!) {
         libraryTracksDelete(input: $input) {
             __typename
@@ -448,13 +527,9 @@ async def delete_library_tracks(client: httpx.AsyncClient, library_track_ids: li
         }
     }
 
-    data = {
-        "query": query,
-        "variables": variables
-    }
 
     try:
-        response = await client.post(url, json=data, headers=headers)
+        response = await cyanite_client.post(query, variables)
         if response.status_code != 200:
             return False
 
@@ -489,8 +564,6 @@ async def get_track_title(track_id: str) -> str|None:
     Returns:
         str|None: Title of the track. None if track not found or request failed.
     """
-    url = 'https://api.cyanite.ai/graphql'
-    headers = {"Authorization": CYANITE_ACCESS_TOKEN}
     query = """query LibraryTrackQuery($id: ID!) {
         libraryTrack(id: $id) {
             __typename
@@ -504,15 +577,14 @@ async def get_track_title(track_id: str) -> str|None:
         }
     }"""
     variables = {"id": track_id}
-    async with httpx.AsyncClient() as client:
-        response = await client.post(url, json={'query': query, 'variables': variables}, headers=headers)
-        response_data = response.json()
-        track_data = response_data.get('data', {}).get('libraryTrack', {})
-
-        if track_data.get('__typename') == 'LibraryTrack':
-            return track_data.get('title')
-        elif track_data.get('__typename') == 'LibraryTrackNotFoundError':
-            logger.error(f"Track not found: {track_data.get('message')}")
-        else:
-            logger.error("Unexpected response format.")
+    response = await cyanite_client.post(query, variables)
+    response_data = response.json()
+    track_data = response_data.get('data', {}).get('libraryTrack', {})
+
+    if track_data.get('__typename') == 'LibraryTrack':
+        return track_data.get('title')
+    elif track_data.get('__typename') == 'LibraryTrackNotFoundError':
+        logger.error(f"Track not found: {track_data.get('message')}")
+    else:
+        logger.error("Unexpected response format.")
     return None
\ No newline at end of file
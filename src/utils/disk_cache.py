@@ -0,0 +1,91 @@
+import contextlib
+import os
+import sqlite3
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class DiskCache:
+    """
+    Bounded key-value store on disk (SQLite) with TTL and LRU eviction.
+    Safe to use from several processes: every operation opens its own short-lived connection.
+
+    Args:
+        path (str): Path to the SQLite file.
+        ttl (float): Time to live of an entry in seconds.
+        max_entries (int): Maximum number of entries to keep.
+        max_size_mb (float): Maximum total size of stored values in megabytes.
+    """
+    def __init__(self, path: str, ttl: float, max_entries: int, max_size_mb: float):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_size = int(max_size_mb * 1024 * 1024)
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("""CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )""")
+            connection.execute("CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at)")
+
+    @contextlib.contextmanager
+    def _connect(self):
+        """
+        Opens a connection for one transaction, committed on success and rolled back on errors, and closes it.
+        """
+        with contextlib.closing(sqlite3.connect(self.path, timeout=10)) as connection, connection:
+            yield connection
+
+    def get(self, key: str) -> str | None:
+        """
+        Returns the value stored under the key, or None if there is no value or it has expired.
+        """
+        now = time.time()
+        with self._connect() as connection:
+            row = connection.execute("SELECT value, created_at FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, created_at = row
+            if now - created_at > self.ttl:
+                connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+                return None
+            connection.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key))
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        """
+        Stores the value under the key and evicts expired and least recently used entries if the store is over its limits.
+        """
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute("INSERT OR REPLACE INTO entries (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                               (key, value, len(value.encode('utf-8')), now, now))
+            self._evict(connection, now)
+
+    def delete(self, key: str) -> None:
+        with self._connect() as connection:
+            connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def _evict(self, connection: sqlite3.Connection, now: float) -> None:
+        connection.execute("DELETE FROM entries WHERE created_at < ?", (now - self.ttl,))
+        n_entries, total_size = connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        if n_entries <= self.max_entries and total_size <= self.max_size:
+            return
+
+        evicted = 0
+        for key, size in connection.execute("SELECT key, size FROM entries ORDER BY accessed_at ASC").fetchall():
+            if n_entries <= self.max_entries and total_size <= self.max_size:
+                break
+            connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+            n_entries -= 1
+            total_size -= size
+            evicted += 1
+        logger.info(f"Evicted {evicted} entries from {self.path}")
@@ -5,31 +5,51 @@ from PIL import Image
 from configs.config import KEYFRAMES_DIR
 from typing import Tuple
 import base64
+import json
+import math
 import logging
 import ffmpeg
 import subprocess
 from io import BytesIO
 from src.utils import extract_filename, delete_old_subfolders
+from src.utils.image_budget import plan_frames, fit_for_detail
+
+FRAMES_PLAN_FILENAME = "plan.json"
 
 logger = logging.getLogger(__name__)
 steps_logger = logging.getLogger("steps_info")
 
 
-def extract_frames(video_path: str, n_frames: int, return_collage: bool) -> None | list:
+def extract_frames(video_path: str, n_frames: int, return_collage: bool, image_token_budget: int = 0) -> None | list:
     """
     Extract frames from the video and save keyframes based on the selection method.
 
     Args:
         video_path (str): Path to the input video.
-        n_frames (int): Number of frames to extract.
+        n_frames (int): Number of frames to extract. Maximum number of frames if `image_token_budget` is set.
         return_collage (bool): Whether to return a collage of 4 frames as a single keyframe.
+            Ignored if `image_token_budget` is set.
+        image_token_budget (int): Image token budget of the description request. If set (> 0), the number of frames,
+            collage grid, resolution and detail level are planned to fit into the budget.
     """
     try:
         steps_logger.info(f"Started extracting frames from {video_path}.")
         # Delete old frames before extracting new ones
         delete_old_subfolders(KEYFRAMES_DIR)
 
-        saved_frames = uniform(video_path, n_frames, return_collage=return_collage)
+        if image_token_budget and image_token_budget > 0:
+            width, height, _, duration = probe_video(video_path)
+            n_shots = count_shots(video_path)
+            plan = plan_frames(duration, n_shots, image_token_budget, n_frames, width, height)
+            steps_logger.info(f"Frames plan for {video_path} (duration {duration:.1f}s, {n_shots} shots, "
+                              f"budget {image_token_budget} tokens): {plan}")
+            saved_frames = uniform(video_path, plan["n_frames"], return_collage=plan["grid"] > 1, grid=plan["grid"],
+                                   detail=plan["detail"])
+            save_frames_plan(video_path, plan)
+        else:
+            saved_frames = uniform(video_path, n_frames, return_collage=return_collage)
+            # a plan of a previous budgeted extraction into the same folder doesn't apply to these frames
+            delete_frames_plan(video_path)
 
         steps_logger.info(f"Successfully extracted frames from {video_path}")
         return saved_frames
@@ -71,14 +91,104 @@ def extract_frame_at_timestamp(file_path, timestamp):
     return frame
 
 
-def uniform(file_path: str, n_frames: int, return_collage: bool) -> list:
+def probe_video(file_path: str) -> Tuple[int, int, float, float]:
+    """
+    Get frame size, frame rate and duration of the video using ffmpeg.
+
+    Args:
+        file_path (str): Path to the input video.
+
+    Returns:
+        tuple: Width, height, frame rate and duration (in seconds) of the video.
+    """
+    probe = ffmpeg.probe(file_path)
+    for stream in probe['streams']:
+        if stream['codec_type'] == 'video':
+            frame_width = stream['width']
+            frame_height = stream['height']
+            frame_rate = stream['r_frame_rate'].split('/')
+            frame_rate = int(frame_rate[0]) / int(frame_rate[1])
+            duration = float(stream['duration'])
+    if duration == 0:
+        raise ValueError("Video file is empty")
+    return frame_width, frame_height, frame_rate, duration
+
+
+def count_shots(file_path: str) -> int:
+    """
+    Cheap estimate of the number of shots in the video: the number of keyframes.
+    Encoders place keyframes at scene cuts, and only keyframes are decoded, so this is fast even for long videos.
+
+    Args:
+        file_path (str): Path to the input video.
+
+    Returns:
+        int: Estimated number of shots.
+    """
+    command = [
+        'ffprobe', '-v', 'error',
+        '-skip_frame', 'nokey',
+        '-select_streams', 'v:0',
+        '-show_entries', 'frame=pts_time',
+        '-of', 'csv=p=0',
+        file_path
+    ]
+    try:
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True, text=True)
+        return max(1, len([line for line in result.stdout.splitlines() if line.strip()]))
+    except subprocess.CalledProcessError as e:
+        logger.error(f"Failed to count shots in {file_path}: {e}")
+        return 1
+
+
+def save_frames_plan(video_path: str, plan: dict) -> None:
+    """
+    Saves the frames plan next to the keyframes, so the description step can use the planned detail level.
+    """
+    frames_folder = os.path.join(KEYFRAMES_DIR, extract_filename(video_path))
+    with open(os.path.join(frames_folder, FRAMES_PLAN_FILENAME), 'w') as file:
+        json.dump(plan, file)
+
+
+def delete_frames_plan(video_path: str) -> None:
+    plan_path = os.path.join(KEYFRAMES_DIR, extract_filename(video_path), FRAMES_PLAN_FILENAME)
+    if os.path.exists(plan_path):
+        os.remove(plan_path)
+
+
+def load_frames_plan(video_path: str) -> dict | None:
+    """
+    Loads the frames plan saved by `extract_frames`, if frames were extracted with an image token budget.
+    """
+    plan_path = os.path.join(KEYFRAMES_DIR, extract_filename(video_path), FRAMES_PLAN_FILENAME)
+    if not os.path.exists(plan_path):
+        return None
+    with open(plan_path, 'r') as file:
+        return json.load(file)
+
+
+def make_collage(frames: list, grid: int, frame_width: int, frame_height: int) -> Image.Image:
+    """
+    Pastes up to grid x grid frames into one image, row by row.
+    """
+    columns = min(len(frames), grid)
+    rows = math.ceil(len(frames) / grid)
+    collage_image = Image.new('RGB', (frame_width * columns, frame_height * rows))
+    for idx, frame in enumerate(frames):
+        collage_image.paste(frame, ((idx % grid) * frame_width, (idx // grid) * frame_height))
+    return collage_image
+
+
+def uniform(file_path: str, n_frames: int, return_collage: bool, grid: int = 2, detail: str | None = None) -> list:
     """
     Extract keyframes uniformly from the video using ffmpeg with fast seeking.
 
     Args:
         file_path (str): Path to the input video.
         n_frames (int): Number of frames to extract.
-        return_collage (bool): Whether to return a collage of 4 frames as a single keyframe.
+        return_collage (bool): Whether to return a collage of grid x grid frames as a single keyframe.
+        grid (int): Number of frames per row and column of a collage.
+        detail (str | None): If set, keyframes are downscaled to the size the vision model uses for this detail level.
 
     Returns:
         list: List of paths to extracted keyframes.
@@ -87,17 +197,15 @@ def uniform(file_path: str, n_frames: int, return_collage: bool) -> list:
         output_folder = os.path.join(KEYFRAMES_DIR, extract_filename(file_path))
         os.makedirs(output_folder, exist_ok=True)
 
-        # Get total number of frames and duration using ffmpeg
-        probe = ffmpeg.probe(file_path)
-        for stream in probe['streams']:
-            if stream['codec_type'] == 'video':
-                frame_width = stream['width']
-                frame_height = stream['height']
-                frame_rate = stream['r_frame_rate'].split('/')
-                frame_rate = int(frame_rate[0]) / int(frame_rate[1])
-                duration = float(stream['duration'])
-        if duration == 0:
-            raise ValueError("Video file is empty")
+        frame_width, frame_height, frame_rate, duration = probe_video(file_path)
+        frames_per_collage = grid * grid
+
+        def save_keyframe(image, index):
+            if detail is not None:
+                image = image.resize(fit_for_detail(image.width, image.height, detail), Image.LANCZOS)
+            output_path = os.path.join(output_folder, f'keyframe{index}.jpg')
+            image.save(output_path)
+            saved_frames.append(output_path)
 
 
         step_size = duration / n_frames
@@ -130,44 +238,21 @@ def uniform(file_path: str, n_frames: int, return_collage: bool) -> list:
                     continue
             
             if not return_collage:
-                output_filename = f'keyframe{extracted_frames + 1}.jpg'
-                output_path = os.path.join(output_folder, output_filename)
-                frame.save(output_path)
-                saved_frames.append(output_path)
+                save_keyframe(frame, extracted_frames + 1)
                 extracted_frames += 1
             
             else:
                 collage_frames.append(frame)
-                if len(collage_frames) == 4:
-                    collage_image = Image.new('RGB', (frame_width * 2, frame_height * 2))
-
-                    collage_image.paste(collage_frames[0], (0, 0))
-                    collage_image.paste(collage_frames[1], (frame_width, 0))
-                    collage_image.paste(collage_frames[2], (0, frame_height))
-                    collage_image.paste(collage_frames[3], (frame_width, frame_height))
-
-                    output_filename = f'keyframe{extracted_frames // 4 + 1}.jpg'
-                    output_path = os.path.join(output_folder, output_filename)
-                    collage_image.save(output_path)
-                    saved_frames.append(output_path)
-                    extracted_frames += 4
+                if len(collage_frames) == frames_per_collage:
+                    collage_image = make_collage(collage_frames, grid, frame_width, frame_height)
+                    save_keyframe(collage_image, extracted_frames // frames_per_collage + 1)
+                    extracted_frames += frames_per_collage
                     collage_frames = []
                 
-        # Save any remaining frames if they are less than 4
+        # Save any remaining frames if they are less than grid x grid
         if collage_frames:
-            new_frame_width = {1: frame_width, 2: frame_width * 2, 3: frame_width * 2}
-            new_frame_height = {1: frame_height, 2: frame_height, 3: frame_height * 2}
-            collage_image = Image.new('RGB', (new_frame_width[len(collage_frames)], new_frame_height[len(collage_frames)]))
-
-            for idx, frame in enumerate(collage_frames):
-                x = (idx % 2) * frame_width
-                y = (idx // 2) * frame_height
-                collage_image.paste(frame, (x, y))
-
-            output_filename = f'keyframe{extracted_frames // 4 + 1}.jpg'
-            output_path = os.path.join(output_folder, output_filename)
-            collage_image.save(output_path)
-            saved_frames.append(output_path)
+            collage_image = make_collage(collage_frames, grid, frame_width, frame_height)
+            save_keyframe(collage_image, extracted_frames // frames_per_collage + 1)
             extracted_frames += len(collage_frames)
 
         return saved_frames
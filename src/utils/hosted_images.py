@@ -0,0 +1,52 @@
+import json
+import logging
+import os
+import time
+from src.utils.frame_detection import encode_image
+
+logger = logging.getLogger(__name__)
+
+URLS_MANIFEST_FILENAME = "urls.json"
+# URLs that expire sooner than this are not used, so the model can still download the image
+URL_EXPIRATION_MARGIN = 60
+
+
+def save_urls_manifest(folder: str, urls: dict, expires_in: int) -> None:
+    """
+    Saves hosted URLs of the images in the folder.
+
+    Args:
+        folder (str): Folder with the images.
+        urls (dict): Mapping of image file names to their URLs.
+        expires_in (int): Number of seconds the URLs are valid for.
+    """
+    with open(os.path.join(folder, URLS_MANIFEST_FILENAME), 'w') as file:
+        json.dump({"expires_at": time.time() + expires_in, "urls": urls}, file)
+
+
+def load_urls_manifest(folder: str) -> dict:
+    """
+    Loads hosted URLs of the images in the folder.
+
+    Returns:
+        dict: Mapping of image file names to their URLs. Empty if there is no manifest or the URLs expire soon.
+    """
+    manifest_path = os.path.join(folder, URLS_MANIFEST_FILENAME)
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, 'r') as file:
+        manifest = json.load(file)
+    if manifest["expires_at"] - URL_EXPIRATION_MARGIN < time.time():
+        logger.warning(f"Hosted image URLs in {folder} expired, sending images inline.")
+        return {}
+    return manifest["urls"]
+
+
+def image_url_content(image_path: str, detail: str, urls: dict) -> dict:
+    """
+    Builds the image message content: the hosted URL of the image if there is one, otherwise the inline base64 image.
+    """
+    url = urls.get(os.path.basename(image_path))
+    if url is None:
+        url = f"data:image/jpeg;base64,{encode_image(image_path)}"
+    return {'type': 'image_url', 'image_url': {"url": url, "detail": detail}}
@@ -0,0 +1,91 @@
+import math
+import logging
+from configs import config
+
+logger = logging.getLogger(__name__)
+
+LOW_DETAIL_TOKENS = 85
+HIGH_DETAIL_TILE_TOKENS = 170
+LOW_DETAIL_MAX_SIDE = 512
+# (grid, detail) layouts from the most to the least detailed view of a single frame
+LAYOUTS = [(1, "high"), (2, "high"), (1, "low"), (2, "low"), (3, "low")]
+
+
+def fit_for_detail(width: int, height: int, detail: str) -> tuple[int, int]:
+    """
+    Returns the size the vision model scales an image to for the given detail level.
+    Sending images larger than that only increases the payload.
+
+    Args:
+        width (int): Width of the image.
+        height (int): Height of the image.
+        detail (str): "low" or "high".
+
+    Returns:
+        tuple: Width and height of the image as seen by the model.
+    """
+    if detail == "low":
+        scale = min(1.0, LOW_DETAIL_MAX_SIDE / max(width, height))
+    else:
+        scale = min(1.0, 2048 / max(width, height))
+        if min(width, height) * scale > 768:
+            scale *= 768 / (min(width, height) * scale)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def image_tokens(width: int, height: int, detail: str) -> int:
+    """
+    Estimates the number of input tokens of an image for OpenAI vision models.
+
+    Args:
+        width (int): Width of the image.
+        height (int): Height of the image.
+        detail (str): "low" or "high".
+
+    Returns:
+        int: Number of tokens.
+    """
+    if detail == "low":
+        return LOW_DETAIL_TOKENS
+    width, height = fit_for_detail(width, height, "high")
+    tiles = math.ceil(width / 512) * math.ceil(height / 512)
+    return LOW_DETAIL_TOKENS + HIGH_DETAIL_TILE_TOKENS * tiles
+
+
+def plan_frames(duration: float, n_shots: int, token_budget: int, max_frames: int,
+                frame_width: int, frame_height: int) -> dict:
+    """
+    Chooses the number of frames, collage grid and detail level that fit into the image token budget.
+    Roughly one frame per shot is taken (bounded by `max_frames` and the duration of the video),
+    then the most detailed layout that fits into the budget is chosen.
+    If no layout fits, the number of frames is reduced to fit into 3x3 low detail collages.
+
+    Args:
+        duration (float): Duration of the video in seconds.
+        n_shots (int): Number of shots in the video.
+        token_budget (int): Maximum number of image tokens per request.
+        max_frames (int): Maximum number of frames to extract.
+        frame_width (int): Width of the video frames.
+        frame_height (int): Height of the video frames.
+
+    Returns:
+        dict: The plan with `n_frames`, `grid`, `detail`, `width`, `height` (size of each image),
+            `n_images` and `estimated_tokens`.
+    """
+    n_frames = max(config.FRAME_PLANNER_MIN_FRAMES, n_shots)
+    n_frames = min(n_frames, max_frames, max(1, math.ceil(duration / config.FRAME_PLANNER_MIN_SECONDS_PER_FRAME)))
+
+    def layout_plan(grid, detail, n_frames):
+        width, height = fit_for_detail(frame_width * min(grid, n_frames), frame_height * min(grid, math.ceil(n_frames / grid)), detail)
+        n_images = math.ceil(n_frames / grid ** 2)
+        return {"n_frames": n_frames, "grid": grid, "detail": detail, "width": width, "height": height,
+                "n_images": n_images, "estimated_tokens": n_images * image_tokens(width, height, detail)}
+
+    for grid, detail in LAYOUTS:
+        plan = layout_plan(grid, detail, n_frames)
+        if plan["estimated_tokens"] <= token_budget:
+            return plan
+
+    grid, detail = LAYOUTS[-1]
+    n_images = max(1, token_budget // LOW_DETAIL_TOKENS)
+    return layout_plan(grid, detail, min(n_frames, n_images * grid ** 2))
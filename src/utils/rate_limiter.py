@@ -0,0 +1,66 @@
+import asyncio
+import contextlib
+import os
+import sqlite3
+import time
+
+
+class RateLimiter:
+    """
+    Token buckets shared by all worker processes through a SQLite file.
+    Each bucket is refilled continuously up to its capacity, e.g. a 500 RPM limit is a bucket
+    of capacity 500 refilled with 500 / 60 tokens per second.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with contextlib.closing(sqlite3.connect(self.path, timeout=10)) as connection, connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("""CREATE TABLE IF NOT EXISTS buckets (
+                name TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )""")
+
+    def try_acquire(self, name: str, amount: float, capacity: float) -> float:
+        """
+        Takes `amount` tokens from the bucket if there are enough of them.
+
+        Returns:
+            float: 0 if the tokens were taken, otherwise the number of seconds to wait before trying again.
+        """
+        refill_rate = capacity / 60
+        amount = min(amount, capacity)
+        connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            row = connection.execute("SELECT tokens, updated_at FROM buckets WHERE name = ?", (name,)).fetchone()
+            tokens = capacity if row is None else min(capacity, row[0] + (now - row[1]) * refill_rate)
+            if tokens >= amount:
+                tokens -= amount
+                wait = 0.0
+            else:
+                wait = (amount - tokens) / refill_rate
+            connection.execute("INSERT OR REPLACE INTO buckets (name, tokens, updated_at) VALUES (?, ?, ?)", (name, tokens, now))
+            connection.execute("COMMIT")
+            return wait
+        except Exception:
+            # BEGIN IMMEDIATE may have failed (e.g. the database stayed locked), then there is nothing to roll back
+            if connection.in_transaction:
+                connection.execute("ROLLBACK")
+            raise
+        finally:
+            connection.close()
+
+    async def acquire(self, name: str, amount: float, capacity: float) -> float:
+        """
+        Waits until `amount` tokens can be taken from the bucket.
+
+        Returns:
+            float: Time spent waiting in seconds.
+        """
+        start = time.perf_counter()
+        while (wait := await asyncio.to_thread(self.try_acquire, name, amount, capacity)) > 0:
+            await asyncio.sleep(min(wait, 5))
+        return time.perf_counter() - start
@@ -21,6 +21,14 @@ response = requests.post(url)
 # response = requests.post(url, json=params)
 # ==========================================
 
+# ========== SEARCH FROM SEVERAL KEYWORD SETS ==========
+# url = "http://127.0.0.1:5011/search_music_weighted_batch"
+# params = [{'whimsical': 1.0, 'playful': 1.0, 'quirky': 1.0},
+#           {'calm': 1.0, 'dreamy': 2.0, 'warm': 1.0},
+#           {'epic': 1.0, 'triumphant': 1.0, "rock 'n' roll": 1.0}]
+# response = requests.post(url, json=params)
+# ======================================================
+
 # ========== SEARCH FROM TEXT ==========
 # url = "http://127.0.0.1:5011/search_music_text/?text_input=energetic"
 # response = requests.post(url)